@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Expense, UserCategory, UserSubcategory
+from .models import Expense, ImportJob, UserCategory, UserSubcategory
+from .search import search_expenses, uses_fts
 
 @admin.register(UserCategory)
 class UserCategoryAdmin(admin.ModelAdmin):
@@ -19,9 +20,25 @@ class UserSubcategoryAdmin(admin.ModelAdmin):
 class ExpenseAdmin(admin.ModelAdmin):
     list_display = ('user', 'date', 'vendor', 'amount', 'category', 'subcategory', 'exclude')
     list_filter = ('user', 'date', 'category', 'exclude')
+    # On SQLite full-text hits are added as well, see get_search_results
     search_fields = ('vendor', 'notes', 'user__username')
-    list_select_related = ('user',)
+    list_select_related = ('user', 'category', 'subcategory')
+    raw_id_fields = ('category', 'subcategory')
     
     def get_queryset(self, request):
         # Admin can see all expenses, but regular users will be filtered in views
-        return super().get_queryset(request)
\ No newline at end of file
+        return super().get_queryset(request)
+    
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term and uses_fts(queryset):
+            # Word-prefix matches from the full-text index, besides the usernames and substrings
+            results = results | search_expenses(queryset, search_term)
+        return results, may_have_duplicates
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'filename', 'status', 'rows_processed', 'created_count', 'updated_count', 'skipped_count', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('filename', 'user__username')
+    list_select_related = ('user',)
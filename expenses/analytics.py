@@ -0,0 +1,172 @@
+"""
+Time series of expense totals for the chart page.
+
+All aggregation happens in the database over ExpenseRollup rows, so the
+cost depends on the number of days (or months) and groups in the range,
+not on the number of expenses. Python only pivots the aggregated rows
+into zero-filled series. abuild_series()/aget_series() run the same queries
+through the async ORM for async views.
+"""
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Concat, TruncMonth, TruncWeek
+
+from .cache import aversioned_key, versioned_key
+from .models import ExpenseRollup, UserCategory, UserSubcategory
+from .utils import add_months
+
+GRANULARITIES = ('day', 'week', 'month')
+GROUP_BY = ('category', 'subcategory', 'flags', 'none')
+ANALYTICS_TIMEOUT = 60 * 60
+
+FLAG_LABELS = {
+    (False, False): 'Unflagged',
+    (True, False): 'Indispensable',
+    (False, True): 'Avoidable',
+    (True, True): 'Indispensable + Avoidable',
+}
+
+
+def bucket_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def iter_buckets(start, end, granularity):
+    """Every bucket start between start and end (inclusive), so series can be zero-filled"""
+    current = bucket_start(start, granularity)
+    while current <= end:
+        yield current
+        if granularity == 'day':
+            current += timedelta(days=1)
+        elif granularity == 'week':
+            current += timedelta(weeks=1)
+        else:
+            current = date(*add_months(current.year, current.month, 1), 1)
+
+
+def _rollups(user, start, end, granularity):
+    """Rollup rows for [start, end] annotated with a `bucket` date, using month rows when possible"""
+    next_day = end + timedelta(days=1)
+    if granularity == 'month' and start.day == 1 and next_day.day == 1:
+        # Whole months: the monthly rollups already hold the answer
+        return ExpenseRollup.objects.filter(
+            user=user, period=ExpenseRollup.PERIOD_MONTH, period_start__gte=start, period_start__lt=next_day
+        ).annotate(bucket=TruncMonth('period_start'))
+
+    rows = ExpenseRollup.objects.filter(
+        user=user, period=ExpenseRollup.PERIOD_DAY, period_start__gte=start, period_start__lt=next_day
+    )
+    if granularity == 'week':
+        return rows.annotate(bucket=TruncWeek('period_start'))
+    if granularity == 'month':
+        return rows.annotate(bucket=TruncMonth('period_start'))
+    return rows.annotate(bucket=F('period_start'))
+
+
+def _group_fields(group_by):
+    if group_by == 'flags':
+        return ['indispensable', 'avoidable']
+    if group_by == 'none':
+        return []
+    # Group on the integer foreign key, names are looked up once afterwards
+    return [f'{group_by}_id']
+
+
+def _aggregate(user, start, end, granularity, group_by, include_excluded):
+    rows = _rollups(user, start, end, granularity)
+    if not include_excluded:
+        rows = rows.filter(exclude=False)
+    return rows.order_by().values('bucket', *_group_fields(group_by)).annotate(
+        total=Sum('total'), count=Sum('count')
+    )
+
+
+def _names(group_by, aggregated):
+    """
+    Queryset of (id, label) for the categories or subcategories in the rows,
+    or None. Subcategories are labelled "Category > Subcategory", since the
+    same name can be used under several categories.
+    """
+    if group_by not in ('category', 'subcategory'):
+        return None
+    ids = {row[f'{group_by}_id'] for row in aggregated} - {None}
+    if group_by == 'category':
+        return UserCategory.objects.filter(id__in=ids).values_list('id', 'name')
+    return UserSubcategory.objects.filter(id__in=ids).values_list(
+        'id', Concat('category__name', Value(' > '), 'name')
+    )
+
+
+def build_series(user, start, end, granularity='month', group_by='category', include_excluded=False):
+    aggregated = list(_aggregate(user, start, end, granularity, group_by, include_excluded))
+    names = _names(group_by, aggregated)
+    names = dict(names) if names is not None else {}
+    return _pivot(aggregated, names, start, end, granularity, group_by, include_excluded)
+
+
+async def abuild_series(user, start, end, granularity='month', group_by='category', include_excluded=False):
+    """build_series() through the async ORM"""
+    aggregated = [row async for row in _aggregate(user, start, end, granularity, group_by, include_excluded)]
+    names = _names(group_by, aggregated)
+    names = {pk: name async for pk, name in names} if names is not None else {}
+    return _pivot(aggregated, names, start, end, granularity, group_by, include_excluded)
+
+
+def _pivot(aggregated, names, start, end, granularity, group_by, include_excluded):
+    """Zero-filled series per group from the aggregated rollup rows"""
+    group_fields = _group_fields(group_by)
+    buckets = list(iter_buckets(start, end, granularity))
+    index = {bucket: i for i, bucket in enumerate(buckets)}
+    series = {}
+    for row in aggregated:
+        if group_by == 'flags':
+            key = name = FLAG_LABELS[(row['indispensable'], row['avoidable'])]
+        elif group_by == 'none':
+            key = name = 'Total'
+        else:
+            # Keyed by id, so groups sharing a name stay apart
+            key = row[group_fields[0]]
+            name = names.get(key) or '(none)'
+        entry = series.setdefault(key, {'name': name, 'totals': [0.0] * len(buckets), 'counts': [0] * len(buckets)})
+        i = index[row['bucket']]
+        entry['totals'][i] = round(entry['totals'][i] + float(row['total'] or 0), 2)
+        entry['counts'][i] += row['count'] or 0
+
+    ordered = sorted(series.values(), key=lambda s: -sum(s['totals']))
+    totals = [round(sum(s['totals'][i] for s in ordered), 2) for i in range(len(buckets))]
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'granularity': granularity,
+        'group_by': group_by,
+        'include_excluded': include_excluded,
+        'periods': [bucket.isoformat() for bucket in buckets],
+        'series': ordered,
+        'totals': totals,
+        'grand_total': round(sum(totals), 2),
+    }
+
+
+def get_series(user, start, end, granularity='month', group_by='category', include_excluded=False):
+    """build_series() cached per user, range and options until the user's data changes"""
+    key = versioned_key(user, 'analytics', start, end, granularity, group_by, include_excluded)
+    data = cache.get(key)
+    if data is None:
+        data = build_series(user, start, end, granularity, group_by, include_excluded)
+        cache.set(key, data, ANALYTICS_TIMEOUT)
+    return data
+
+
+async def aget_series(user, start, end, granularity='month', group_by='category', include_excluded=False):
+    key = await aversioned_key(user, 'analytics', start, end, granularity, group_by, include_excluded)
+    data = await cache.aget(key)
+    if data is None:
+        data = await abuild_series(user, start, end, granularity, group_by, include_excluded)
+        await cache.aset(key, data, ANALYTICS_TIMEOUT)
+    return data
@@ -0,0 +1,171 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Requests are sent straight to Django's WSGI or ASGI handler in the current
+process, with a session cookie created for the benchmark user, so they pass
+through the whole middleware stack without a server or network in between.
+"""
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connections
+
+
+def create_session(user):
+    """A saved session for user, as the login view would create it"""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session
+
+
+def session_cookie(session):
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def _split(path):
+    parts = urlsplit(path)
+    return parts.path, parts.query
+
+
+def wsgi_get(application, path, host, cookie):
+    """Send a GET through a WSGI application; returns (status code, body size in bytes)"""
+    path_info, query = _split(path)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path_info,
+        'QUERY_STRING': query,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'HTTP_COOKIE': cookie,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    size = 0
+    body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        for chunk in body:
+            size += len(chunk)
+    finally:
+        # Sends request_finished, which closes the thread's database connection
+        body.close()
+    return int(status[0].split()[0]), size
+
+
+class WSGIRunner:
+    """Calls the WSGI application from a fixed pool of threads"""
+
+    def __init__(self, application, host, cookie, threads):
+        self.application = application
+        self.host = host
+        self.cookie = cookie
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    def request(self, path):
+        status, _ = wsgi_get(self.application, path, self.host, self.cookie)
+        return status == 200
+
+    def timed_request(self, path):
+        # The worker pool caps how many requests are served at once; the rest
+        # wait for a free thread as they would in a server's backlog, and that
+        # wait counts towards their latency
+        started = time.perf_counter()
+        ok = self.pool.submit(self.request, path).result()
+        return time.perf_counter() - started, ok
+
+    def run(self, path, count, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            results = list(clients.map(lambda _: self.timed_request(path), range(count)))
+        return summarize(started, results)
+
+    def close(self):
+        self.pool.shutdown()
+        connections.close_all()
+
+
+class ASGIRunner:
+    """Drives the ASGI application on an event loop with `concurrency` requests in flight"""
+
+    def __init__(self, application, host, cookie):
+        self.application = application
+        self.host = host.encode()
+        self.cookie = cookie.encode()
+
+    async def request(self, path):
+        path_info, query = _split(path)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path_info,
+            'raw_path': path_info.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', self.host), (b'cookie', self.cookie)],
+            'client': ('127.0.0.1', 0),
+            'server': (self.host.decode(), 80),
+        }
+        sent_body = False
+        disconnected = asyncio.Event()
+        status = []
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await self.application(scope, receive, send)
+        disconnected.set()
+        return time.perf_counter() - started, status[0] == 200
+
+    async def _run(self, path, count, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                return await self.request(path)
+
+        return await asyncio.gather(*(limited() for _ in range(count)))
+
+    def run(self, path, count, concurrency):
+        started = time.perf_counter()
+        results = asyncio.run(self._run(path, count, concurrency))
+        return summarize(started, results)
+
+
+def summarize(started, results):
+    """(elapsed seconds, latencies, error count) of a round of (latency, ok) results"""
+    elapsed = time.perf_counter() - started
+    latencies = [latency for latency, ok in results]
+    errors = sum(1 for latency, ok in results if not ok)
+    return elapsed, latencies, errors
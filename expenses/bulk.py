@@ -0,0 +1,56 @@
+"""
+Bulk changes to many expenses at once.
+
+Each operation is a single UPDATE or DELETE over a user-scoped queryset,
+run in one transaction together with the rollup adjustment. The rollup
+and vendor-count deltas are computed from GROUP BYs over the affected
+rows, so the cost does not depend on per-row signals.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_data_version_on_commit
+from .categorizer import apply_vendor_deltas, collect_vendor_deltas, group_for_vendors
+from .rollups import apply_deltas, collect_group_deltas, group_for_rollups
+
+# Fields that can be changed in bulk, by attribute name
+BULK_FIELDS = ('category_id', 'subcategory_id', 'exclude', 'indispensable', 'avoidable')
+
+
+def bulk_update_expenses(user, queryset, changes):
+    """Apply `changes` (BULK_FIELDS -> value) to the user's expenses in queryset, returning the row count"""
+    unknown = set(changes) - set(BULK_FIELDS)
+    if unknown:
+        raise ValueError(f'Fields cannot be changed in bulk: {", ".join(sorted(unknown))}')
+    queryset = queryset.filter(user=user).order_by()
+    recategorized = {'category_id', 'subcategory_id'} & set(changes)
+    with transaction.atomic():
+        groups = group_for_rollups(queryset)
+        vendors = group_for_vendors(queryset) if recategorized else []
+        updated = queryset.update(updated_at=timezone.now(), **changes)
+        deltas = collect_group_deltas(groups, sign=-1)
+        collect_group_deltas(groups, changes=changes, deltas=deltas)
+        apply_deltas(user.pk, deltas)
+        if vendors:
+            vendor_deltas = collect_vendor_deltas(vendors, sign=-1)
+            collect_vendor_deltas(vendors, changes=changes, deltas=vendor_deltas)
+            apply_vendor_deltas(user.pk, vendor_deltas)
+    if updated:
+        bump_data_version_on_commit(user)
+    return updated
+
+
+def bulk_delete_expenses(user, queryset):
+    """Delete the user's expenses in queryset, returning the row count"""
+    queryset = queryset.filter(user=user).order_by()
+    with transaction.atomic():
+        groups = group_for_rollups(queryset)
+        vendors = group_for_vendors(queryset)
+        # QuerySet.delete() would load every row to send the per-row signals;
+        # nothing references expenses, so delete with one statement instead
+        deleted = queryset._raw_delete(queryset.db)
+        apply_deltas(user.pk, collect_group_deltas(groups, sign=-1))
+        apply_vendor_deltas(user.pk, collect_vendor_deltas(vendors, sign=-1))
+    if deleted:
+        bump_data_version_on_commit(user)
+    return deleted
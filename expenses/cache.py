@@ -0,0 +1,228 @@
+"""
+Per-user caching of derived expense data.
+
+Every user has a data version stored in the cache. Cached entries embed the
+version in their key, so bumping it (on any write to the user's expenses)
+makes all of them unreachable at once without having to find and delete
+them. A bump writes a fresh random token rather than incrementing: incr is
+a get-then-set on the file and database caches, so two concurrent bumps
+could leave one write behind, and a version key lost to eviction can never
+come back as an older value.
+
+Calendar fragments and snapshot refreshes use a finer version per user and
+month instead, bumped only when an expense dated in that month is written
+(through the rollups, which every write path updates), so other months stay
+cached.
+
+The a-prefixed functions are the same lookups for async views, going
+through the cache's async API.
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from .models import Expense, UserCategory, UserSubcategory
+
+VERSION_KEY = 'expenses:version:{user_id}'
+MODIFIED_KEY = 'expenses:modified:{user_id}'
+CATEGORIES_KEY = 'expenses:categories:{user_id}'
+MONTH_VERSION_KEY = 'expenses:month-version:{user_id}:{month}'
+SUMMARY_TIMEOUT = 60 * 60 * 24
+
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def get_data_version(user):
+    """Current data version for a user (a user object or id)"""
+    key = VERSION_KEY.format(user_id=_user_id(user))
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        # add() so two concurrent first reads agree on one value
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_data_version(user):
+    key = VERSION_KEY.format(user_id=_user_id(user))
+    version = await cache.aget(key)
+    if version is None:
+        version = _new_version()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_data_version(user):
+    """Invalidate everything cached for a user"""
+    user_id = _user_id(user)
+    cache.set(MODIFIED_KEY.format(user_id=user_id), time.time(), None)
+    version = _new_version()
+    cache.set(VERSION_KEY.format(user_id=user_id), version, None)
+    return version
+
+
+def bump_data_version_on_commit(user):
+    """
+    bump_data_version once the current transaction commits (right away
+    outside one), so a concurrent reader cannot cache the old data under
+    the new version, and a rollback bumps nothing
+    """
+    user_id = _user_id(user)
+    transaction.on_commit(lambda: bump_data_version(user_id))
+
+
+def _month_version_keys(user, months):
+    user_id = _user_id(user)
+    return {first: MONTH_VERSION_KEY.format(user_id=user_id, month=f'{first:%Y-%m}') for first in months}
+
+
+def get_month_versions(user, months):
+    """{first day: version} for months given by their first day"""
+    keys = _month_version_keys(user, months)
+    found = cache.get_many(keys.values())
+    versions = {}
+    for first, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _new_version()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[first] = version
+    return versions
+
+
+async def aget_month_versions(user, months):
+    keys = _month_version_keys(user, months)
+    found = await cache.aget_many(keys.values())
+    versions = {}
+    for first, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _new_version()
+            if not await cache.aadd(key, version, None):
+                version = await cache.aget(key, version)
+        versions[first] = version
+    return versions
+
+
+def bump_month_versions(user, months):
+    """Invalidate what is cached for the given months (first days) of a user"""
+    # A fresh token per month rather than incr, for the same reason as bump_data_version
+    cache.set_many({key: _new_version() for key in _month_version_keys(user, months).values()}, None)
+
+
+def get_last_modified(user):
+    """Time of the user's last expense write as a UTC datetime, if known"""
+    timestamp = cache.get(MODIFIED_KEY.format(user_id=_user_id(user)))
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+async def aget_last_modified(user):
+    timestamp = await cache.aget(MODIFIED_KEY.format(user_id=_user_id(user)))
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _versioned_key(user, name, version, parts):
+    key = f'expenses:{name}:{_user_id(user)}:{version}'
+    if parts:
+        digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+        key = f'{key}:{digest}'
+    return key
+
+
+def versioned_key(user, name, *parts):
+    """Cache key for `name` that changes whenever the user's data changes"""
+    return _versioned_key(user, name, get_data_version(user), parts)
+
+
+async def aversioned_key(user, name, *parts):
+    return _versioned_key(user, name, await aget_data_version(user), parts)
+
+
+def get_user_summary(user):
+    """
+    Stats for a user's whole expense set: count, total, min/max amount and
+    the distinct categories and subcategories used.
+    """
+    key = versioned_key(user, 'summary')
+    summary = cache.get(key)
+    if summary is None:
+        queryset = Expense.objects.for_user(user)
+        summary = queryset.aggregate(
+            count=Count('id'),
+            total=Sum('amount'),
+            min_amount=Min('amount'),
+            max_amount=Max('amount'),
+        )
+        summary['categories'] = list(
+            queryset.values_list('category__name', flat=True).distinct().order_by('category__name')
+        )
+        summary['subcategories'] = list(
+            queryset.filter(subcategory__isnull=False).values_list(
+                'subcategory__name', flat=True
+            ).distinct().order_by('subcategory__name')
+        )
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+def get_filtered_totals(user, queryset, params):
+    """Count and total of a filtered queryset, cached per filter parameters"""
+    key = versioned_key(user, 'totals', sorted(params.items()))
+    totals = cache.get(key)
+    if totals is None:
+        totals = queryset.aggregate(total=Sum('amount'), count=Count('id'))
+        cache.set(key, totals, SUMMARY_TIMEOUT)
+    return totals
+
+
+def get_category_tree(user):
+    """
+    A user's categories and subcategories as {'categories': [(id, name)],
+    'subcategories': {category_id: [(id, name)]}}, sorted by name. Cached
+    until a category or subcategory of the user is saved or deleted.
+    """
+    key = CATEGORIES_KEY.format(user_id=_user_id(user))
+    tree = cache.get(key)
+    if tree is None:
+        user_id = _user_id(user)
+        tree = {
+            'categories': list(UserCategory.objects.filter(user_id=user_id).order_by('name').values_list('id', 'name')),
+            'subcategories': {},
+        }
+        for category_id, subcategory_id, name in UserSubcategory.objects.filter(user_id=user_id).order_by(
+            'name'
+        ).values_list('category_id', 'id', 'name'):
+            tree['subcategories'].setdefault(category_id, []).append((subcategory_id, name))
+        cache.set(key, tree, SUMMARY_TIMEOUT)
+    return tree
+
+
+def get_subcategory_choices(user, category_name):
+    """[(id, name)] of the subcategories under the user's category called category_name"""
+    tree = get_category_tree(user)
+    for category_id, name in tree['categories']:
+        if name == category_name:
+            return tree['subcategories'].get(category_id, [])
+    return []
+
+
+def invalidate_categories(user):
+    cache.delete(CATEGORIES_KEY.format(user_id=_user_id(user)))
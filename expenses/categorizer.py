@@ -0,0 +1,184 @@
+"""
+Learned vendor -> category suggestions.
+
+VendorCategory counts, per user, how many expenses of each normalized
+vendor name were filed under each category/subcategory. Every vendor also
+counts towards its leading-token prefixes ("esselunga via roma" towards
+"esselunga via" and "esselunga"), so a new branch of a known shop still
+finds a match. A lookup tries the full name first, then shorter prefixes,
+which is at most MAX_PREFIX_TOKENS + 1 dictionary lookups per vendor.
+
+The counts are kept up to date the same way as the rollups: writes turn
+into signed deltas that are added to the stored rows.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Expense, VendorCategory
+
+MAX_PREFIX_TOKENS = 3
+
+# Expense fields a vendor count is keyed by
+VENDOR_FIELDS = ('vendor', 'category_id', 'subcategory_id')
+
+
+def normalize_vendor(name):
+    """Lowercase, accents and punctuation removed, numbers dropped, single spaces"""
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char)).lower()
+    tokens = [token for token in re.split(r'[\W_]+', name) if token and not token.isdigit()]
+    return ' '.join(tokens)
+
+
+def vendor_keys(name):
+    """Index keys for a vendor, most specific first"""
+    tokens = normalize_vendor(name).split()
+    if not tokens:
+        return []
+    keys = [' '.join(tokens)]
+    for length in range(min(len(tokens) - 1, MAX_PREFIX_TOKENS), 0, -1):
+        keys.append(' '.join(tokens[:length]))
+    return keys
+
+
+def _get(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def collect_vendor_deltas(rows, sign=1, deltas=None, changes=None):
+    """
+    Add the vendor counts of `rows` (Expense instances, value dicts, or
+    grouped dicts with a `count`) to `deltas`, a mapping of
+    (key, category_id, subcategory_id) -> count. `changes` overrides
+    category_id/subcategory_id, as for a bulk update.
+    """
+    if deltas is None:
+        deltas = defaultdict(int)
+    changes = changes or {}
+    for row in rows:
+        category_id = changes.get('category_id', _get(row, 'category_id'))
+        subcategory_id = changes.get('subcategory_id', _get(row, 'subcategory_id'))
+        count = row.get('count', 1) if isinstance(row, dict) else 1
+        for key in vendor_keys(_get(row, 'vendor')):
+            deltas[(key, category_id, subcategory_id)] += sign * count
+    return deltas
+
+
+def group_for_vendors(queryset):
+    """Expense count of a queryset per vendor, category and subcategory"""
+    return list(queryset.order_by().values(*VENDOR_FIELDS).annotate(count=Count('id')))
+
+
+def apply_vendor_deltas(user_id, deltas):
+    """Add collected deltas to the user's vendor counts"""
+    changes = {key: count for key, count in deltas.items() if count}
+    if not changes:
+        return
+    with transaction.atomic():
+        existing = {
+            row.key: row
+            for row in VendorCategory.objects.select_for_update().filter(
+                user_id=user_id, vendor__in={key[0] for key in changes}
+            )
+        }
+        to_create = []
+        to_update = []
+        to_delete = []
+        for key, count in changes.items():
+            row = existing.get(key)
+            if row is None:
+                if count > 0:
+                    vendor, category_id, subcategory_id = key
+                    to_create.append(VendorCategory(
+                        user_id=user_id, vendor=vendor, category_id=category_id,
+                        subcategory_id=subcategory_id, count=count,
+                    ))
+                continue
+            row.count += count
+            if row.count <= 0:
+                to_delete.append(row.pk)
+            else:
+                to_update.append(row)
+        if to_delete:
+            VendorCategory.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            VendorCategory.objects.bulk_update(to_update, ['count'])
+        if to_create:
+            VendorCategory.objects.bulk_create(to_create)
+
+
+def fold_subcategory_vendor_counts(subcategory):
+    """Move a deleted subcategory's vendor counts onto the rows without a subcategory, like rollups"""
+    deltas = defaultdict(int)
+    for vendor, category_id, count in VendorCategory.objects.filter(subcategory=subcategory).values_list(
+        'vendor', 'category_id', 'count'
+    ):
+        deltas[(vendor, category_id, subcategory.pk)] -= count
+        deltas[(vendor, category_id, None)] += count
+    apply_vendor_deltas(subcategory.user_id, deltas)
+
+
+def rebuild_vendor_index(user):
+    """Recompute the user's vendor counts from their expenses"""
+    deltas = collect_vendor_deltas(group_for_vendors(Expense.objects.for_user(user)))
+    rows = [
+        VendorCategory(user_id=user.pk, vendor=vendor, category_id=category_id, subcategory_id=subcategory_id,
+                       count=count)
+        for (vendor, category_id, subcategory_id), count in deltas.items() if count > 0
+    ]
+    with transaction.atomic():
+        VendorCategory.objects.filter(user=user).delete()
+        VendorCategory.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _best(counts):
+    # Most frequent; ties go to the combination with a subcategory, then the older category
+    return max(counts.items(), key=lambda item: (item[1], item[0][1] is not None, -item[0][0]))[0]
+
+
+class VendorIndex:
+    """A user's vendor counts held in memory, for many lookups in a row (e.g. an import)"""
+
+    def __init__(self, user):
+        self.counts = defaultdict(dict)
+        for vendor, category_id, subcategory_id, count in VendorCategory.objects.filter(user=user).values_list(
+            'vendor', 'category_id', 'subcategory_id', 'count'
+        ):
+            self.counts[vendor][(category_id, subcategory_id)] = count
+
+    def apply(self, deltas):
+        """Keep the in-memory counts in step with deltas written to the database"""
+        for (vendor, category_id, subcategory_id), count in deltas.items():
+            counts = self.counts[vendor]
+            counts[(category_id, subcategory_id)] = counts.get((category_id, subcategory_id), 0) + count
+            if counts[(category_id, subcategory_id)] <= 0:
+                del counts[(category_id, subcategory_id)]
+
+    def lookup(self, vendor):
+        """(category_id, subcategory_id) most often used for vendor, or None"""
+        for key in vendor_keys(vendor):
+            counts = self.counts.get(key)
+            if counts:
+                return _best(counts)
+        return None
+
+
+def suggest_category(user, vendor):
+    """(category_id, subcategory_id) for one vendor, from a single indexed query, or None"""
+    keys = vendor_keys(vendor)
+    if not keys:
+        return None
+    counts = defaultdict(dict)
+    for key, category_id, subcategory_id, count in VendorCategory.objects.filter(
+        user=user, vendor__in=keys
+    ).values_list('vendor', 'category_id', 'subcategory_id', 'count'):
+        counts[key][(category_id, subcategory_id)] = count
+    for key in keys:
+        if counts.get(key):
+            return _best(counts[key])
+    return None
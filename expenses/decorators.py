@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+from calendar import timegm
+from datetime import date, datetime, time, timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .cache import aget_data_version, aget_last_modified, get_data_version, get_last_modified
+
+
+async def aget_user(request):
+    """
+    request.user for async views. The middleware's lazy user is loaded from
+    the session (a database query) on first access, so that access happens
+    in a thread; afterwards reading request.user is free.
+    """
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+def _etag(request, version):
+    # Today's date too: views default to the current month or the last twelve
+    # months, so their pages change at midnight without any write
+    seed = f'{request.user.pk}:{version}:{date.today()}:{request.META.get("CSRF_COOKIE", "")}'
+    return hashlib.sha1(seed.encode()).hexdigest()
+
+
+def _last_modified(stored):
+    """The last write's time, but never before today's (local) midnight, for the same reason"""
+    midnight = datetime.combine(date.today(), time.min).astimezone(timezone.utc)
+    return max(stored, midnight) if stored else midnight
+
+
+def conditional_on_user_data(view):
+    """
+    Answer GET requests with 304 Not Modified while the user's expenses are unchanged.
+
+    The ETag is built from the per-user data version kept in the cache, so
+    checking it never touches the expense table. The CSRF secret is mixed in
+    so a page cached before a new login is not reused with a stale token,
+    and today's date because pages default to the current month.
+    Responses are marked private and must be revalidated on every use.
+    Works on sync and async views.
+    """
+    if asyncio.iscoroutinefunction(view):
+        return _aconditional_on_user_data(view)
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        # Pending flash messages must be rendered, so skip the shortcut
+        if not request.user.is_authenticated or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        etag = _etag(request, get_data_version(request.user))
+        last_modified = _last_modified(get_last_modified(request.user))
+
+        response = condition(
+            etag_func=lambda request, *args, **kwargs: etag,
+            last_modified_func=lambda request, *args, **kwargs: last_modified,
+        )(view)(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapped
+
+
+def _aconditional_on_user_data(view):
+    # django.views.decorators.http.condition only wraps sync views in Django 4.2,
+    # so this follows the same steps around an awaited view
+    @wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        user = await aget_user(request)
+        has_messages = await sync_to_async(lambda: len(get_messages(request)))()
+        if not user.is_authenticated or has_messages:
+            return await view(request, *args, **kwargs)
+
+        etag = quote_etag(_etag(request, await aget_data_version(user)))
+        last_modified = _last_modified(await aget_last_modified(user))
+        timestamp = timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            if timestamp and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(timestamp)
+            response.headers.setdefault('ETag', etag)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapped
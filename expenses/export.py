@@ -0,0 +1,85 @@
+"""
+Streaming export of expenses.
+
+Rows are read with values_list() through QuerySet.iterator(), so only one
+chunk of plain tuples is in memory at a time, and written out as they are
+read: the header goes out before the query even runs.
+"""
+import csv
+import json
+
+from .importer import CATEGORY_FLAG_COLUMNS
+
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 2000
+
+# Oldest first; matches the (user, date, created_at) index so no sort is needed
+EXPORT_ORDERING = ('date', 'created_at', 'id')
+
+EXPORT_FIELDS = (
+    'id', 'date', 'vendor', 'amount', 'category__name', 'subcategory__name',
+    'exclude', 'indispensable', 'avoidable', 'notes',
+)
+
+# The layout import_expenses reads
+CSV_COLUMNS = (
+    ['Date (MM-DD-YYYY)', 'Store / Vendor']
+    + [column for column, _ in CATEGORY_FLAG_COLUMNS]
+    + ['Flag1', 'Escludi', 'INDISPENSABILE', 'EVITABILE', '$ Amount', 'Expense Category', 'SubCategory',
+       'Notes (Optional)']
+)
+
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset):
+    return queryset.order_by(*EXPORT_ORDERING).values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _flag(value):
+    # The same spelling for every flag column, as importer.is_true() reads it
+    return 'TRUE' if value else 'FALSE'
+
+
+_FLAG_COLUMNS = [_flag(False)] * (len(CATEGORY_FLAG_COLUMNS) + 1)
+
+
+def csv_row(day, vendor, amount, category, subcategory, exclude, indispensable, avoidable, notes):
+    """One expense as a list of CSV_COLUMNS values"""
+    return (
+        [day.strftime('%d/%m/%Y'), vendor]
+        + _FLAG_COLUMNS
+        + [_flag(exclude), _flag(indispensable), _flag(avoidable), f'${amount}', category, subcategory or '', notes]
+    )
+
+
+def iter_csv(queryset):
+    """Semicolon separated lines in the import layout, header first"""
+    writer = csv.writer(Echo(), delimiter=';')
+    yield writer.writerow(CSV_COLUMNS)
+    for _, *values in iter_rows(queryset):
+        yield writer.writerow(csv_row(*values))
+
+
+def iter_jsonl(queryset):
+    """One JSON object per expense and line"""
+    for expense_id, day, vendor, amount, category, subcategory, exclude, indispensable, avoidable, notes in iter_rows(
+        queryset
+    ):
+        yield json.dumps({
+            'id': expense_id,
+            'date': day.isoformat(),
+            'vendor': vendor,
+            'amount': str(amount),
+            'category': category,
+            'subcategory': subcategory or '',
+            'exclude': exclude,
+            'indispensable': indispensable,
+            'avoidable': avoidable,
+            'notes': notes,
+        }) + '\n'
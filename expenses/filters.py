@@ -1,5 +1,18 @@
 import django_filters
-from .models import Expense
+from .models import Expense, UserCategory, UserSubcategory
+from .search import search_expenses
+
+
+def user_categories(request):
+    if request is None or not request.user.is_authenticated:
+        return UserCategory.objects.none()
+    return UserCategory.objects.filter(user=request.user)
+
+
+def user_subcategories(request):
+    if request is None or not request.user.is_authenticated:
+        return UserSubcategory.objects.none()
+    return UserSubcategory.objects.filter(user=request.user)
 
 
 class ExpenseFilter(django_filters.FilterSet):
@@ -7,11 +20,17 @@ class ExpenseFilter(django_filters.FilterSet):
     date_before = django_filters.DateFilter(field_name='date', lookup_expr='lte', label='Date Before', method='filter_date_before')
     amount_min = django_filters.NumberFilter(field_name='amount', lookup_expr='gte', label='Min Amount', method='filter_amount_min')
     amount_max = django_filters.NumberFilter(field_name='amount', lookup_expr='lte', label='Max Amount', method='filter_amount_max')
+    q = django_filters.CharFilter(label='Search', method='filter_search')
+    category = django_filters.ModelChoiceFilter(queryset=user_categories, label='Category')
+    subcategory = django_filters.ModelChoiceFilter(queryset=user_subcategories, label='Subcategory')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
 
+    def filter_search(self, queryset, name, value):
+        return search_expenses(queryset, value)
+
     def filter_date_after(self, queryset, name, value):
         if not value:
             return queryset
@@ -34,4 +53,4 @@ class ExpenseFilter(django_filters.FilterSet):
 
     class Meta:
         model = Expense
-        fields = ['date_after', 'date_before', 'amount_min', 'amount_max'] 
\ No newline at end of file
+        fields = ['q', 'date_after', 'date_before', 'amount_min', 'amount_max', 'category', 'subcategory'] 
\ No newline at end of file
@@ -1,11 +1,14 @@
 from django import forms
 from django.contrib.auth.models import User
+from .cache import get_category_tree, get_subcategory_choices
+from .categorizer import suggest_category
 from .models import Expense, UserCategory, UserSubcategory
 
 class ExpenseForm(forms.ModelForm):
+    # Left empty, the category is taken from the vendor's history (see clean_category)
     category = forms.CharField(
         max_length=100,
-        required=True,
+        required=False,
         widget=forms.Select(attrs={'class': 'form-control', 'id': 'category-select'})
     )
     subcategory = forms.CharField(
@@ -16,7 +19,8 @@ class ExpenseForm(forms.ModelForm):
     
     class Meta:
         model = Expense
-        fields = ['date', 'vendor', 'exclude', 'indispensable', 'avoidable', 'amount', 'category', 'subcategory', 'notes']
+        # category and subcategory are the name fields above, turned into rows by save()
+        fields = ['date', 'vendor', 'exclude', 'indispensable', 'avoidable', 'amount', 'notes']
         widgets = {
             'date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'vendor': forms.TextInput(attrs={'class': 'form-control'}),
@@ -30,71 +34,127 @@ class ExpenseForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        self.user = user or getattr(self.instance, 'user', None)
+        
+        # The selects post names; show the names of the current rows when editing
+        if self.instance and self.instance.pk:
+            if self.instance.category_id:
+                self.initial['category'] = self.instance.category.name
+            if self.instance.subcategory_id:
+                self.initial['subcategory'] = self.instance.subcategory.name
         
         if user:
-            # Get user's categories
-            categories = UserCategory.objects.filter(user=user).order_by('name')
+            # Category choices come from the per-user cache
+            tree = get_category_tree(user)
             category_choices = [('', 'Select Category...')]
-            category_choices.extend([(cat.name, cat.name) for cat in categories])
+            category_choices.extend([(name, name) for _, name in tree['categories']])
             
             self.fields['category'].widget.choices = category_choices
             
-            # Get user's subcategories
-            subcategories = UserSubcategory.objects.filter(user=user).order_by('name')
+            # Only the selected category's subcategories; the page fetches others on change
+            if self.is_bound:
+                selected = self.data.get(self.add_prefix('category'))
+            else:
+                selected = self.initial.get('category')
             subcategory_choices = [('', 'Select Subcategory...')]
-            subcategory_choices.extend([(sub.name, sub.name) for sub in subcategories])
+            if selected:
+                subcategory_choices.extend([(name, name) for _, name in get_subcategory_choices(user, selected)])
             
             self.fields['subcategory'].widget.choices = subcategory_choices
-            
-            # Set initial values for category and subcategory if editing an existing expense
-            if self.instance and self.instance.pk:
-                if self.instance.category:
-                    self.fields['category'].initial = self.instance.category
-                if self.instance.subcategory:
-                    self.fields['subcategory'].initial = self.instance.subcategory
     
     def clean_category(self):
-        category = self.cleaned_data.get('category')
-        if not category:
-            raise forms.ValidationError("Please select a category.")
-        return category
+        name = self.cleaned_data.get('category')
+        self.suggested_subcategory_id = None
+        if not name:
+            suggestion = suggest_category(self.user, self.cleaned_data.get('vendor'))
+            category = UserCategory.objects.filter(user=self.user, pk=suggestion[0]).first() if suggestion else None
+            if category is None:
+                raise forms.ValidationError("Please select a category.")
+            self.suggested_subcategory_id = suggestion[1]
+            return category
+        # A new name stays unsaved until save(), so an invalid form creates nothing
+        return UserCategory.objects.filter(user=self.user, name=name).first() or UserCategory(user=self.user, name=name)
     
     def clean_subcategory(self):
-        subcategory = self.cleaned_data.get('subcategory')
-        # Subcategory is optional, so we don't validate if it's empty
-        return subcategory
+        name = self.cleaned_data.get('subcategory')
+        category = self.cleaned_data.get('category')
+        if not name and category and getattr(self, 'suggested_subcategory_id', None):
+            return UserSubcategory.objects.filter(user=self.user, pk=self.suggested_subcategory_id).first()
+        # Subcategory is optional; it always belongs to the selected category
+        if not name or not category:
+            return None
+        subcategory = None
+        if category.pk:
+            subcategory = UserSubcategory.objects.filter(user=self.user, category=category, name=name).first()
+        return subcategory or UserSubcategory(user=self.user, category=category, name=name)
     
     def save(self, commit=True):
         expense = super().save(commit=False)
-        
-        # Handle category - store as string in the expense model
-        category_name = self.cleaned_data.get('category')
-        if category_name:
-            expense.category = category_name
-            # Also create/update the UserCategory for consistency
-            UserCategory.objects.get_or_create(
-                user=expense.user,
-                name=category_name
+        category = self.cleaned_data['category']
+        subcategory = self.cleaned_data.get('subcategory')
+        if category.pk is None:
+            category, created = UserCategory.objects.get_or_create(user=self.user, name=category.name)
+        if subcategory is not None and subcategory.pk is None:
+            subcategory, created = UserSubcategory.objects.get_or_create(
+                user=self.user, category=category, name=subcategory.name
             )
-        
-        # Handle subcategory - store as string in the expense model
-        subcategory_name = self.cleaned_data.get('subcategory')
-        if subcategory_name and category_name:
-            expense.subcategory = subcategory_name
-            # Also create/update the UserSubcategory for consistency
-            try:
-                category_obj = UserCategory.objects.get(user=expense.user, name=category_name)
-                UserSubcategory.objects.get_or_create(
-                    user=expense.user,
-                    category=category_obj,
-                    name=subcategory_name
-                )
-            except UserCategory.DoesNotExist:
-                # If category doesn't exist, just store the subcategory as string
-                pass
-        else:
-            expense.subcategory = ''
+        expense.category = category
+        expense.subcategory = subcategory
         
         if commit:
             expense.save()
-        return expense 
\ No newline at end of file
+        return expense
+
+
+class BulkExpenseForm(forms.Form):
+    """
+    Action and new values for a bulk change; the affected rows are chosen by
+    the view. The new category fields are named set_* so they can never be
+    read as the category/subcategory filter parameters.
+    """
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    
+    action = forms.ChoiceField(choices=[(ACTION_UPDATE, 'Update'), (ACTION_DELETE, 'Delete')])
+    set_category = forms.ModelChoiceField(queryset=UserCategory.objects.none(), required=False)
+    set_subcategory = forms.ModelChoiceField(queryset=UserSubcategory.objects.none(), required=False)
+    clear_subcategory = forms.BooleanField(required=False)
+    # Flags left out of the request are not changed
+    exclude = forms.NullBooleanField(required=False)
+    indispensable = forms.NullBooleanField(required=False)
+    avoidable = forms.NullBooleanField(required=False)
+    
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['set_category'].queryset = UserCategory.objects.filter(user=user)
+        self.fields['set_subcategory'].queryset = UserSubcategory.objects.filter(user=user)
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        category = cleaned_data.get('set_category')
+        subcategory = cleaned_data.get('set_subcategory')
+        if subcategory and category and subcategory.category_id != category.pk:
+            raise forms.ValidationError("The subcategory does not belong to the selected category.")
+        if cleaned_data.get('action') == self.ACTION_UPDATE and not self.get_changes():
+            raise forms.ValidationError("Nothing to update.")
+        return cleaned_data
+    
+    def get_changes(self):
+        """Field changes for bulk_update_expenses()"""
+        data = self.cleaned_data
+        changes = {}
+        if data.get('set_subcategory'):
+            # A subcategory implies its parent category
+            changes['category_id'] = data['set_subcategory'].category_id
+            changes['subcategory_id'] = data['set_subcategory'].pk
+        elif data.get('set_category'):
+            # Subcategories belong to one category, so moving rows clears them
+            changes['category_id'] = data['set_category'].pk
+            changes['subcategory_id'] = None
+        elif data.get('clear_subcategory'):
+            changes['subcategory_id'] = None
+        for flag in ('exclude', 'indispensable', 'avoidable'):
+            if data.get(flag) is not None:
+                changes[flag] = data[flag]
+        return changes
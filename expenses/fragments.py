@@ -0,0 +1,92 @@
+"""
+Cached HTML fragments of the calendar and the expense list.
+
+Calendar week rows are cached per user and month under the month's version
+(cache.aget_month_versions). Writing an expense only bumps the version of
+its own month, so the rows of every other month stay cached, and a month
+whose rows are all cached is shown without a query or a template render.
+
+Expense list pages (the table rows and the page links) are cached per user
+and query string under the user's data version. A keyset page's rows and
+links also depend on expenses outside its own months (a new expense moves
+every later page), so any write invalidates them.
+"""
+import calendar
+from datetime import date
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .cache import SUMMARY_TIMEOUT, aget_month_versions, versioned_key
+from .pagination import paginate_keyset
+from .utils import add_months, aget_day_totals, build_month_matrix
+
+CALENDAR_WEEK_TEMPLATE = 'expenses/calendar_week.html'
+LIST_ROWS_TEMPLATE = 'expenses/expense_rows.html'
+LIST_PAGINATION_TEMPLATE = 'expenses/expense_pagination.html'
+FRAGMENT_TIMEOUT = SUMMARY_TIMEOUT
+
+
+def _week_key(user_id, first, version, week):
+    return f'expenses:calendar-week:{user_id}:{first:%Y-%m}:{version}:{week}'
+
+
+def week_count(year, month):
+    """Rows of a Monday-first month calendar, as build_month_matrix lays it out"""
+    return len(calendar.Calendar(firstweekday=0).monthdatescalendar(year, month))
+
+
+async def aget_calendar_fragments(user, year, month, months=1):
+    """
+    [{'year', 'month', 'rows'}] for `months` consecutive months starting at
+    year/month, rows being the rendered week rows of the month. Months with
+    a missing row are rendered again from one daily-totals query.
+    """
+    firsts = [date(*add_months(year, month, offset), 1) for offset in range(months)]
+    versions = await aget_month_versions(user, firsts)
+    keys = {
+        first: [_week_key(user.pk, first, versions[first], week) for week in range(week_count(first.year, first.month))]
+        for first in firsts
+    }
+    rows = await cache.aget_many([key for month_keys in keys.values() for key in month_keys])
+
+    stale = [first for first in firsts if any(key not in rows for key in keys[first])]
+    if stale:
+        last = stale[-1]
+        totals = await aget_day_totals(stale[0], date(*add_months(last.year, last.month, 1), 1), user)
+        rendered = {}
+        for first in stale:
+            # Plain context without the request, so rendering never touches the database
+            for week, cells in enumerate(build_month_matrix(first.year, first.month, totals)):
+                rendered[keys[first][week]] = render_to_string(CALENDAR_WEEK_TEMPLATE, {'week': cells})
+        await cache.aset_many(rendered, FRAGMENT_TIMEOUT)
+        rows.update(rendered)
+
+    return [
+        {'year': first.year, 'month': first.month, 'rows': [rows[key] for key in keys[first]]}
+        for first in firsts
+    ]
+
+
+def get_list_page(request, queryset, page_size, filter_query):
+    """
+    {'count', 'rows', 'pagination'} for the keyset page of queryset selected
+    by the request's after/before cursor, with rows and page links rendered.
+    """
+    key = versioned_key(request.user, 'list-page', sorted(request.GET.lists()))
+    page = cache.get(key)
+    if page is None:
+        keyset_page = paginate_keyset(
+            queryset,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            page_size=page_size,
+        )
+        context = {'object_list': keyset_page.object_list, 'keyset_page': keyset_page, 'filter_query': filter_query}
+        page = {
+            'count': len(keyset_page.object_list),
+            'rows': render_to_string(LIST_ROWS_TEMPLATE, context),
+            'pagination': render_to_string(LIST_PAGINATION_TEMPLATE, context),
+        }
+        cache.set(key, page, FRAGMENT_TIMEOUT)
+    return page
@@ -0,0 +1,534 @@
+import codecs
+import csv
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import bump_data_version_on_commit
+from .categorizer import VendorIndex, apply_vendor_deltas, collect_vendor_deltas
+from .models import Expense, UserCategory, UserSubcategory
+from .rollups import ROLLUP_FIELDS, apply_deltas, collect_deltas
+
+# Columns that may carry the amount, checked in order; the first positive value wins
+AMOUNT_COLUMNS = ['$ Amount', 'INDISPENSABILE', 'EVITABILE']
+
+# Flag columns used to guess a category when 'Expense Category' is empty and
+# the vendor is not in the user's vendor index
+CATEGORY_FLAG_COLUMNS = [
+    ('Holidays', 'Holidays'),
+    ('Regali', 'Regali'),
+    ('Mediche', 'Mediche'),
+    ('Abbigl.', 'Abbigliamento'),
+    ('Bollette', 'Bollette'),
+    ('Affitto', 'Affitto'),
+]
+
+TRUE_VALUES = ('TRUE', '1', 'YES')
+
+# Expense fields rewritten when a row matches an existing (date, vendor, amount) key
+UPDATE_FIELDS = ['exclude', 'indispensable', 'avoidable', 'category', 'subcategory', 'notes', 'updated_at']
+
+# Fields compared to tell an identical re-imported row from a conflicting one
+COMPARE_FIELDS = ('category_id', 'subcategory_id', 'exclude', 'indispensable', 'avoidable', 'notes')
+
+# What to do with a row whose key exists with different values
+ON_CONFLICT_UPDATE = 'update'
+ON_CONFLICT_SKIP = 'skip'
+ON_CONFLICT_CHOICES = (ON_CONFLICT_UPDATE, ON_CONFLICT_SKIP)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Skipped-row messages and conflicts kept on the result; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+MAX_REPORTED_CONFLICTS = 100
+
+
+class RowError(ValueError):
+    """Raised when a CSV row cannot be turned into an expense."""
+
+
+def parse_date(value):
+    """Parse DD/MM/YY(YY) or MM-DD-YYYY into a date"""
+    date_str = value
+    if '/' in date_str:
+        # Handle DD/MM/YY format
+        day, month, year = date_str.split('/')
+        # Convert 2-digit year to 4-digit year (assuming 20xx for years 00-99)
+        if len(year) == 2:
+            year = '20' + year
+        # Reformat to MM-DD-YYYY for datetime parsing
+        date_str = f"{month}-{day}-{year}"
+    try:
+        return datetime.strptime(date_str, '%m-%d-%Y').date()
+    except ValueError as e:
+        raise RowError(f'Invalid date format: {value} - {e}')
+
+
+def parse_amount(row):
+    """Return the first positive amount found in the amount columns, or None"""
+    for col in AMOUNT_COLUMNS:
+        if col in row and row[col]:
+            amount_str = str(row[col]).replace('$', '').replace(',', '').replace('--', '0')
+            try:
+                amount = Decimal(amount_str.strip())
+            except InvalidOperation:
+                continue
+            if amount.is_finite() and amount > 0:
+                return amount.quantize(Decimal('0.01'))
+    return None
+
+
+def is_true(value):
+    return (value or '').upper() in TRUE_VALUES
+
+
+def guess_category(row):
+    """Pick a category from the flag columns, or None if no flag is set"""
+    for column, category in CATEGORY_FLAG_COLUMNS:
+        if (row.get(column) or '').upper() == 'TRUE':
+            return category
+    return None
+
+
+def parse_row(row):
+    """
+    Turn a CSV row into a dict of Expense field values, raising RowError if
+    unusable. Without an 'Expense Category' the category is left empty and
+    `flag_category` carries the guess from the flag columns, if any.
+    """
+    date_obj = parse_date(row['Date (MM-DD-YYYY)'])
+
+    amount = parse_amount(row)
+    if amount is None:
+        raise RowError(f'No valid amount found for: {row["Store / Vendor"]} on {date_obj}')
+
+    category = (row.get('Expense Category') or '').strip()
+
+    # Handle vendor field - some rows have empty vendor
+    vendor = row['Store / Vendor']
+    if not vendor or vendor.strip() == '':
+        vendor = 'Unknown Vendor'
+
+    return {
+        'date': date_obj,
+        'vendor': vendor,
+        'amount': amount,
+        'category': category,
+        'flag_category': None if category else guess_category(row),
+        'subcategory': (row.get('SubCategory') or '').strip(),
+        'exclude': is_true(row.get('Escludi')),
+        'indispensable': is_true(row.get('INDISPENSABILE')),
+        'avoidable': is_true(row.get('EVITABILE')),
+        'notes': row.get('Notes (Optional)') or '',
+    }
+
+
+@dataclass
+class ImportResult:
+    """Outcome of an import, returned instead of command output"""
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    conflicts: int = 0
+    elapsed: float = 0.0
+    errors: list = field(default_factory=list)
+    conflict_report: list = field(default_factory=list)
+    new_categories: list = field(default_factory=list)
+    new_subcategories: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def created_categories(self):
+        return bool(self.new_categories or self.new_subcategories)
+
+
+def _compared_values(expense):
+    return tuple(getattr(expense, name) for name in COMPARE_FIELDS)
+
+
+class BatchImporter:
+    """
+    Imports parsed CSV rows for one user with bulk writes.
+
+    Categories and subcategories are loaded once up front. The user's
+    existing (date, vendor, amount) keys, with the values of COMPARE_FIELDS,
+    are loaded into a dict one month at a time as the file's rows reach it
+    (or for a whole span with preload()). Each row is then classified without
+    a query: new rows are inserted, rows identical to the stored expense are
+    counted and not written, and conflicting rows are added to the conflict
+    report and, with on_conflict='update', overwrite the stored values.
+    Writes happen with bulk_create/bulk_update every `batch_size` rows, one
+    transaction per batch.
+    """
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, log=None, verbose=False, on_flush=None,
+                 on_conflict=ON_CONFLICT_UPDATE, conflict_limit=MAX_REPORTED_CONFLICTS):
+        if on_conflict not in ON_CONFLICT_CHOICES:
+            raise ValueError(f'on_conflict must be one of {ON_CONFLICT_CHOICES}')
+        self.user = user
+        self.batch_size = max(1, batch_size)
+        self.on_conflict = on_conflict
+        # Conflicts kept in conflict_report, None for all of them
+        self.conflict_limit = conflict_limit
+        self.log = log or (lambda level, message: None)
+        self.verbose = verbose
+        # Called with the importer after each written batch, e.g. to report progress
+        self.on_flush = on_flush
+
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.conflicts = 0
+        self.conflict_report = []
+        self.rows = 0
+        # File the current rows come from (import_expenses with several files) and
+        # self.rows before its first row, so reported row numbers restart at 1 per file
+        self.source = None
+        self._source_start = 0
+        self.new_categories = []
+        self.new_subcategories = []
+        self.errors = []
+        self.started_at = None
+        self.finished_at = None
+
+        self._to_create = {}
+        self._to_update = {}
+        self._load()
+
+    def _load(self):
+        self.categories = {c.name: c for c in UserCategory.objects.filter(user=self.user)}
+        self.subcategories = {
+            (s.category_id, s.name): s
+            for s in UserSubcategory.objects.filter(user=self.user)
+        }
+        self.categories_by_id = {c.pk: c for c in self.categories.values()}
+        self.subcategories_by_id = {s.pk: s for s in self.subcategories.values()}
+        self.vendor_index = VendorIndex(self.user)
+        # (date, vendor, amount) -> (pk, COMPARE_FIELDS values) for the loaded months
+        self.existing = {}
+        self._loaded_months = set()
+
+    def preload(self, start, end):
+        """Load the existing keys of every month touching [start, end] in one query"""
+        months = set()
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.add(date(year, month, 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        months -= self._loaded_months
+        if not months:
+            return
+        first = min(months)
+        last = max(months)
+        year, month = (last.year + 1, 1) if last.month == 12 else (last.year, last.month + 1)
+        queryset = Expense.objects.for_user(self.user).filter(date__gte=first, date__lt=date(year, month, 1))
+        for pk, d, vendor, amount, *values in queryset.values_list(
+            'id', 'date', 'vendor', 'amount', *COMPARE_FIELDS
+        ).order_by().iterator(chunk_size=5000):
+            if d.replace(day=1) in months:
+                self.existing[(d, vendor, amount)] = (pk, tuple(values))
+        self._loaded_months |= months
+
+    def _ensure_loaded(self, day):
+        if day.replace(day=1) not in self._loaded_months:
+            self.preload(day, day)
+
+    def _category(self, name):
+        category = self.categories.get(name)
+        if category is None:
+            category, created = UserCategory.objects.get_or_create(user=self.user, name=name)
+            self.categories[name] = category
+            self.categories_by_id[category.pk] = category
+            if created:
+                self.new_categories.append(name)
+                self.log('SUCCESS', f'Created new category: {name}')
+        return category
+
+    def _subcategory(self, category, name):
+        key = (category.id, name)
+        subcategory = self.subcategories.get(key)
+        if subcategory is None:
+            subcategory, created = UserSubcategory.objects.get_or_create(
+                user=self.user, category=category, name=name
+            )
+            self.subcategories[key] = subcategory
+            self.subcategories_by_id[subcategory.pk] = subcategory
+            if created:
+                self.new_subcategories.append(f'{category.name} > {name}')
+                self.log('SUCCESS', f'Created new subcategory: {category.name} > {name}')
+        return subcategory
+
+    def start_file(self, name):
+        """Number the following rows from 1 again, as rows of the file called name"""
+        self.source = name
+        self._source_start = self.rows
+
+    @property
+    def row_number(self):
+        """Number of the current data row in its file, the header not counted"""
+        return self.rows - self._source_start
+
+    def add(self, row):
+        """Parse and queue one CSV row, flushing when the batch is full"""
+        try:
+            fields = parse_row(row)
+        except (RowError, KeyError) as e:
+            self.skip(str(e) if isinstance(e, RowError) else f'Missing column: {e}')
+            return
+        self.add_parsed(fields)
+
+    def skip(self, message):
+        """Count a row that could not be parsed"""
+        self._start()
+        self.rows += 1
+        self.skipped += 1
+        prefix = f'{self.source} row' if self.source else 'Row'
+        message = f'{prefix} {self.row_number}: {message}'
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+        self.log('WARNING', message)
+
+    def add_parsed(self, fields):
+        """Queue a row already turned into field values by parse_row"""
+        self._start()
+        self.rows += 1
+        flag_category = fields.pop('flag_category', None)
+        subcategory = None
+        if fields['category']:
+            category = self._category(fields['category'])
+        else:
+            # What the user filed this vendor under before, then the flag columns
+            category, subcategory = self._suggest(fields['vendor'])
+            if category is None:
+                category = self._category(flag_category or 'Other')
+        fields['category'] = category
+        if fields['subcategory']:
+            fields['subcategory'] = self._subcategory(category, fields['subcategory'])
+        else:
+            fields['subcategory'] = subcategory
+
+        self._queue(fields)
+        if self.verbose:
+            self.log('SUCCESS', f"Imported: {fields['date']} - {fields['vendor']} - €{fields['amount']}")
+
+        if len(self._to_create) + len(self._to_update) >= self.batch_size:
+            self.flush()
+
+    def _suggest(self, vendor):
+        """(category, subcategory) from the vendor index, or (None, None)"""
+        suggestion = self.vendor_index.lookup(vendor)
+        if suggestion is None:
+            return None, None
+        category_id, subcategory_id = suggestion
+        category = self.categories_by_id.get(category_id)
+        if category is None:
+            return None, None
+        return category, self.subcategories_by_id.get(subcategory_id)
+
+    def _start(self):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+
+    def _queue(self, fields):
+        key = (fields['date'], fields['vendor'], fields['amount'])
+        self._ensure_loaded(fields['date'])
+        pending = self._to_create.get(key) or self._to_update.get(key)
+        if pending is not None:
+            # Same key earlier in the file and not written yet: compare with that row
+            stored = (pending.pk, _compared_values(pending))
+        else:
+            stored = self.existing.get(key)
+
+        if stored is None:
+            self._to_create[key] = Expense(user=self.user, **fields)
+            self.created += 1
+            return
+
+        pk, values = stored
+        expense = Expense(pk=pk, user=self.user, **fields)
+        new_values = _compared_values(expense)
+        if new_values == values:
+            self.unchanged += 1
+            return
+        self._report_conflict(key, values, new_values)
+        if self.on_conflict == ON_CONFLICT_SKIP:
+            return
+        if pending is not None:
+            # The later row wins; it is still a single write
+            for name, value in fields.items():
+                setattr(pending, name, value)
+            return
+        self._to_update[key] = expense
+        self.updated += 1
+
+    def _report_conflict(self, key, old, new):
+        self.conflicts += 1
+        if self.conflict_limit is not None and len(self.conflict_report) >= self.conflict_limit:
+            return
+        changes = {}
+        for name, before, after in zip(COMPARE_FIELDS, old, new):
+            before, after = self._display(name, before), self._display(name, after)
+            # By name: a subcategory of the same name under the new category is no change of its own
+            if before != after:
+                changes[name.removesuffix('_id')] = [before, after]
+        day, vendor, amount = key
+        self.conflict_report.append({
+            'file': self.source,
+            'row': self.row_number,
+            'date': day.isoformat(),
+            'vendor': vendor,
+            'amount': str(amount),
+            'changes': changes,
+        })
+
+    def _display(self, name, value):
+        """Category and subcategory names instead of ids in the conflict report"""
+        if value is None:
+            return None
+        if name == 'category_id':
+            category = self.categories_by_id.get(value)
+            return category.name if category else value
+        if name == 'subcategory_id':
+            subcategory = self.subcategories_by_id.get(value)
+            return subcategory.name if subcategory else value
+        return value
+
+    def flush(self):
+        """Write the pending batch in a single transaction"""
+        if not self._to_create and not self._to_update:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            # Bulk writes skip the rollup and vendor-count signals, so the batch's deltas are applied here
+            deltas = collect_deltas(self._to_create.values())
+            vendor_deltas = collect_vendor_deltas(self._to_create.values())
+            if self._to_create:
+                created = Expense.objects.bulk_create(list(self._to_create.values()))
+                for obj in created:
+                    self.existing[(obj.date, obj.vendor, obj.amount)] = (obj.pk, _compared_values(obj))
+                if any(obj.pk is None for obj in created):
+                    self._reload_keys(created)
+            if self._to_update:
+                previous = Expense.objects.filter(pk__in=[obj.pk for obj in self._to_update.values()])
+                previous = list(previous.values(*ROLLUP_FIELDS, 'vendor'))
+                collect_deltas(previous, sign=-1, deltas=deltas)
+                collect_deltas(self._to_update.values(), deltas=deltas)
+                collect_vendor_deltas(previous, sign=-1, deltas=vendor_deltas)
+                collect_vendor_deltas(self._to_update.values(), deltas=vendor_deltas)
+                for key, obj in self._to_update.items():
+                    obj.updated_at = now
+                    self.existing[key] = (obj.pk, _compared_values(obj))
+                Expense.objects.bulk_update(list(self._to_update.values()), UPDATE_FIELDS)
+            apply_deltas(self.user.pk, deltas)
+            apply_vendor_deltas(self.user.pk, vendor_deltas)
+        # Later rows of the same import learn from this batch
+        self.vendor_index.apply(vendor_deltas)
+        # Bulk writes send no post_save signals, so invalidate cached data here
+        bump_data_version_on_commit(self.user)
+        self._to_create = {}
+        self._to_update = {}
+        if self.on_flush:
+            self.on_flush(self)
+
+    def _reload_keys(self, objs):
+        # Backends that cannot return ids from bulk_create need a lookup
+        dates = {obj.date for obj in objs}
+        self.existing.update({
+            (d, vendor, amount): (pk, tuple(values))
+            for pk, d, vendor, amount, *values in Expense.objects.for_user(self.user).filter(
+                date__in=dates
+            ).values_list('id', 'date', 'vendor', 'amount', *COMPARE_FIELDS)
+        })
+
+    def finish(self):
+        self.flush()
+        self.finished_at = time.perf_counter()
+        return self
+
+    def run(self, rows):
+        for row in rows:
+            self.add(row)
+        return self.finish()
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed else 0.0
+
+    def result(self):
+        return ImportResult(
+            rows=self.rows,
+            created=self.created,
+            updated=self.updated,
+            unchanged=self.unchanged,
+            skipped=self.skipped,
+            conflicts=self.conflicts,
+            elapsed=self.elapsed,
+            errors=list(self.errors),
+            conflict_report=list(self.conflict_report),
+            new_categories=list(self.new_categories),
+            new_subcategories=list(self.new_subcategories),
+        )
+
+    def summary(self):
+        return (
+            f'Processed {self.rows} rows in {self.elapsed:.2f}s '
+            f'({self.rows_per_second:.0f} rows/sec): '
+            f'{self.created} created, {self.updated} updated, {self.unchanged} unchanged, '
+            f'{self.skipped} skipped, {self.conflicts} conflicts'
+        )
+
+
+def read_upload(uploaded_file, encoding='utf-8-sig'):
+    """
+    Yield CSV rows from an UploadedFile without reading it into memory.
+
+    Iterating a Django File walks its chunks() and splits them into lines,
+    and iterdecode turns those into text incrementally, so only one chunk
+    is held at a time.
+    """
+    lines = codecs.iterdecode(uploaded_file, encoding)
+    return csv.DictReader(lines, delimiter=';')
+
+
+def parse_csv_file(path):
+    """
+    Parse a CSV file without touching the database.
+
+    Returns (path, rows) with one item per data row in file order: the
+    parsed fields, or the RowError of a row that could not be parsed. Only
+    picklable values are used, so it can run in a worker process.
+    """
+    rows = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f, delimiter=';'):
+            try:
+                rows.append(parse_row(row))
+            except RowError as e:
+                rows.append(e)
+            except KeyError as e:
+                rows.append(RowError(f'Missing column: {e}'))
+    return path, rows
+
+
+def import_upload(user, uploaded_file, batch_size=DEFAULT_BATCH_SIZE, on_flush=None):
+    """Stream an uploaded CSV into the user's expenses and return an ImportResult"""
+    importer = BatchImporter(user, batch_size=batch_size, on_flush=on_flush)
+    return importer.run(read_upload(uploaded_file)).result()
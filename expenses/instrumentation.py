@@ -0,0 +1,204 @@
+"""
+Opt-in per-request timing (settings.REQUEST_TIMING).
+
+RequestTimingMiddleware records, for every request, the number of database
+queries, the time spent in SQL, the time spent rendering templates and the
+total time. The numbers are sent back in a Server-Timing header (visible in
+the browser's network panel), written as a log line and added to a rolling
+per-URL-name window from which /expenses/timings/ shows p50/p95/p99 to staff.
+
+The current request's counters live in a context variable, so they follow
+the request into the threads that run sync code for async views. Queries
+are timed by an execute_wrapper installed on every new connection
+(expenses.signals.time_queries) and templates by the TimedDjangoTemplates
+backend.
+"""
+import logging
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+from .utils import percentiles
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timing', default=None)
+
+# Requests that do not resolve to a view (404s) are grouped under this name
+UNRESOLVED = '<unresolved>'
+
+
+class RequestTimer:
+    """Counters of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        # Templates rendered from inside a template are already being timed
+        self.rendering = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def time_query(execute, sql, params, many, context):
+    """execute_wrapper adding each query to the current request's counters"""
+    timer = _current.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.queries += 1
+        timer.sql += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        timer = _current.get()
+        if timer is None or timer.rendering:
+            return super().render(context, request)
+        timer.rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timer.template += time.perf_counter() - started
+            timer.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every render for RequestTimingMiddleware"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class TimingWindow:
+    """The last REQUEST_TIMING_WINDOW requests of every URL name in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(self._window)
+
+    def _window(self):
+        return deque(maxlen=getattr(settings, 'REQUEST_TIMING_WINDOW', 1000))
+
+    def add(self, name, total, sql, template, queries):
+        with self.lock:
+            self.samples[name].append((total, sql, template, queries))
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self):
+        """One row per URL name with latency percentiles and mean breakdown, slowest p95 first"""
+        with self.lock:
+            samples = {name: list(window) for name, window in self.samples.items()}
+        rows = []
+        for name, window in samples.items():
+            totals, sqls, templates, queries = zip(*window)
+            cuts = percentiles(totals)
+            rows.append({
+                'url_name': name,
+                'requests': len(window),
+                'p50_ms': round(cuts['p50'], 1),
+                'p95_ms': round(cuts['p95'], 1),
+                'p99_ms': round(cuts['p99'], 1),
+                'max_ms': round(max(totals) * 1000, 1),
+                'sql_ms': round(statistics.mean(sqls) * 1000, 1),
+                'template_ms': round(statistics.mean(templates) * 1000, 1),
+                'queries': round(statistics.mean(queries), 1),
+            })
+        return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+timings = TimingWindow()
+
+
+def request_user_id(request):
+    # Only a user the request already loaded: resolving the lazy request.user
+    # here would add a query, and cannot run on the event loop at all
+    user = getattr(request, '_cached_user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+class RequestTimingMiddleware:
+    """
+    Time each request and report it in a Server-Timing header, a log line
+    and the per-URL-name window. Listed first in MIDDLEWARE so the session
+    and user lookups are included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timer)
+
+    async def __acall__(self, request):
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timer)
+
+    def finish(self, request, response, timer):
+        # A streaming response is timed until the view returns it, not until its body is sent
+        total = timer.elapsed()
+        match = request.resolver_match
+        name = match.view_name if match else UNRESOLVED
+        app = max(total - timer.sql - timer.template, 0.0)
+
+        response['Server-Timing'] = ', '.join([
+            f'sql;dur={timer.sql * 1000:.1f};desc="{timer.queries} queries"',
+            f'tpl;dur={timer.template * 1000:.1f};desc="templates"',
+            f'app;dur={app * 1000:.1f};desc="python"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        timings.add(name, total, timer.sql, timer.template, timer.queries)
+
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': name,
+            'status': response.status_code,
+            'user_id': request_user_id(request),
+            'queries': timer.queries,
+            'sql_ms': round(timer.sql * 1000, 1),
+            'template_ms': round(timer.template * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+        }
+        logger.info(' '.join(f'{key}={value}' for key, value in fields.items()), extra={'timing': fields})
+        return response
@@ -0,0 +1,179 @@
+"""
+Background CSV imports.
+
+Uploads are stored on an ImportJob row and processed by a small thread pool,
+so the upload request returns as soon as the file is saved. The job table is
+the queue: a running job records its owner (host:pid) and a heartbeat it
+refreshes every IMPORT_JOB_HEARTBEAT seconds. Jobs left pending, or running
+without a heartbeat for IMPORT_JOB_STALE_AFTER seconds because their process
+stopped, are picked up by the process_import_jobs command. Jobs another live
+process is running are never taken over.
+"""
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import import_upload
+from .models import ImportJob
+from .profiling import maybe_profiled
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMPORT_JOB_WORKERS', 2),
+                thread_name_prefix='import-job',
+            )
+    return _executor
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def submit_import(user, uploaded_file):
+    """Save the upload on a new ImportJob and queue it once the row is committed"""
+    job = ImportJob(user=user, filename=uploaded_file.name)
+    job.csv_file.save(uploaded_file.name, uploaded_file, save=False)
+    job.save()
+    transaction.on_commit(lambda: enqueue(job.pk))
+    return job
+
+
+def enqueue(job_id):
+    get_executor().submit(run_job, job_id)
+
+
+def reclaim_stale_jobs():
+    """Requeue running jobs whose process stopped sending heartbeats; returns how many"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'IMPORT_JOB_STALE_AFTER', 60))
+    return ImportJob.objects.filter(status=ImportJob.STATUS_RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    ).update(status=ImportJob.STATUS_PENDING, owner='', heartbeat_at=None)
+
+
+def claim_job(job_id):
+    """Mark a pending job as running in this process; returns False if another worker got it first"""
+    now = timezone.now()
+    return ImportJob.objects.filter(pk=job_id, status=ImportJob.STATUS_PENDING).update(
+        status=ImportJob.STATUS_RUNNING, started_at=now, owner=worker_id(), heartbeat_at=now
+    ) == 1
+
+
+class Heartbeat:
+    """Refresh a claimed job's heartbeat_at from a background thread while the block runs"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.owner = worker_id()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'import-job-heartbeat-{job_id}', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        interval = getattr(settings, 'IMPORT_JOB_HEARTBEAT', 10)
+        try:
+            while not self.stopped.wait(interval):
+                try:
+                    ImportJob.objects.filter(pk=self.job_id, owner=self.owner).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    # A locked database only delays this beat; the job keeps running
+                    logger.warning('Heartbeat of import job %s failed', self.job_id, exc_info=True)
+        finally:
+            connections.close_all()
+
+
+def run_job(job_id):
+    """Run a pending job; returns False if another worker claimed it first"""
+    close_old_connections()
+    try:
+        if not claim_job(job_id):
+            return False
+        job = ImportJob.objects.select_related('user').get(pk=job_id)
+
+        def report_progress(importer):
+            ImportJob.objects.filter(pk=job_id).update(
+                rows_processed=importer.rows,
+                created_count=importer.created,
+                updated_count=importer.updated,
+                skipped_count=importer.skipped,
+                unchanged_count=importer.unchanged,
+                conflict_count=importer.conflicts,
+                errors=importer.errors,
+            )
+
+        try:
+            with Heartbeat(job_id), job.csv_file.open('rb') as csv_file:
+                with maybe_profiled('import-job', job.user_id) as block:
+                    block.extra = {'job_id': job_id, 'filename': job.filename}
+                    result = import_upload(job.user, csv_file, on_flush=report_progress)
+        except Exception as e:
+            logger.exception('Import job %s failed', job_id)
+            job.status = ImportJob.STATUS_FAILED
+            job.message = str(e)
+        else:
+            job.status = ImportJob.STATUS_DONE
+            job.rows_processed = result.rows
+            job.created_count = result.created
+            job.updated_count = result.updated
+            job.skipped_count = result.skipped
+            job.unchanged_count = result.unchanged
+            job.conflict_count = result.conflicts
+            job.errors = result.errors
+            job.conflicts = result.conflict_report
+            job.new_categories = result.new_categories + result.new_subcategories
+        job.finished_at = timezone.now()
+        # The stored upload is only needed until the job has run
+        job.csv_file.delete(save=False)
+        job.save(update_fields=[
+            'status', 'message', 'rows_processed', 'created_count', 'updated_count',
+            'skipped_count', 'unchanged_count', 'conflict_count', 'errors', 'conflicts',
+            'new_categories', 'finished_at', 'csv_file',
+        ])
+        return True
+    finally:
+        close_old_connections()
+
+
+def job_progress(job):
+    """JSON-ready progress snapshot for the polling endpoint"""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'finished': job.is_finished,
+        'rows_processed': job.rows_processed,
+        'created': job.created_count,
+        'updated': job.updated_count,
+        'skipped': job.skipped_count,
+        'unchanged': job.unchanged_count,
+        'conflict_count': job.conflict_count,
+        'conflicts': job.conflicts,
+        'rows_per_second': round(job.rows_per_second, 1),
+        'elapsed': round(job.elapsed, 3),
+        'errors': job.errors,
+        'new_categories': job.new_categories,
+        'message': job.message,
+    }
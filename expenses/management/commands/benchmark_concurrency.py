@@ -0,0 +1,104 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+from expenses.benchmark import ASGIRunner, WSGIRunner, create_session, session_cookie
+from expenses.models import Expense
+from expenses.utils import percentiles
+
+
+ENDPOINTS = ('calendar', 'day', 'chart')
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the WSGI and ASGI handlers under concurrent requests to the calendar, day detail and '
+        'chart data endpoints. Requests go through the full middleware stack in this process, without a '
+        'server or network: WSGI requests run on a fixed pool of worker threads (like gunicorn --threads), '
+        'ASGI requests are all in flight on one event loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, required=True, help='User whose pages are requested')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and concurrency level')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32],
+            help='Numbers of requests kept in flight at once'
+        )
+        parser.add_argument(
+            '--wsgi-threads', type=int, default=4,
+            help='Worker threads available to the WSGI handler (default 4)'
+        )
+        parser.add_argument(
+            '--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS), help='Endpoints to request'
+        )
+        parser.add_argument('--host', type=str, default='localhost', help='Host header sent with every request')
+        parser.add_argument(
+            '--db-latency', type=float, default=0.0,
+            help='Milliseconds added to every query, to stand in for a database across the network'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        latest = Expense.objects.for_user(user).order_by('-date').values_list('date', flat=True).first()
+        if latest is None:
+            raise CommandError(f'User "{user.username}" has no expenses.')
+        paths = {
+            'calendar': f"{reverse('expenses:calendar')}?year={latest.year}&month={latest.month}",
+            'day': reverse('expenses:expenses-by-date', args=[latest.isoformat()]),
+            'chart': reverse('expenses:chart-data'),
+        }
+
+        if options['db_latency']:
+            delay = options['db_latency'] / 1000
+
+            def add_latency(execute, sql, params, many, context):
+                time.sleep(delay)
+                return execute(sql, params, many, context)
+
+            def install(sender, connection, **kwargs):
+                # Fires again each time a thread's connection reconnects, so only add it once
+                if add_latency not in connection.execute_wrappers:
+                    connection.execute_wrappers.append(add_latency)
+
+            connection_created.connect(install, weak=False)
+            connections.close_all()
+
+        session = create_session(user)
+        cookie = session_cookie(session)
+        wsgi = WSGIRunner(get_wsgi_application(), options['host'], cookie, options['wsgi_threads'])
+        asgi = ASGIRunner(get_asgi_application(), options['host'], cookie)
+
+        self.stdout.write(
+            f"{'endpoint':<12} {'handler':<6} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'errors':>6}"
+        )
+        try:
+            for name in options['endpoints']:
+                path = paths[name]
+                for concurrency in options['concurrency']:
+                    for label, runner in (('wsgi', wsgi), ('asgi', asgi)):
+                        # One unmeasured round warms caches and connections
+                        runner.run(path, min(concurrency, options['requests']), concurrency)
+                        elapsed, latencies, errors = runner.run(path, options['requests'], concurrency)
+                        self.report(name, label, concurrency, elapsed, latencies, errors)
+        finally:
+            wsgi.close()
+            session.delete()
+
+    def report(self, name, label, concurrency, elapsed, latencies, errors):
+        cuts = percentiles(latencies)
+        rate = len(latencies) / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f'{name:<12} {label:<6} {concurrency:>5} {rate:>9.1f} {cuts["p50"]:>8.1f} '
+            f'{cuts["p95"]:>8.1f} {cuts["p99"]:>8.1f} {errors:>6}'
+        )
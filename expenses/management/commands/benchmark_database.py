@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, connection
+from django.urls import reverse
+from expenses.benchmark import WSGIRunner, create_session, session_cookie
+from expenses.bulk import bulk_delete_expenses
+from expenses.importer import BatchImporter
+from expenses.models import Expense, UserCategory
+from expenses.utils import percentiles
+
+# Pragmas reported for the SQLite profile in use
+SQLITE_REPORTED_PRAGMAS = ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent read/write throughput of the configured database profile: reader threads '
+        'request the expense list through the WSGI handler while writer threads import synthetic rows '
+        'with the batch importer. Run it once per profile (DB_ENGINE, DB_CONN_MAX_AGE, DB_SQLITE_TUNING) '
+        'to compare them. Writers use throwaway users that are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, required=True, help='User whose expense list is read')
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long readers and writers run')
+        parser.add_argument('--readers', type=int, default=4, help='Threads requesting the expense list')
+        parser.add_argument('--writers', type=int, default=1, help='Threads importing rows')
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows per import (one transaction)')
+        parser.add_argument('--host', type=str, default='localhost', help='Host header sent with every request')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        self.stdout.write(self.describe_profile())
+
+        list_url = reverse('expenses:list')
+        latest = Expense.objects.for_user(user).order_by('-date').values_list('date', flat=True).first() or date.today()
+        # Plain first page and a filtered one, alternated by every reader
+        paths = [list_url, f'{list_url}?date_after={latest.year}-01-01&amount_min=10']
+
+        session = create_session(user)
+        runner = WSGIRunner(
+            get_wsgi_application(), options['host'], session_cookie(session), max(1, options['readers'])
+        )
+        writers = [
+            User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}') for _ in range(options['writers'])
+        ]
+        stop = threading.Event()
+        reads = []
+        writes = []
+        errors = []
+        threads = [
+            threading.Thread(target=self.read, args=(runner, paths, stop, reads, errors))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=self.write, args=(writer, options['batch_size'], stop, writes, errors))
+            for writer in writers
+        ]
+
+        # Unmeasured requests fill the user's cached summaries, as on a running site
+        for path in paths:
+            runner.request(path)
+
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            time.sleep(options['seconds'])
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            self.report(elapsed, reads, writes, errors)
+        finally:
+            stop.set()
+            runner.close()
+            session.delete()
+            for writer in writers:
+                bulk_delete_expenses(writer, Expense.objects.for_user(writer))
+                UserCategory.objects.filter(user=writer).delete()
+                writer.delete()
+
+    def describe_profile(self):
+        settings_dict = connection.settings_dict
+        lines = [f"Database: {connection.vendor} ({settings_dict['NAME']}), CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}"]
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                pragmas = []
+                for name in SQLITE_REPORTED_PRAGMAS:
+                    cursor.execute(f'PRAGMA {name}')
+                    pragmas.append(f'{name}={cursor.fetchone()[0]}')
+            lines.append('Pragmas: ' + ', '.join(pragmas))
+        return '\n'.join(lines)
+
+    def read(self, runner, paths, stop, reads, errors):
+        i = 0
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                ok = runner.request(paths[i % len(paths)])
+                reads.append(time.perf_counter() - started)
+                if not ok:
+                    errors.append('read: non-200 response')
+                i += 1
+        finally:
+            # Persistent connections (CONN_MAX_AGE > 0) outlive the request
+            connection.close()
+
+    def write(self, writer, batch_size, stop, writes, errors):
+        rng = random.Random(writer.pk)
+        start = date.today() - timedelta(days=365)
+        batch = 0
+        try:
+            while not stop.is_set():
+                rows = [{
+                    'date': start + timedelta(days=rng.randrange(365)),
+                    'vendor': f'Benchmark vendor {batch}-{n}',
+                    'amount': Decimal(rng.randrange(100, 50000)) / 100,
+                    'category': rng.choice(['Groceries', 'Transport', 'Bills']),
+                    'subcategory': '',
+                    'exclude': False,
+                    'indispensable': False,
+                    'avoidable': False,
+                    'notes': '',
+                } for n in range(batch_size)]
+                started = time.perf_counter()
+                try:
+                    importer = BatchImporter(writer, batch_size=batch_size)
+                    for fields in rows:
+                        importer.add_parsed(fields)
+                    importer.finish()
+                except DatabaseError as e:
+                    errors.append(f'write: {e}')
+                else:
+                    writes.append((time.perf_counter() - started, batch_size))
+                batch += 1
+        finally:
+            connection.close()
+
+    def report(self, elapsed, reads, writes, errors):
+        cuts = percentiles(reads)
+        self.stdout.write(
+            f'Reads:  {len(reads)} list requests in {elapsed:.1f}s = {len(reads) / elapsed:.1f} req/s '
+            f'(p50 {cuts["p50"]:.1f} ms, p95 {cuts["p95"]:.1f} ms, p99 {cuts["p99"]:.1f} ms)'
+        )
+        rows = sum(count for _, count in writes)
+        cuts = percentiles([latency for latency, _ in writes])
+        self.stdout.write(
+            f'Writes: {rows} rows in {len(writes)} imports = {rows / elapsed:.0f} rows/s '
+            f'(per import p50 {cuts["p50"]:.1f} ms, p95 {cuts["p95"]:.1f} ms)'
+        )
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{len(errors)} errors, first: {errors[0]}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No errors'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from expenses.snapshot import build_snapshot, refresh_snapshot, snapshot_path
+
+class Command(BaseCommand):
+    help = 'Write or refresh the columnar analytics snapshot of each user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only this user (default: all users)')
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rebuild from scratch (dropping unused dictionary codes), even if the user\'s data is unchanged',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User "{options["username"]}" does not exist.'))
+                return
+
+        for user in users.iterator():
+            count = build_snapshot(user) if options['full'] else refresh_snapshot(user)
+            if count:
+                self.stdout.write(f'{user.username}: {count} rows written to {snapshot_path(user)}')
+            else:
+                self.stdout.write(f'{user.username}: unchanged')
+        self.stdout.write(self.style.SUCCESS('Snapshots up to date'))
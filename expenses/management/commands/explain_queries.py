@@ -0,0 +1,97 @@
+import asyncio
+import re
+from datetime import date
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from expenses.models import Expense
+from expenses.views import ExpenseListView, expense_calendar, get_expenses_by_date
+
+# A plan line that walks the whole expense table (or a whole index of it)
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?expenses_expense\b')
+# Cached summaries and fragments would hide the queries to check
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+class Command(BaseCommand):
+    help = "Print the query plan of every expense query issued by the main views"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, required=True, help='User whose pages are rendered')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit with an error if any full scan is found')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        latest = Expense.objects.for_user(user).order_by('-date').values_list('date', flat=True).first() or date.today()
+        day = latest.isoformat()
+        factory = RequestFactory()
+        requests = [
+            ('list', ExpenseListView.as_view(), reverse('expenses:list'), {}),
+            ('list (date range)', ExpenseListView.as_view(), reverse('expenses:list'),
+             {'date_after': f'{latest.year}-01-01', 'date_before': day}),
+            ('list (amount range)', ExpenseListView.as_view(), reverse('expenses:list'),
+             {'amount_min': '10', 'amount_max': '100'}),
+            ('calendar', expense_calendar, reverse('expenses:calendar'),
+             {'year': latest.year, 'month': latest.month}),
+            ('day detail', partial(get_expenses_by_date, date_str=day),
+             reverse('expenses:expenses-by-date', args=[day]), {}),
+        ]
+
+        scans = 0
+        empty = []
+        for name, view, path, params in requests:
+            request = factory.get(path, params)
+            request.user = user
+            with override_settings(CACHES=NO_CACHE), CaptureQueriesContext(connection) as captured:
+                if asyncio.iscoroutinefunction(view):
+                    # Thread-sensitive ORM calls run on this thread, so they are captured too
+                    response = async_to_sync(view)(request)
+                else:
+                    response = view(request)
+                if hasattr(response, 'render'):
+                    response.render()
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {name} ({len(captured)} queries)'))
+            if not captured:
+                empty.append(name)
+            for query in captured:
+                sql = query['sql']
+                if 'expenses_expense' not in sql or not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                self.stdout.write(sql)
+                for line in self.explain(sql):
+                    if FULL_SCAN.search(line):
+                        scans += 1
+                        self.stdout.write(self.style.ERROR(f'    {line}'))
+                    else:
+                        self.stdout.write(f'    {line}')
+
+        problems = []
+        if scans:
+            problems.append(f'{scans} full scans of expenses_expense found')
+        if empty:
+            problems.append(f'no queries captured for {", ".join(empty)}')
+        if problems:
+            message = '; '.join(problems)
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS('No full scans of expenses_expense'))
+
+    def explain(self, sql):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        # SQLite returns (id, parent, notused, detail); other backends one text column
+        return [str(row[-1]) for row in rows]
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from expenses.synthetic import DEFAULT_BATCH_SIZE, create_dataset, default_span, write_csv
+
+class Command(BaseCommand):
+    help = (
+        'Generate users with realistic synthetic expenses (seasonal categories, Zipf-distributed vendors, '
+        'log-normal amounts, recurring bills) for load tests and benchmarks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Number of users to create or fill')
+        parser.add_argument('--expenses', type=int, default=100000, help='Expenses per user')
+        parser.add_argument('--years', type=int, default=3, help='Years of history, ending today')
+        parser.add_argument('--prefix', type=str, default='demo', help='Usernames are <prefix>1, <prefix>2, ...')
+        parser.add_argument(
+            '--password', type=str,
+            help='Password for newly created users (default: unusable, log in with the admin or a session)'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; user n uses seed + n')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per bulk insert')
+        parser.add_argument('--csv', type=str, help='Write the expenses of one user to this CSV file instead')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['expenses'] < 0:
+            raise CommandError('--users must be at least 1 and --expenses not negative.')
+        start, end = default_span(options['years'])
+
+        if options['csv']:
+            write_csv(options['csv'], options['expenses'], start, end, options['seed'])
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['expenses']} expenses to {options['csv']}"))
+            return
+
+        for n in range(1, options['users'] + 1):
+            username = f"{options['prefix']}{n}"
+            user, created = User.objects.get_or_create(username=username)
+            if created:
+                if options['password']:
+                    user.set_password(options['password'])
+                else:
+                    user.set_unusable_password()
+                user.save()
+
+            started = time.perf_counter()
+
+            def progress(written):
+                self.stdout.write(f'{username}: {written}/{options["expenses"]} rows generated', ending='\r')
+                self.stdout.flush()
+
+            added = create_dataset(
+                user, options['expenses'], start, end,
+                seed=options['seed'] + n, batch_size=options['batch_size'], progress=progress,
+            )
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{username}: {added} expenses added from {start} to {end} in {elapsed:.1f}s '
+                f'({added / elapsed if elapsed else 0:.0f} rows/sec)'
+                + ('' if added == options['expenses'] else ', duplicates of existing keys were dropped')
+            )
+        self.stdout.write(self.style.SUCCESS('Synthetic data generated'))
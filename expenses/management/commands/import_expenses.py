@@ -1,138 +1,221 @@
 import csv
+import fnmatch
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from expenses.models import Expense, UserCategory, UserSubcategory
-from datetime import datetime
+from expenses.importer import (
+    BatchImporter, DEFAULT_BATCH_SIZE, ON_CONFLICT_CHOICES, ON_CONFLICT_UPDATE, MAX_REPORTED_CONFLICTS,
+    RowError, parse_csv_file,
+)
 
 class Command(BaseCommand):
-    help = 'Import expenses from CSV'
+    help = (
+        'Import expenses from CSV. csv_path may be a single file, a directory or a glob; '
+        'several files are parsed in a process pool and written one user at a time.'
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_path', type=str)
-        parser.add_argument('--username', type=str, required=True, help='Username to assign expenses to')
+        parser.add_argument('csv_path', type=str, help='CSV file, directory of CSV files, or glob pattern')
+        parser.add_argument('--username', type=str, help='Username to assign expenses to')
+        parser.add_argument(
+            '--manifest', type=str,
+            help='JSON file mapping file name patterns to usernames, e.g. {"alice_*.csv": "alice"}'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help=f'Number of rows written per transaction (default {DEFAULT_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes used to parse files when importing several at once'
+        )
+        parser.add_argument(
+            '--on-conflict', choices=ON_CONFLICT_CHOICES, default=ON_CONFLICT_UPDATE,
+            help='Rows matching an existing expense with different values: overwrite it (update) or leave it (skip)'
+        )
+        parser.add_argument(
+            '--conflict-report', type=str,
+            help='Write every reported conflict to this CSV file (one line per changed field)'
+        )
 
     def handle(self, *args, **options):
         path = options['csv_path']
-        username = options['username']
-        
-        try:
-            user = User.objects.get(username=username)
-        except User.DoesNotExist:
-            self.stdout.write(
-                self.style.ERROR(f'User "{username}" does not exist. Please create the user first.')
-            )
+        if not options['username'] and not options['manifest']:
+            self.stdout.write(self.style.ERROR('Pass --username or --manifest to say who owns the expenses.'))
+            return
+
+        paths = self.find_files(path)
+        if not paths:
+            self.stdout.write(self.style.ERROR(f'No CSV files found at {path}'))
+            return
+
+        if len(paths) == 1 and not options['manifest']:
+            self.import_file(paths[0], options)
+        else:
+            self.import_many(paths, options)
+
+    def find_files(self, path):
+        if os.path.isdir(path):
+            return sorted(glob.glob(os.path.join(path, '*.csv')))
+        if os.path.isfile(path):
+            return [path]
+        return sorted(p for p in glob.glob(path, recursive=True) if os.path.isfile(p))
+
+    def import_file(self, path, options):
+        """Stream a single file through the batch importer"""
+        user = self.get_user(options['username'])
+        if user is None:
             return
-        with open(path, newline='', encoding='utf-8') as f:
+
+        importer = self.get_importer(user, options)
+        # utf-8-sig like the uploads and parse_csv_file, so a BOM does not end up in the first column name
+        with open(path, newline='', encoding='utf-8-sig') as f:
             reader = csv.DictReader(f, delimiter=';')
-            
+
             # Debug: Print column names to see what we're working with
             self.stdout.write(f"CSV columns: {list(reader.fieldnames)}")
-            
-            for row in reader:
-                # Parse date from DD/MM/YY format to YYYY-MM-DD
-                date_str = row['Date (MM-DD-YYYY)']
-                if '/' in date_str:
-                    # Handle DD/MM/YY format
-                    day, month, year = date_str.split('/')
-                    # Convert 2-digit year to 4-digit year (assuming 20xx for years 00-99)
-                    if len(year) == 2:
-                        year = '20' + year
-                    # Reformat to MM-DD-YYYY for datetime parsing
-                    date_str = f"{month}-{day}-{year}"
-                
-                try:
-                    date_obj = datetime.strptime(date_str, '%m-%d-%Y').date()
-                except ValueError as e:
-                    self.stdout.write(
-                        self.style.ERROR(f'Invalid date format: {row["Date (MM-DD-YYYY)"]} - {e}')
-                    )
-                    continue
-                
-                # Parse amount - handle multiple amount columns and find the non-zero one
-                amount = 0.0
-                amount_columns = ['$ Amount', 'INDISPENSABILE', 'EVITABILE']
-                
-                for col in amount_columns:
-                    if col in row and row[col]:
-                        amount_str = str(row[col]).replace('$', '').replace(',', '').replace('--', '0')
-                        try:
-                            temp_amount = float(amount_str)
-                            if temp_amount > 0:
-                                amount = temp_amount
-                                break
-                        except ValueError:
-                            continue
-                
-                if amount == 0.0:
-                    self.stdout.write(
-                        self.style.WARNING(f'No valid amount found for: {row["Store / Vendor"]} on {date_obj}')
-                    )
-                    continue
-                
-                # Determine category based on flag columns
-                category = row['Expense Category']
-                if not category or category.strip() == '':
-                    # Auto-determine category based on flags
-                    if row['Holidays'].upper() == 'TRUE':
-                        category = 'Holidays'
-                    elif row['Regali'].upper() == 'TRUE':
-                        category = 'Regali'
-                    elif row['Mediche'].upper() == 'TRUE':
-                        category = 'Mediche'
-                    elif row['Abbigl.'].upper() == 'TRUE':
-                        category = 'Abbigliamento'
-                    elif row['Bollette'].upper() == 'TRUE':
-                        category = 'Bollette'
-                    elif row['Affitto'].upper() == 'TRUE':
-                        category = 'Affitto'
+
+            importer.run(reader)
+
+        self.stdout.write(importer.summary())
+        self.report_conflicts([importer], options)
+        self.stdout.write(self.style.SUCCESS(f'Successfully imported expenses from {path}'))
+
+    def import_many(self, paths, options):
+        """Parse files in a process pool and write them serially, one importer per user"""
+        owners = self.assign_owners(paths, options)
+        if owners is None:
+            return
+
+        importers = {}
+        for path, username in owners.items():
+            if username not in importers:
+                user = self.get_user(username)
+                if user is None:
+                    return
+                importers[username] = self.get_importer(user, options)
+
+        started = time.perf_counter()
+        write_time = 0.0
+        total_rows = 0
+        workers = max(1, min(options['workers'], len(owners)))
+        self.stdout.write(f'Parsing {len(owners)} files with {workers} workers')
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            futures = [pool.submit(parse_csv_file, path) for path in owners]
+            # Writes happen here in the parent as results arrive, so only one
+            # connection ever writes and each user's rows go through one importer
+            for future in as_completed(futures):
+                path, rows = future.result()
+                importer = importers[owners[path]]
+                write_started = time.perf_counter()
+                dates = [row['date'] for row in rows if not isinstance(row, RowError)]
+                if dates:
+                    # The whole file is known, so its date span is loaded in one query
+                    importer.preload(min(dates), max(dates))
+                # In file order, so rows are numbered as import_file numbers them
+                importer.start_file(os.path.basename(path))
+                for row in rows:
+                    if isinstance(row, RowError):
+                        importer.skip(str(row))
                     else:
-                        category = 'Other'
-                
-                # Create category if it doesn't exist
-                if category and category.strip():
-                    category_obj, category_created = UserCategory.objects.get_or_create(
-                        user=user,
-                        name=category.strip()
-                    )
-                    if category_created:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'Created new category: {category}')
-                        )
-                
-                # Handle subcategory
-                subcategory = row.get('SubCategory', '').strip()
-                subcategory_obj = None
-                if subcategory and category_obj:
-                    subcategory_obj, subcategory_created = UserSubcategory.objects.get_or_create(
-                        user=user,
-                        category=category_obj,
-                        name=subcategory
-                    )
-                    if subcategory_created:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'Created new subcategory: {category} > {subcategory}')
-                        )
-                
-                # Handle vendor field - some rows have empty vendor
-                vendor = row['Store / Vendor']
-                if not vendor or vendor.strip() == '':
-                    vendor = 'Unknown Vendor'
-                
-                Expense.objects.update_or_create(
-                    date=date_obj,
-                    vendor=vendor,
-                    user=user,
-                    exclude=(row['Escludi'].upper() in ['TRUE', '1', 'YES']),
-                    indispensable=(row['INDISPENSABILE'].upper() in ['TRUE', '1', 'YES']),
-                    avoidable=(row['EVITABILE'].upper() in ['TRUE', '1', 'YES']),
-                    amount=amount,
-                    category=category_obj.name if category_obj else category,
-                    subcategory=subcategory_obj.name if subcategory_obj else subcategory,
-                    notes=row.get('Notes (Optional)', '')
-                )
-                
+                        importer.add_parsed(row)
+                importer.flush()
+                write_time += time.perf_counter() - write_started
+                total_rows += len(rows)
                 self.stdout.write(
-                    self.style.SUCCESS(f'Imported: {date_obj} - {vendor} - €{amount}')
+                    f'{path} -> {owners[path]}: {len(dates)} rows parsed, {len(rows) - len(dates)} skipped'
                 )
-        
-        self.stdout.write(self.style.SUCCESS(f'Successfully imported expenses from {path}'))
+
+        for username, importer in importers.items():
+            importer.finish()
+            self.stdout.write(f'{username}: {importer.summary()}')
+        self.report_conflicts(importers.values(), options)
+
+        elapsed = time.perf_counter() - started
+        rate = total_rows / elapsed if elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total_rows} rows from {len(owners)} files in {elapsed:.2f}s '
+            f'({rate:.0f} rows/sec overall, {write_time:.2f}s writing)'
+        ))
+
+    def assign_owners(self, paths, options):
+        """Map each file to a username using the manifest, falling back to --username"""
+        manifest = {}
+        if options['manifest']:
+            try:
+                with open(options['manifest'], encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                self.stdout.write(self.style.ERROR(f'Could not read manifest {options["manifest"]}: {e}'))
+                return None
+
+        owners = {}
+        for path in paths:
+            username = options['username']
+            for pattern, owner in manifest.items():
+                if fnmatch.fnmatch(os.path.basename(path), pattern) or fnmatch.fnmatch(path, pattern):
+                    username = owner
+                    break
+            if username:
+                owners[path] = username
+            else:
+                self.stdout.write(self.style.WARNING(f'No user mapped for {path}, skipping'))
+        return owners
+
+    def get_importer(self, user, options):
+        return BatchImporter(
+            user,
+            batch_size=options['batch_size'],
+            log=self.log,
+            verbose=options['verbosity'] >= 2,
+            on_conflict=options['on_conflict'],
+            # The report file gets every conflict, the console only the first ones
+            conflict_limit=None if options['conflict_report'] else MAX_REPORTED_CONFLICTS,
+        )
+
+    def report_conflicts(self, importers, options):
+        """Print the conflicting rows and optionally write them to --conflict-report"""
+        conflicts = [(importer.user.username, conflict) for importer in importers for conflict in importer.conflict_report]
+        if not conflicts:
+            return
+        action = 'overwritten' if options['on_conflict'] == ON_CONFLICT_UPDATE else 'left unchanged'
+        self.stdout.write(self.style.WARNING(
+            f'{sum(importer.conflicts for importer in importers)} rows conflict with existing expenses ({action}):'
+        ))
+        for username, conflict in conflicts[:MAX_REPORTED_CONFLICTS]:
+            changes = ', '.join(f'{name}: {old!r} -> {new!r}' for name, (old, new) in conflict['changes'].items())
+            source = f"{conflict['file']} " if conflict.get('file') else ''
+            self.stdout.write(
+                f"  {username} {source}row {conflict['row']}: {conflict['date']} {conflict['vendor']} "
+                f"{conflict['amount']} ({changes})"
+            )
+        if options['conflict_report']:
+            with open(options['conflict_report'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['user', 'file', 'row', 'date', 'vendor', 'amount', 'field', 'existing', 'imported'])
+                for username, conflict in conflicts:
+                    for name, (old, new) in conflict['changes'].items():
+                        writer.writerow([
+                            username, conflict.get('file') or '', conflict['row'], conflict['date'], conflict['vendor'],
+                            conflict['amount'], name, old, new,
+                        ])
+            self.stdout.write(f"Conflict report written to {options['conflict_report']}")
+
+    def get_user(self, username):
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'User "{username}" does not exist. Please create the user first.')
+            )
+            return None
+
+    def log(self, level, message):
+        self.stdout.write(getattr(self.style, level)(message))
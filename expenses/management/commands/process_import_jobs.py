@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from expenses.jobs import reclaim_stale_jobs, run_job
+from expenses.models import ImportJob
+
+class Command(BaseCommand):
+    help = 'Run queued CSV import jobs, and jobs whose process stopped, in this process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='Keep polling for new jobs instead of exiting')
+        parser.add_argument('--interval', type=float, default=2.0, help='Polling interval in seconds for --watch')
+
+    def handle(self, *args, **options):
+        while True:
+            # Only jobs without a recent heartbeat; live ones belong to another process
+            count = reclaim_stale_jobs()
+            if count:
+                self.stdout.write(f'Requeued {count} interrupted jobs')
+            pending = list(ImportJob.objects.filter(status=ImportJob.STATUS_PENDING).order_by('created_at').values_list('id', flat=True))
+            for job_id in pending:
+                if not run_job(job_id):
+                    continue
+                job = ImportJob.objects.get(pk=job_id)
+                style = self.style.SUCCESS if job.status == ImportJob.STATUS_DONE else self.style.ERROR
+                self.stdout.write(style(
+                    f'Job {job.id} ({job.filename}): {job.status} - {job.rows_processed} rows, '
+                    f'{job.rows_per_second:.0f} rows/sec'
+                ))
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from expenses.cache import bump_data_version
+from expenses.rollups import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'Recompute daily and monthly expense rollups from the expense table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User "{options["username"]}" does not exist.'))
+                return
+
+        for user in users.iterator():
+            count = rebuild_rollups(user)
+            bump_data_version(user)
+            self.stdout.write(f'{user.username}: {count} rollup rows')
+        self.stdout.write(self.style.SUCCESS('Rollups rebuilt'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from expenses.search import install_search_index
+
+class Command(BaseCommand):
+    help = 'Recreate the SQLite full-text index of expense vendors and notes'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING('Full-text search needs SQLite; other databases use icontains.'))
+            return
+        install_search_index(connection)
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from expenses.categorizer import rebuild_vendor_index
+
+class Command(BaseCommand):
+    help = 'Recompute the learned vendor -> category counts from the expense table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, help='Only rebuild this user (default: all users)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['username']:
+            users = users.filter(username=options['username'])
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User "{options["username"]}" does not exist.'))
+                return
+
+        for user in users.iterator():
+            count = rebuild_vendor_index(user)
+            self.stdout.write(f'{user.username}: {count} vendor counts')
+        self.stdout.write(self.style.SUCCESS('Vendor index rebuilt'))
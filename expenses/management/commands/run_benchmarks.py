@@ -0,0 +1,229 @@
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.urls import reverse
+from expenses.benchmark import create_session, session_cookie, wsgi_get
+from expenses.bulk import bulk_delete_expenses
+from expenses.importer import import_upload
+from expenses.models import Expense, UserCategory
+from expenses.synthetic import default_span, write_csv
+from expenses.utils import QueryCounter, percentiles
+
+CASES = (
+    'list', 'list_filtered', 'list_search', 'calendar_month', 'day_detail', 'form_add', 'form_edit', 'csv_import',
+)
+
+class Command(BaseCommand):
+    help = (
+        'Time the main pages and the CSV import for one user and write the results (latency percentiles, '
+        'query counts, response sizes) to a JSON file. Pass --compare with an earlier file to see regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', type=str, required=True, help='User whose pages are requested')
+        parser.add_argument('--output', type=str, default='benchmark-results.json', help='JSON file to write')
+        parser.add_argument('--repeat', type=int, default=20, help='Measured requests per case')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests before each case')
+        parser.add_argument(
+            '--cold', action='store_true', help='Clear the cache before every request (no cached summaries)'
+        )
+        parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES), help='Cases to run')
+        parser.add_argument('--import-rows', type=int, default=2000, help='Rows in the generated import file')
+        parser.add_argument('--import-repeat', type=int, default=3, help='Measured imports')
+        parser.add_argument('--compare', type=str, help='Earlier results file to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=10.0,
+            help='Percent slowdown of the median (or any extra query) reported as a regression'
+        )
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions')
+        parser.add_argument('--host', type=str, default='localhost', help='Host header sent with every request')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+        expense = Expense.objects.for_user(user).order_by('-date', '-created_at').first()
+        if expense is None:
+            raise CommandError(f'User "{user.username}" has no expenses; create some with generate_expenses.')
+
+        self.application = get_wsgi_application()
+        self.host = options['host']
+        session = create_session(user)
+        self.cookie = session_cookie(session)
+        try:
+            results = {}
+            for name in options['cases']:
+                if name == 'csv_import':
+                    results[name] = self.run_import(options)
+                else:
+                    results[name] = self.run_page(self.path(name, user, expense), options)
+                self.report(name, results[name])
+        finally:
+            session.delete()
+
+        data = {'meta': self.meta(user, options), 'results': results}
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['compare']:
+            regressions = self.compare(options['compare'], results, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} regressions against {options["compare"]}')
+
+    def path(self, name, user, expense):
+        day = expense.date
+        list_url = reverse('expenses:list')
+        if name == 'list':
+            return list_url
+        if name == 'list_filtered':
+            return (
+                f'{list_url}?date_after={day.year - 1}-{day.month:02d}-01&date_before={day.isoformat()}'
+                f'&amount_min=10&amount_max=500&category={expense.category_id}'
+            )
+        if name == 'list_search':
+            return f'{list_url}?q={expense.vendor.split()[0]}'
+        if name == 'calendar_month':
+            return f"{reverse('expenses:calendar')}?year={day.year}&month={day.month}"
+        if name == 'day_detail':
+            return reverse('expenses:expenses-by-date', args=[day.isoformat()])
+        if name == 'form_add':
+            return reverse('expenses:add')
+        return reverse('expenses:edit', args=[expense.pk])
+
+    def run_page(self, path, options):
+        for _ in range(options['warmup']):
+            wsgi_get(self.application, path, self.host, self.cookie)
+        timings = []
+        queries = []
+        for _ in range(options['repeat']):
+            if options['cold']:
+                cache.clear()
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                status, size = wsgi_get(self.application, path, self.host, self.cookie)
+                timings.append(time.perf_counter() - started)
+            queries.append(counter.count)
+            if status != 200:
+                raise CommandError(f'GET {path} returned {status}')
+        return {'path': path, 'bytes': size, 'queries': max(queries), **self.stats(timings)}
+
+    def run_import(self, options):
+        """Import a generated CSV into a throwaway user, once per repeat"""
+        buffer = io.StringIO()
+        write_csv(buffer, options['import_rows'], *default_span(1), seed=1)
+        content = buffer.getvalue().encode('utf-8')
+        timings = []
+        queries = []
+        for _ in range(options['import_repeat']):
+            user = User.objects.create_user(f'benchmark-{uuid.uuid4().hex[:12]}')
+            try:
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    result = import_upload(user, io.BytesIO(content))
+                    timings.append(time.perf_counter() - started)
+                queries.append(counter.count)
+            finally:
+                bulk_delete_expenses(user, Expense.objects.for_user(user))
+                UserCategory.objects.filter(user=user).delete()
+                user.delete()
+        stats = self.stats(timings)
+        return {
+            'rows': options['import_rows'],
+            'created': result.created,
+            'queries': max(queries),
+            'rows_per_second': round(options['import_rows'] / (stats['median_ms'] / 1000), 1),
+            **stats,
+        }
+
+    def stats(self, timings):
+        cuts = percentiles(timings)
+        return {
+            'runs': len(timings),
+            'min_ms': round(min(timings) * 1000, 2),
+            'median_ms': round(statistics.median(timings) * 1000, 2),
+            'mean_ms': round(statistics.mean(timings) * 1000, 2),
+            'p95_ms': round(cuts['p95'], 2),
+            'max_ms': round(max(timings) * 1000, 2),
+        }
+
+    def meta(self, user, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR,
+                timeout=10,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        meta = {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'database': connection.vendor,
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'username': user.username,
+            'expenses': Expense.objects.for_user(user).count(),
+            'repeat': options['repeat'],
+            'cold_cache': options['cold'],
+        }
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT sqlite_version()')
+                meta['sqlite'] = cursor.fetchone()[0]
+        return meta
+
+    def report(self, name, result):
+        line = (
+            f"{name:<15} median {result['median_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  "
+            f"{result['queries']:>4} queries"
+        )
+        if 'rows_per_second' in result:
+            line += f"  {result['rows_per_second']:.0f} rows/sec"
+        self.stdout.write(line)
+
+    def compare(self, path, results, threshold):
+        """Print the change of every case against an earlier run; returns the number of regressions"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                previous = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+
+        regressions = 0
+        self.stdout.write(f'Compared with {path}:')
+        for name, result in results.items():
+            before = previous.get(name)
+            if before is None:
+                self.stdout.write(f'{name:<15} (new)')
+                continue
+            change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+            extra_queries = result['queries'] - before['queries']
+            line = (
+                f"{name:<15} {before['median_ms']:>9.2f} -> {result['median_ms']:>9.2f} ms ({change:+.1f}%)  "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
+            if change > threshold or extra_queries > 0:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f'{line}  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        return regressions
@@ -0,0 +1,81 @@
+import io
+import pstats
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from expenses.profiling import STATS_SUFFIX, list_profiles, profile_dir
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    help = (
+        'List the profiles saved by the sampling profiler (REQUEST_PROFILING), or print the top functions '
+        'of one profile, or of all listed profiles combined'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_ids', nargs='*', help='Profiles to print (ids or unique id prefixes)')
+        parser.add_argument('--dir', type=str, help='Profile directory (default: settings.PROFILE_DIR)')
+        parser.add_argument('--name', type=str, help='Only profiles of this URL name, e.g. expenses:calendar')
+        parser.add_argument('--user-id', type=int, help='Only profiles of this user')
+        parser.add_argument('--min-ms', type=float, default=0, help='Only profiles at least this slow')
+        parser.add_argument('--limit', type=int, default=20, help='Profiles listed')
+        parser.add_argument(
+            '--combine', action='store_true', help='Print the top functions of all matching profiles added together'
+        )
+        parser.add_argument('--top', type=int, default=25, help='Functions printed per profile')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative', help='Order of the printed functions')
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir']) if options['dir'] else profile_dir()
+        profiles = [
+            meta for meta in list_profiles(directory)
+            if (not options['name'] or meta['name'] == options['name'])
+            and (options['user_id'] is None or meta['user_id'] == options['user_id'])
+            and meta['duration_ms'] >= options['min_ms']
+        ]
+
+        if options['profile_ids']:
+            for profile_id in options['profile_ids']:
+                self.print_stats([self.find(profiles, profile_id)], options)
+        elif options['combine']:
+            if not profiles:
+                raise CommandError(f'No matching profiles in {directory}')
+            self.print_stats(profiles, options)
+        else:
+            self.list(profiles[:options['limit']], len(profiles), directory)
+
+    def find(self, profiles, profile_id):
+        matches = [meta for meta in profiles if meta['id'].startswith(profile_id)]
+        if len(matches) != 1:
+            raise CommandError(f'{len(matches)} profiles match "{profile_id}"; give a longer id.')
+        return matches[0]
+
+    def list(self, profiles, total, directory):
+        if not profiles:
+            self.stdout.write(f'No profiles in {directory}')
+            return
+        self.stdout.write(
+            f"{'id':<58} {'name':<28} {'user':>6} {'ms':>9} {'queries':>8} {'samples':>8} reason"
+        )
+        for meta in profiles:
+            self.stdout.write(
+                f"{meta['id']:<58} {meta['name']:<28} {meta['user_id'] if meta['user_id'] is not None else '-':>6} "
+                f"{meta['duration_ms']:>9.1f} {meta['queries']:>8} {meta['samples']:>8} {meta['reason']}"
+            )
+        if total > len(profiles):
+            self.stdout.write(f'... {total - len(profiles)} more, see --limit')
+
+    def print_stats(self, profiles, options):
+        for meta in profiles:
+            details = ', '.join(f'{key}={value}' for key, value in meta.items() if key not in ('id', 'stats_path'))
+            self.stdout.write(f"{meta['id']}: {details}")
+        paths = [meta['stats_path'] for meta in profiles]
+        if not all(Path(path).exists() for path in paths):
+            raise CommandError(f'Missing {STATS_SUFFIX} file for one of the profiles')
+        # pstats prints piecewise, and the command's stdout would end every piece with a newline
+        output = io.StringIO()
+        stats = pstats.Stats(*paths, stream=output)
+        stats.sort_stats(options['sort']).print_stats(options['top'])
+        self.stdout.write(output.getvalue())
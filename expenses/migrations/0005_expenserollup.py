@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+DIMENSIONS = ('category', 'subcategory', 'exclude', 'indispensable', 'avoidable')
+
+
+def backfill_rollups(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseRollup = apps.get_model('expenses', 'ExpenseRollup')
+    expenses = Expense.objects.order_by()
+    rows = []
+    for item in expenses.values('user_id', 'date', *DIMENSIONS).annotate(total=Sum('amount'), count=Count('id')):
+        rows.append(ExpenseRollup(period='day', period_start=item.pop('date'), **item))
+    for item in expenses.annotate(month=TruncMonth('date')).values('user_id', 'month', *DIMENSIONS).annotate(
+        total=Sum('amount'), count=Count('id')
+    ):
+        rows.append(ExpenseRollup(period='month', period_start=item.pop('month'), **item))
+    ExpenseRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0004_expense_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('category', models.CharField(max_length=100)),
+                ('subcategory', models.CharField(blank=True, max_length=100)),
+                ('exclude', models.BooleanField(default=False)),
+                ('indispensable', models.BooleanField(default=False)),
+                ('avoidable', models.BooleanField(default=False)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['period', 'period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'period_start', 'category', 'subcategory', 'exclude', 'indispensable', 'avoidable'), name='unique_expense_rollup'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
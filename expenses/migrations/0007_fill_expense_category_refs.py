@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def fill_refs(apps, schema_editor):
+    """Point every expense at the UserCategory/UserSubcategory named by its text columns"""
+    Expense = apps.get_model('expenses', 'Expense')
+    UserCategory = apps.get_model('expenses', 'UserCategory')
+    UserSubcategory = apps.get_model('expenses', 'UserSubcategory')
+
+    combinations = Expense.objects.order_by().values_list('user_id', 'category', 'subcategory').distinct()
+    for user_id, category_name, subcategory_name in combinations:
+        category, _ = UserCategory.objects.get_or_create(user_id=user_id, name=category_name or 'Other')
+        subcategory = None
+        if subcategory_name:
+            subcategory, _ = UserSubcategory.objects.get_or_create(
+                user_id=user_id, category=category, name=subcategory_name
+            )
+        Expense.objects.filter(
+            user_id=user_id, category=category_name, subcategory=subcategory_name
+        ).update(category_ref=category, subcategory_ref=subcategory)
+
+
+def clear_rollups(apps, schema_editor):
+    # Rollups are keyed by category names until 0008; they are rebuilt by id in 0009
+    apps.get_model('expenses', 'ExpenseRollup').objects.all().delete()
+
+
+def fill_names(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    for expense in Expense.objects.select_related('category_ref', 'subcategory_ref').iterator():
+        expense.category = expense.category_ref.name if expense.category_ref else ''
+        expense.subcategory = expense.subcategory_ref.name if expense.subcategory_ref else ''
+        expense.save(update_fields=['category', 'subcategory'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_expense_category_refs'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_refs, fill_names),
+        migrations.RunPython(clear_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_names(apps, schema_editor):
+    """Reverse only: the re-added name columns take the names of the referenced rows"""
+    Expense = apps.get_model('expenses', 'Expense')
+    UserCategory = apps.get_model('expenses', 'UserCategory')
+    UserSubcategory = apps.get_model('expenses', 'UserSubcategory')
+    Expense.objects.update(
+        category=Coalesce(
+            Subquery(UserCategory.objects.filter(pk=OuterRef('category_ref')).values('name')[:1]), Value('')
+        ),
+        subcategory=Coalesce(
+            Subquery(UserSubcategory.objects.filter(pk=OuterRef('subcategory_ref')).values('name')[:1]), Value('')
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_fill_expense_category_refs'),
+    ]
+
+    operations = [
+        # Nullable while they are dropped, so that migrating back can re-add the
+        # columns to a table with rows and fill them before they become NOT NULL
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.CharField(max_length=100, null=True, verbose_name='Expense Category'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='subcategory',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='SubCategory'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, fill_names),
+        migrations.RemoveField(
+            model_name='expense',
+            name='category',
+        ),
+        migrations.RemoveField(
+            model_name='expense',
+            name='subcategory',
+        ),
+        migrations.RenameField(
+            model_name='expense',
+            old_name='category_ref',
+            new_name='category',
+        ),
+        migrations.RenameField(
+            model_name='expense',
+            old_name='subcategory_ref',
+            new_name='subcategory',
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='expenses', to='expenses.usercategory', verbose_name='Expense Category'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='subcategory',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='expenses', to='expenses.usersubcategory', verbose_name='SubCategory'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'category', 'date'], name='expense_user_cat_date_idx'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='expenserollup',
+            name='unique_expense_rollup',
+        ),
+        migrations.RemoveField(
+            model_name='expenserollup',
+            name='category',
+        ),
+        migrations.RemoveField(
+            model_name='expenserollup',
+            name='subcategory',
+        ),
+        migrations.AddField(
+            model_name='expenserollup',
+            name='category',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.usercategory'),
+        ),
+        migrations.AlterField(
+            model_name='expenserollup',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.usercategory'),
+        ),
+        migrations.AddField(
+            model_name='expenserollup',
+            name='subcategory',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rollups', to='expenses.usersubcategory'),
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(fields=('user', 'period', 'period_start', 'category', 'subcategory', 'exclude', 'indispensable', 'avoidable'), name='unique_expense_rollup'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+DIMENSIONS = ('category_id', 'subcategory_id', 'exclude', 'indispensable', 'avoidable')
+
+
+def backfill_rollups(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    ExpenseRollup = apps.get_model('expenses', 'ExpenseRollup')
+    expenses = Expense.objects.order_by()
+    rows = []
+    for item in expenses.values('user_id', 'date', *DIMENSIONS).annotate(total=Sum('amount'), count=Count('id')):
+        rows.append(ExpenseRollup(period='day', period_start=item.pop('date'), **item))
+    for item in expenses.annotate(month=TruncMonth('date')).values('user_id', 'month', *DIMENSIONS).annotate(
+        total=Sum('amount'), count=Count('id')
+    ):
+        rows.append(ExpenseRollup(period='month', period_start=item.pop('month'), **item))
+    ExpenseRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+def clear_rollups(apps, schema_editor):
+    apps.get_model('expenses', 'ExpenseRollup').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0008_expense_category_fk'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, clear_rollups),
+    ]
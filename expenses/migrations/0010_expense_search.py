@@ -0,0 +1,56 @@
+from django.db import migrations
+
+FTS_TABLE = 'expenses_expense_fts'
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        vendor, notes, content='expenses_expense', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_insert AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, vendor, notes) VALUES (new.id, new.vendor, new.notes);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_delete AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, notes) VALUES ('delete', old.id, old.vendor, old.notes);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_update AFTER UPDATE OF vendor, notes ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, notes) VALUES ('delete', old.id, old.vendor, old.notes);
+        INSERT INTO {FTS_TABLE}(rowid, vendor, notes) VALUES (new.id, new.vendor, new.notes);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    # Statistics let the planner start from the full-text match rather than the date index
+    'ANALYZE',
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_insert',
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_delete',
+    'DROP TRIGGER IF EXISTS expenses_expense_fts_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite only; other backends search with icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0009_rebuild_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
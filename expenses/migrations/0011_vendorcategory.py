@@ -0,0 +1,70 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:54
+
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+MAX_PREFIX_TOKENS = 3
+
+
+def vendor_keys(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char)).lower()
+    tokens = [token for token in re.split(r'[\W_]+', name) if token and not token.isdigit()]
+    if not tokens:
+        return []
+    keys = [' '.join(tokens)]
+    for length in range(min(len(tokens) - 1, MAX_PREFIX_TOKENS), 0, -1):
+        keys.append(' '.join(tokens[:length]))
+    return keys
+
+
+def backfill_vendor_counts(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    VendorCategory = apps.get_model('expenses', 'VendorCategory')
+    counts = defaultdict(int)
+    for item in Expense.objects.order_by().values('user_id', 'vendor', 'category_id', 'subcategory_id').annotate(
+        count=Count('id')
+    ):
+        for key in vendor_keys(item['vendor']):
+            counts[(item['user_id'], key, item['category_id'], item['subcategory_id'])] += item['count']
+    VendorCategory.objects.bulk_create(
+        [
+            VendorCategory(user_id=user_id, vendor=vendor, category_id=category_id,
+                           subcategory_id=subcategory_id, count=count)
+            for (user_id, vendor, category_id, subcategory_id), count in counts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0010_expense_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vendor', models.CharField(max_length=255)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_counts', to='expenses.usercategory')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='vendor_counts', to='expenses.usersubcategory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_categories', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='vendorcategory',
+            constraint=models.UniqueConstraint(fields=('user', 'vendor', 'category', 'subcategory'), name='unique_vendor_category'),
+        ),
+        migrations.RunPython(backfill_vendor_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:50
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+ROLLUP_KEY = ('user_id', 'period', 'period_start', 'category_id', 'exclude', 'indispensable', 'avoidable')
+VENDOR_KEY = ('user_id', 'vendor', 'category_id')
+
+
+def _merge(model, key, sums):
+    """Fold rows without a subcategory that share a key into the one with the lowest id"""
+    duplicates = model.objects.filter(subcategory__isnull=True).order_by().values(*key).annotate(
+        rows=Count('id'), keep=Min('id'), **{name: Sum(name) for name in sums}
+    ).filter(rows__gt=1)
+    for group in duplicates:
+        rows = model.objects.filter(subcategory__isnull=True, **{name: group[name] for name in key})
+        rows.exclude(pk=group['keep']).delete()
+        rows.filter(pk=group['keep']).update(**{name: group[name] for name in sums})
+
+
+def merge_duplicates(apps, schema_editor):
+    _merge(apps.get_model('expenses', 'ExpenseRollup'), ROLLUP_KEY, ('total', 'count'))
+    _merge(apps.get_model('expenses', 'VendorCategory'), VENDOR_KEY, ('count',))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('subcategory__isnull', True)), fields=('user', 'period', 'period_start', 'category', 'exclude', 'indispensable', 'avoidable'), name='unique_expense_rollup_no_subcategory'),
+        ),
+        migrations.AddConstraint(
+            model_name='vendorcategory',
+            constraint=models.UniqueConstraint(condition=models.Q(('subcategory__isnull', True)), fields=('user', 'vendor', 'category'), name='unique_vendor_category_no_subcategory'),
+        ),
+    ]
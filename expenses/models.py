@@ -43,8 +43,13 @@ class Expense(models.Model):
     indispensable = models.BooleanField(default=False, verbose_name="Spesa indispensabile")
     avoidable = models.BooleanField(default=False, verbose_name="Spesa evitabile")
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="$ Amount")
-    category = models.CharField(max_length=100, verbose_name="Expense Category")
-    subcategory = models.CharField(max_length=100, blank=True, verbose_name="SubCategory")
+    category = models.ForeignKey(
+        UserCategory, on_delete=models.PROTECT, related_name='expenses', verbose_name="Expense Category"
+    )
+    subcategory = models.ForeignKey(
+        UserSubcategory, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='expenses', verbose_name="SubCategory"
+    )
     notes = models.TextField(blank=True, verbose_name="Notes (Optional)")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -54,6 +59,146 @@ class Expense(models.Model):
     class Meta:
         ordering = ['-date', '-created_at']
         unique_together = ['user', 'date', 'vendor', 'amount']  # Prevent duplicate entries
+        indexes = [
+            # List ordering/keyset pages, date ranges, calendar and day detail
+            models.Index(fields=['user', 'date', 'created_at'], name='expense_user_date_idx'),
+            # Category breakdowns and category filters within a date range
+            models.Index(fields=['user', 'category', 'date'], name='expense_user_cat_date_idx'),
+            # Amount filters and min/max for the amount slider
+            models.Index(fields=['user', 'amount'], name='expense_user_amount_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date} – {self.vendor}: {self.amount}"
+
+class ImportJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    csv_file = models.FileField(upload_to='imports/', blank=True)
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rows_processed = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    unchanged_count = models.PositiveIntegerField(default=0)
+    conflict_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    conflicts = models.JSONField(default=list, blank=True)
+    new_categories = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # The host:pid running the job, and when it last reported being alive
+    owner = models.CharField(max_length=255, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.filename} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    @property
+    def elapsed(self):
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        return (end - self.started_at).total_seconds()
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return self.rows_processed / elapsed if elapsed else 0.0
+
+class ExpenseRollup(models.Model):
+    """Running totals of a user's expenses per day or month, one row per category/flag combination"""
+    PERIOD_DAY = 'day'
+    PERIOD_MONTH = 'month'
+    PERIOD_CHOICES = [
+        (PERIOD_DAY, 'Day'),
+        (PERIOD_MONTH, 'Month'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    category = models.ForeignKey(UserCategory, on_delete=models.CASCADE, related_name='rollups')
+    subcategory = models.ForeignKey(
+        UserSubcategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollups'
+    )
+    exclude = models.BooleanField(default=False)
+    indispensable = models.BooleanField(default=False)
+    avoidable = models.BooleanField(default=False)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['period', 'period_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start', 'category', 'subcategory', 'exclude', 'indispensable', 'avoidable'],
+                name='unique_expense_rollup',
+            ),
+            # NULLs never compare equal, so rows without a subcategory need their own constraint
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start', 'category', 'exclude', 'indispensable', 'avoidable'],
+                condition=models.Q(subcategory__isnull=True),
+                name='unique_expense_rollup_no_subcategory',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.period} {self.period_start} - {self.category_id}: {self.total}"
+
+    @property
+    def key(self):
+        return (self.period, self.period_start, self.category_id, self.subcategory_id,
+                self.exclude, self.indispensable, self.avoidable)
+
+class VendorCategory(models.Model):
+    """How often a user filed a (normalized) vendor name under a category/subcategory"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='vendor_categories')
+    # Normalized vendor name, or one of its leading-token prefixes
+    vendor = models.CharField(max_length=255)
+    category = models.ForeignKey(UserCategory, on_delete=models.CASCADE, related_name='vendor_counts')
+    subcategory = models.ForeignKey(
+        UserSubcategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='vendor_counts'
+    )
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'vendor', 'category', 'subcategory'],
+                name='unique_vendor_category',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'vendor', 'category'],
+                condition=models.Q(subcategory__isnull=True),
+                name='unique_vendor_category_no_subcategory',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.vendor} -> {self.category_id}: {self.count}"
+
+    @property
+    def key(self):
+        return (self.vendor, self.category_id, self.subcategory_id)
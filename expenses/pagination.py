@@ -0,0 +1,113 @@
+"""
+Keyset (seek) pagination for expense querysets.
+
+Pages are addressed by the (date, created_at, id) of the last or first row
+shown rather than by an OFFSET, so every page is a bounded index seek and
+rows inserted meanwhile never shift what the next page shows. id breaks
+ties between rows created in the same instant (e.g. by bulk_create).
+"""
+import base64
+import json
+from datetime import date
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Expense.Meta.ordering plus a unique tie-breaker
+ORDERING = ('-date', '-created_at', '-id')
+REVERSE_ORDERING = ('date', 'created_at', 'id')
+
+
+def encode_cursor(expense):
+    payload = [expense.date.isoformat(), expense.created_at.isoformat(), expense.id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (date, created_at, id) from a cursor token, or None if it is malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw_date, raw_created, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(raw_created)
+        if created_at is None:
+            return None
+        return date.fromisoformat(raw_date), created_at, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _after(cursor):
+    # Rows that come after the cursor in (-date, -created_at, -id) order. The
+    # plain date bound is redundant but lets the database seek the
+    # (user, date, created_at) index instead of scanning the newer rows.
+    d, created_at, pk = cursor
+    return Q(date__lte=d) & (
+        Q(date__lt=d)
+        | Q(date=d, created_at__lt=created_at)
+        | Q(date=d, created_at=created_at, id__lt=pk)
+    )
+
+
+def _before(cursor):
+    d, created_at, pk = cursor
+    return Q(date__gte=d) & (
+        Q(date__gt=d)
+        | Q(date=d, created_at__gt=created_at)
+        | Q(date=d, created_at=created_at, id__gt=pk)
+    )
+
+
+def get_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    def __init__(self, object_list, page_size, has_next, has_previous):
+        self.object_list = object_list
+        self.page_size = page_size
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+def paginate_keyset(queryset, after=None, before=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Return one KeysetPage of `queryset`.
+
+    `after` continues forward from a next_cursor, `before` goes back from a
+    previous_cursor; with neither, the first page is returned. One extra row
+    is fetched to know whether another page exists in that direction.
+    """
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    if before_key:
+        rows = list(queryset.filter(_before(before_key)).order_by(*REVERSE_ORDERING)[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return KeysetPage(rows, page_size, has_next=True, has_previous=has_previous)
+
+    if after_key:
+        queryset = queryset.filter(_after(after_key))
+    rows = list(queryset.order_by(*ORDERING)[:page_size + 1])
+    has_next = len(rows) > page_size
+    return KeysetPage(rows[:page_size], page_size, has_next=has_next, has_previous=after_key is not None)
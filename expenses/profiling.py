@@ -0,0 +1,248 @@
+"""
+Sampling profiler for slow requests and import jobs (settings.REQUEST_PROFILING).
+
+While a profiled block runs, a background thread records the Python stack of
+the block's thread every PROFILE_INTERVAL_MS. When the block took
+PROFILE_SLOW_MS or longer, or was picked as the random one in
+PROFILE_SAMPLE_RATE, the samples are written to PROFILE_DIR as a pstats file
+(<id>.prof, readable by pstats, snakeviz or the show_profiles command) next
+to a JSON file with the URL name, user id, query count and duration
+(<id>.json). Otherwise they are dropped, so a fast request only pays for the
+sampling.
+
+In the pstats file times are sample times: the cumulative time of a function
+is the time its frame was on the stack, the call counts are sample counts.
+"""
+import json
+import marshal
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .instrumentation import request_user_id
+from .utils import QueryCounter
+
+# Every profile is a pstats file plus a JSON file with its details
+STATS_SUFFIX = '.prof'
+META_SUFFIX = '.json'
+
+# Requests that do not resolve to a view (404s) are saved under this name
+UNRESOLVED = 'unresolved'
+
+
+def _code_key(code):
+    return (code.co_filename, code.co_firstlineno, getattr(code, 'co_qualname', code.co_name))
+
+
+class StackProfile:
+    """Stacks sampled from one thread, as counts of (leaf-first) code keys"""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.samples = 0
+
+    def add(self, frame, weight):
+        stack = []
+        while frame is not None:
+            stack.append(_code_key(frame.f_code))
+            frame = frame.f_back
+        self.stacks[tuple(stack)] += weight
+        self.samples += 1
+
+    def pstats(self):
+        """The samples in the dict layout pstats.Stats loads from a marshal file"""
+        stats = {}
+
+        def entry(func):
+            if func not in stats:
+                stats[func] = [0, 0, 0.0, 0.0, {}]
+            return stats[func]
+
+        for stack, weight in self.stacks.items():
+            seen = set()
+            for depth, func in enumerate(stack):
+                row = entry(func)
+                if depth == 0:
+                    row[2] += weight
+                # A recursive function is on the stack once per sample
+                if func not in seen:
+                    seen.add(func)
+                    row[0] += 1
+                    row[1] += 1
+                    row[3] += weight
+                if depth + 1 < len(stack):
+                    caller = stack[depth + 1]
+                    cc, nc, tt, ct = row[4].get(caller, (0, 0, 0.0, 0.0))
+                    row[4][caller] = (cc + 1, nc + 1, tt + (weight if depth == 0 else 0.0), ct + weight)
+        return {func: (cc, nc, tt, ct, callers) for func, (cc, nc, tt, ct, callers) in stats.items()}
+
+
+class StackSampler:
+    """One daemon thread per process sampling the threads of the blocks being profiled"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self, profile):
+        with self.lock:
+            self.active[profile.thread_id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def stop(self, profile):
+        # Taking the lock waits for a sample in progress, so the profile is complete afterwards
+        with self.lock:
+            self.active.pop(profile.thread_id, None)
+
+    def run(self):
+        interval = getattr(settings, 'PROFILE_INTERVAL_MS', 10) / 1000
+        last = time.perf_counter()
+        while True:
+            with self.lock:
+                idle = not self.active
+                if idle:
+                    self.wake.clear()
+            if idle:
+                self.wake.wait()
+                last = time.perf_counter()
+                continue
+            time.sleep(interval)
+            # Weight each sample by the time since the last one, which grows when the GIL is busy
+            now = time.perf_counter()
+            weight, last = now - last, now
+            with self.lock:
+                frames = sys._current_frames()
+                for thread_id, profile in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        profile.add(frame, weight)
+
+
+sampler = StackSampler()
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILE_DIR', Path(settings.BASE_DIR) / 'profiles'))
+
+
+class ProfiledBlock:
+    """What profiled() yields; the caller fills in details known only at the end"""
+
+    def __init__(self, name, user_id):
+        self.name = name
+        self.user_id = user_id
+        self.extra = {}
+
+
+@contextmanager
+def profiled(name, user_id=None):
+    """
+    Sample the current thread while the block runs and save the profile if
+    it is slow or randomly picked. name is the URL name or job kind.
+    """
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    picked = rate > 0 and random.randrange(rate) == 0
+    block = ProfiledBlock(name, user_id)
+    profile = StackProfile(threading.get_ident())
+    counter = QueryCounter()
+    sampler.start(profile)
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter):
+            yield block
+    finally:
+        duration = time.perf_counter() - started
+        sampler.stop(profile)
+        slow = duration * 1000 >= getattr(settings, 'PROFILE_SLOW_MS', 1000)
+        if (slow or picked) and profile.samples:
+            save_profile(profile, block, duration, counter.count, 'slow' if slow else 'sample')
+
+
+def save_profile(profile, block, duration, queries, reason):
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now:%Y%m%dT%H%M%S%f}-{block.name.replace(':', '.')}-{uuid.uuid4().hex[:8]}"
+    meta = {
+        'id': profile_id,
+        'created_at': now.isoformat(timespec='seconds'),
+        'name': block.name,
+        'user_id': block.user_id,
+        'queries': queries,
+        'duration_ms': round(duration * 1000, 1),
+        'samples': profile.samples,
+        'reason': reason,
+        **block.extra,
+    }
+    with open(directory / f'{profile_id}{STATS_SUFFIX}', 'wb') as f:
+        marshal.dump(profile.pstats(), f)
+    with open(directory / f'{profile_id}{META_SUFFIX}', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    prune_profiles(directory)
+
+
+def prune_profiles(directory):
+    """Keep the newest PROFILE_KEEP profiles"""
+    keep = getattr(settings, 'PROFILE_KEEP', 500)
+    metas = sorted(directory.glob(f'*{META_SUFFIX}'), reverse=True)
+    for path in metas[keep:]:
+        path.with_suffix(STATS_SUFFIX).unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+
+
+def maybe_profiled(name, user_id=None):
+    """profiled() when REQUEST_PROFILING is on, otherwise a context that does nothing"""
+    if getattr(settings, 'REQUEST_PROFILING', False):
+        return profiled(name, user_id)
+    return nullcontext(ProfiledBlock(name, user_id))
+
+
+def list_profiles(directory=None):
+    """Metadata of the stored profiles, newest first"""
+    directory = Path(directory) if directory else profile_dir()
+    profiles = []
+    for path in sorted(directory.glob(f'*{META_SUFFIX}'), reverse=True):
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta['stats_path'] = str(path.with_suffix(STATS_SUFFIX))
+        profiles.append(meta)
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests with profiled(). Sync only, on purpose: Django then runs
+    the rest of an async request's sync work (queries, template rendering)
+    on this middleware's thread, which is the one being sampled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profiled(UNRESOLVED) as block:
+            response = self.get_response(request)
+            match = request.resolver_match
+            block.name = match.view_name if match else UNRESOLVED
+            block.user_id = request_user_id(request)
+            block.extra = {'method': request.method, 'path': request.path, 'status': response.status_code}
+        return response
+
@@ -0,0 +1,177 @@
+"""
+Incrementally maintained expense rollups.
+
+ExpenseRollup holds, per user, the total and count of expenses for every
+day and every month, split by category, subcategory and the exclude /
+indispensable / avoidable flags. Writes to Expense turn into signed deltas
+that are added to the matching rollup rows, so reads that only need totals
+scan a few rows per day instead of every expense.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+from .cache import bump_month_versions
+from .models import Expense, ExpenseRollup
+
+DAY = ExpenseRollup.PERIOD_DAY
+MONTH = ExpenseRollup.PERIOD_MONTH
+
+# Expense fields a rollup row is split by
+DIMENSIONS = ('category_id', 'subcategory_id', 'exclude', 'indispensable', 'avoidable')
+KEY_FIELDS = ('period', 'period_start') + DIMENSIONS
+
+# Expense fields needed to compute an expense's contribution
+ROLLUP_FIELDS = ('date', 'amount') + DIMENSIONS
+
+
+def _get(row, name):
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+def collect_deltas(rows, sign=1, deltas=None):
+    """
+    Add the contribution of `rows` (Expense instances or value dicts) to
+    `deltas`, a mapping of rollup key -> [amount, count]. Use sign=-1 for
+    rows being removed or for the old state of rows being changed.
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for row in rows:
+        day = _get(row, 'date')
+        amount = Decimal(str(_get(row, 'amount')))
+        dimensions = tuple(_get(row, name) for name in DIMENSIONS)
+        for period, start in ((DAY, day), (MONTH, day.replace(day=1))):
+            entry = deltas[(period, start) + dimensions]
+            entry[0] += sign * amount
+            entry[1] += sign
+    return deltas
+
+
+def group_for_rollups(queryset):
+    """Total and count of a queryset's expenses per date and rollup dimensions"""
+    return list(queryset.order_by().values('date', *DIMENSIONS).annotate(total=Sum('amount'), count=Count('id')))
+
+
+def collect_group_deltas(groups, sign=1, deltas=None, changes=None):
+    """
+    Like collect_deltas() for rows from group_for_rollups(). `changes` maps
+    dimension names to the values the grouped expenses are being given.
+    """
+    if deltas is None:
+        deltas = defaultdict(lambda: [Decimal('0'), 0])
+    changes = changes or {}
+    for group in groups:
+        day = group['date']
+        dimensions = tuple(changes.get(name, group[name]) for name in DIMENSIONS)
+        for period, start in ((DAY, day), (MONTH, day.replace(day=1))):
+            entry = deltas[(period, start) + dimensions]
+            entry[0] += sign * group['total']
+            entry[1] += sign * group['count']
+    return deltas
+
+
+def apply_deltas(user_id, deltas):
+    """Add collected deltas to the user's rollup rows"""
+    if not deltas:
+        return
+    changes = {key: value for key, value in deltas.items() if value[0] or value[1]}
+    starts = [key[1] for key in changes]
+    with transaction.atomic():
+        # Every month written to, even when its deltas cancel out (only the vendor changed)
+        _bump_months_on_commit(user_id, [key[1] for key in deltas])
+        if not changes:
+            return
+        existing = {
+            rollup.key: rollup
+            for rollup in ExpenseRollup.objects.select_for_update().filter(
+                user_id=user_id, period_start__range=(min(starts), max(starts))
+            )
+        }
+        to_create = []
+        to_update = []
+        to_delete = []
+        for key, (amount, count) in changes.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                # Nothing to subtract from, e.g. while the user is being deleted
+                if count <= 0:
+                    continue
+                to_create.append(ExpenseRollup(
+                    user_id=user_id, total=amount, count=count, **dict(zip(KEY_FIELDS, key))
+                ))
+                continue
+            rollup.total += amount
+            rollup.count += count
+            if rollup.count <= 0:
+                to_delete.append(rollup.pk)
+            else:
+                to_update.append(rollup)
+        if to_delete:
+            ExpenseRollup.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            ExpenseRollup.objects.bulk_update(to_update, ['total', 'count'])
+        if to_create:
+            ExpenseRollup.objects.bulk_create(to_create)
+
+
+def fold_subcategory_rollups(subcategory):
+    """
+    Move the rollup rows of a subcategory being deleted onto the matching rows
+    without a subcategory; SET_NULL would turn them into duplicates of those
+    """
+    position = KEY_FIELDS.index('subcategory_id')
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for row in ExpenseRollup.objects.filter(subcategory=subcategory).values(*KEY_FIELDS, 'total', 'count'):
+        key = tuple(row[name] for name in KEY_FIELDS)
+        for target, sign in ((key, -1), (key[:position] + (None,) + key[position + 1:], 1)):
+            deltas[target][0] += sign * row['total']
+            deltas[target][1] += sign * row['count']
+    apply_deltas(subcategory.user_id, deltas)
+
+
+def _bump_months_on_commit(user_id, starts):
+    # After the commit, so a concurrent reader cannot cache the old totals under the new version
+    months = {start.replace(day=1) for start in starts}
+    transaction.on_commit(lambda: bump_month_versions(user_id, months))
+
+
+def rebuild_rollups(user):
+    """Recompute all rollup rows of a user from their expenses"""
+    expenses = Expense.objects.for_user(user).order_by()
+    rows = []
+    for item in expenses.values('date', *DIMENSIONS).annotate(total=Sum('amount'), count=Count('id')):
+        rows.append(ExpenseRollup(
+            user_id=user.pk, period=DAY, period_start=item.pop('date'), **item
+        ))
+    for item in expenses.annotate(month=TruncMonth('date')).values('month', *DIMENSIONS).annotate(
+        total=Sum('amount'), count=Count('id')
+    ):
+        rows.append(ExpenseRollup(
+            user_id=user.pk, period=MONTH, period_start=item.pop('month'), **item
+        ))
+    with transaction.atomic():
+        previous = ExpenseRollup.objects.filter(user=user, period=MONTH).values_list('period_start', flat=True)
+        _bump_months_on_commit(user.pk, set(previous) | {row.period_start for row in rows})
+        ExpenseRollup.objects.filter(user=user).delete()
+        ExpenseRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _period_rows(user, period, start, end):
+    return ExpenseRollup.objects.filter(
+        user=user, period=period, period_start__gte=start, period_start__lt=end
+    ).values('period_start').annotate(total=Sum('total'), count=Sum('count')).order_by()
+
+
+async def aperiod_totals(user, period, start, end):
+    """{period_start: (total, count)} for periods starting in [start, end)"""
+    rows = _period_rows(user, period, start, end)
+    return {row['period_start']: (row['total'], row['count']) async for row in rows}
+
+
+async def adaily_totals(user, start, end):
+    return await aperiod_totals(user, DAY, start, end)
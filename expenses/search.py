@@ -0,0 +1,104 @@
+"""
+Full-text search over expense vendor and notes.
+
+On SQLite an FTS5 table (expenses_expense_fts) indexes the two columns of
+expenses_expense as an external-content table, kept in sync by triggers so
+bulk_create, QuerySet.update() and raw deletes are covered as well as
+save(). Searches match every word of the query as a prefix; ranked_search()
+orders by bm25. Other backends fall back to icontains lookups.
+
+Filtering uses `id IN (SELECT rowid ... MATCH ...)`. With table statistics
+(ANALYZE, run by the migration and rebuild_search_index) SQLite evaluates
+the match first and sorts the hits, instead of walking the user's date
+index and probing the full-text index for every row.
+
+Migrations that make Django rebuild expenses_expense on SQLite drop its
+triggers; run `manage.py rebuild_search_index` after them.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Expense
+
+FTS_TABLE = 'expenses_expense_fts'
+
+CREATE_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        vendor, notes, content='expenses_expense', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_insert AFTER INSERT ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, vendor, notes) VALUES (new.id, new.vendor, new.notes);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_delete AFTER DELETE ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, notes) VALUES ('delete', old.id, old.vendor, old.notes);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expenses_expense_fts_update AFTER UPDATE OF vendor, notes ON expenses_expense BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, vendor, notes) VALUES ('delete', old.id, old.vendor, old.notes);
+        INSERT INTO {FTS_TABLE}(rowid, vendor, notes) VALUES (new.id, new.vendor, new.notes);
+    END""",
+]
+REBUILD_SQL = [f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')", 'ANALYZE']
+
+MATCH_SQL = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+
+# CROSS JOIN keeps the full-text index as the outer loop
+RANKED_SQL = f'''
+    SELECT e.id FROM {FTS_TABLE} f CROSS JOIN expenses_expense e ON e.id = f.rowid
+    WHERE f.{FTS_TABLE} MATCH %s AND e.user_id = %s
+    ORDER BY f.rank LIMIT %s
+'''
+
+
+def install_search_index(connection):
+    """Create the FTS table and triggers if missing and reindex every expense"""
+    with connection.cursor() as cursor:
+        for sql in CREATE_SQL + REBUILD_SQL:
+            cursor.execute(sql)
+
+
+def search_terms(value):
+    return re.findall(r'\w+', value or '')
+
+
+def match_query(value):
+    """FTS5 query requiring every word of `value` as a prefix, or None if there are no words"""
+    terms = search_terms(value)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def uses_fts(queryset):
+    return connections[queryset.db].vendor == 'sqlite'
+
+
+def search_expenses(queryset, value):
+    """Expenses of queryset whose vendor or notes contain every word of value (as prefixes on SQLite)"""
+    match = match_query(value)
+    if match is None:
+        return queryset
+    if not uses_fts(queryset):
+        for term in search_terms(value):
+            queryset = queryset.filter(Q(vendor__icontains=term) | Q(notes__icontains=term))
+        return queryset
+    return queryset.filter(id__in=RawSQL(MATCH_SQL, [match]))
+
+
+def ranked_search(user, value, limit=20):
+    """The user's best `limit` matches for value, best first (most recent first without FTS5)"""
+    queryset = Expense.objects.for_user(user).select_related('category', 'subcategory')
+    match = match_query(value)
+    if match is None:
+        return []
+    if not uses_fts(queryset):
+        return list(search_expenses(queryset, value)[:limit])
+
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(RANKED_SQL, [match, user.pk, limit])
+        ids = [row[0] for row in cursor.fetchall()]
+    expenses = queryset.in_bulk(ids)
+    return [expenses[pk] for pk in ids if pk in expenses]
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_data_version_on_commit, invalidate_categories
+from .categorizer import apply_vendor_deltas, collect_vendor_deltas, fold_subcategory_vendor_counts
+from .instrumentation import time_query
+from .models import Expense, UserCategory, UserSubcategory
+from .rollups import ROLLUP_FIELDS, apply_deltas, collect_deltas, fold_subcategory_rollups
+
+
+@receiver(pre_save, sender=Expense)
+def remember_rollup_state(sender, instance, **kwargs):
+    # Keep the stored values so post_save can take them out of the rollups and vendor counts
+    instance._rollup_previous = None
+    if instance.pk:
+        instance._rollup_previous = Expense.objects.filter(pk=instance.pk).values(*ROLLUP_FIELDS, 'vendor').first()
+
+
+@receiver(post_save, sender=Expense)
+def update_rollups_on_save(sender, instance, **kwargs):
+    deltas = collect_deltas([instance])
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        collect_deltas([previous], sign=-1, deltas=deltas)
+    apply_deltas(instance.user_id, deltas)
+
+
+@receiver(post_delete, sender=Expense)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    apply_deltas(instance.user_id, collect_deltas([instance], sign=-1))
+
+
+@receiver(post_save, sender=Expense)
+def update_vendor_counts_on_save(sender, instance, **kwargs):
+    deltas = collect_vendor_deltas([instance])
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        collect_vendor_deltas([previous], sign=-1, deltas=deltas)
+    apply_vendor_deltas(instance.user_id, deltas)
+
+
+@receiver(post_delete, sender=Expense)
+def update_vendor_counts_on_delete(sender, instance, **kwargs):
+    apply_vendor_deltas(instance.user_id, collect_vendor_deltas([instance], sign=-1))
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Expense)
+def expense_changed(sender, instance, **kwargs):
+    bump_data_version_on_commit(instance.user_id)
+
+
+@receiver(pre_delete, sender=UserSubcategory)
+def fold_subcategory_rows(sender, instance, **kwargs):
+    # Before SET_NULL moves the rows onto keys that may already exist
+    fold_subcategory_rollups(instance)
+    fold_subcategory_vendor_counts(instance)
+
+
+@receiver(post_save, sender=UserCategory)
+@receiver(post_delete, sender=UserCategory)
+@receiver(post_save, sender=UserSubcategory)
+@receiver(post_delete, sender=UserSubcategory)
+def categories_changed(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_categories(user_id))
+    # Pages show category names, so a rename or delete also changes them
+    bump_data_version_on_commit(instance.user_id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # Per-connection pragmas from settings.SQLITE_PRAGMAS; journal_mode=WAL is
+    # stored in the database file, the others only last for the connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Count and time this connection's queries for RequestTimingMiddleware
+    if getattr(settings, 'REQUEST_TIMING', False) and time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
@@ -0,0 +1,372 @@
+"""
+Columnar snapshots of a user's expenses for analytics.
+
+A snapshot is one file per user holding the expenses as fixed-width
+columns: id (int64), day (int32 days since 1970-01-01), cents (int64),
+dictionary codes for category, subcategory and vendor (int32, -1 for no
+subcategory) and a bit-packed flags byte. A small JSON header stores the
+column offsets, the dictionaries, and the user's data version and month
+versions (see expenses.cache) the snapshot was built at.
+
+Columns are memory-mapped when read. With NumPy installed they are NumPy
+arrays and the aggregations below are vectorised; without it they are
+memoryviews and the same functions fall back to plain loops.
+
+refresh_snapshot() does nothing while the data version is unchanged.
+Otherwise it patches the snapshot month by month: rows are ordered by date,
+so every month is a contiguous slice, copied as is while the month's
+version is unchanged and re-read from the database when it changed. The
+versions are bumped after every write commits, so a refresh never misses a
+late commit the way an updated_at watermark would.
+"""
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import get_data_version, get_month_versions
+from .models import Expense, ExpenseRollup, UserCategory, UserSubcategory
+from .utils import add_months
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy is optional
+    np = None
+
+MAGIC = b'EXPSNAP1'
+PREAMBLE = struct.Struct('<8sI')
+EPOCH = date(1970, 1, 1)
+CHUNK_SIZE = 5000
+
+# Column name -> array typecode; NumPy dtypes are derived from the typecodes
+COLUMNS = (
+    ('id', 'q'),
+    ('day', 'i'),
+    ('cents', 'q'),
+    ('category', 'i'),
+    ('subcategory', 'i'),
+    ('vendor', 'i'),
+    ('flags', 'B'),
+)
+NUMPY_DTYPES = {'q': '<i8', 'i': '<i4', 'B': 'u1'}
+
+# Bits of the flags column
+EXCLUDE = 1
+INDISPENSABLE = 2
+AVOIDABLE = 4
+
+SNAPSHOT_FIELDS = (
+    'id', 'date', 'amount', 'category_id', 'subcategory_id', 'vendor', 'exclude', 'indispensable', 'avoidable',
+)
+
+
+def snapshot_path(user):
+    directory = Path(getattr(settings, 'EXPENSE_SNAPSHOT_DIR', Path(settings.BASE_DIR) / 'snapshots'))
+    return directory / f'user-{user.pk}.snap'
+
+
+def _align(offset):
+    return (offset + 7) // 8 * 8
+
+
+class Snapshot:
+    """A memory-mapped snapshot file; columns are NumPy arrays or memoryviews"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is not an expense snapshot')
+        self.header = json.loads(self._mmap[PREAMBLE.size:PREAMBLE.size + header_length])
+        self.rows = self.header['rows']
+        data_start = _align(PREAMBLE.size + header_length)
+        self.columns = {}
+        for name, typecode in COLUMNS:
+            offset = data_start + self.header['offsets'][name]
+            if np is not None:
+                self.columns[name] = np.frombuffer(
+                    self._mmap, dtype=NUMPY_DTYPES[typecode], count=self.rows, offset=offset
+                )
+            else:
+                size = array(typecode).itemsize * self.rows
+                self.columns[name] = memoryview(self._mmap)[offset:offset + size].cast(typecode)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self.columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays handed out by __getitem__ still point into the map; it
+            # is closed when they are garbage collected
+            pass
+
+    @property
+    def category_names(self):
+        return self.header['category_names']
+
+    @property
+    def subcategory_names(self):
+        return self.header['subcategory_names']
+
+    @property
+    def vendors(self):
+        return self.header['vendors']
+
+
+class _Columns:
+    """Growable in-memory columns plus dictionaries, used while building a snapshot"""
+
+    def __init__(self, snapshot=None):
+        self.data = {name: array(typecode) for name, typecode in COLUMNS}
+        self.category_ids, self.subcategory_ids, self.vendors = [], [], []
+        if snapshot is not None:
+            # Start from the snapshot's dictionaries, so codes copied from it stay valid
+            self.category_ids = list(snapshot.header['category_ids'])
+            self.subcategory_ids = list(snapshot.header['subcategory_ids'])
+            self.vendors = list(snapshot.vendors)
+        self.category_codes = {value: code for code, value in enumerate(self.category_ids)}
+        self.subcategory_codes = {value: code for code, value in enumerate(self.subcategory_ids)}
+        self.vendor_codes = {value: code for code, value in enumerate(self.vendors)}
+
+    def __len__(self):
+        return len(self.data['id'])
+
+    @staticmethod
+    def _code(codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def encode(self, row):
+        expense_id, day, amount, category_id, subcategory_id, vendor, exclude, indispensable, avoidable = row
+        return (
+            expense_id,
+            (day - EPOCH).days,
+            int(amount * 100),
+            self._code(self.category_codes, self.category_ids, category_id),
+            -1 if subcategory_id is None else self._code(self.subcategory_codes, self.subcategory_ids, subcategory_id),
+            self._code(self.vendor_codes, self.vendors, vendor),
+            (EXCLUDE if exclude else 0) | (INDISPENSABLE if indispensable else 0) | (AVOIDABLE if avoidable else 0),
+        )
+
+    def append(self, row):
+        for (name, _), value in zip(COLUMNS, self.encode(row)):
+            self.data[name].append(value)
+
+    def copy(self, snapshot, start, stop):
+        """Append rows start:stop of the snapshot this was created from"""
+        for name, _ in COLUMNS:
+            self.data[name].frombytes(snapshot[name][start:stop].tobytes())
+
+    def write(self, path, user, data_version, month_versions):
+        """Write the columns atomically to `path`"""
+        category_names = dict(UserCategory.objects.filter(user=user).values_list('id', 'name'))
+        subcategory_names = dict(UserSubcategory.objects.filter(user=user).values_list('id', 'name'))
+        offsets = {}
+        offset = 0
+        for name, typecode in COLUMNS:
+            offsets[name] = offset
+            offset = _align(offset + len(self.data[name]) * self.data[name].itemsize)
+        header = json.dumps({
+            'user_id': user.pk,
+            'rows': len(self),
+            'built_at': timezone.now().isoformat(),
+            'data_version': data_version,
+            'month_versions': {f'{first:%Y-%m}': version for first, version in month_versions.items()},
+            'offsets': offsets,
+            'category_ids': self.category_ids,
+            'category_names': [category_names.get(pk) for pk in self.category_ids],
+            'subcategory_ids': self.subcategory_ids,
+            'subcategory_names': [subcategory_names.get(pk) for pk in self.subcategory_ids],
+            'vendors': self.vendors,
+        }).encode()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, len(header)))
+            f.write(header)
+            data_start = _align(PREAMBLE.size + len(header))
+            f.write(b'\0' * (data_start - f.tell()))
+            for name, typecode in COLUMNS:
+                f.write(b'\0' * (data_start + offsets[name] - f.tell()))
+                self.data[name].tofile(f)
+        os.replace(tmp_path, path)
+
+
+def _rows(user):
+    return Expense.objects.for_user(user).order_by('date', 'created_at', 'id').values_list(*SNAPSHOT_FIELDS)
+
+
+def _next_month(first):
+    return date(*add_months(first.year, first.month, 1), 1)
+
+
+def _months_with_rows(user):
+    """First days of the months holding any of the user's expenses, from the monthly rollups"""
+    return set(ExpenseRollup.objects.filter(user=user, period=ExpenseRollup.PERIOD_MONTH).order_by().values_list(
+        'period_start', flat=True
+    ).distinct())
+
+
+def _month_slices(snapshot):
+    """{first day of month: (start, stop)} of the snapshot's rows, which are sorted by day"""
+    days = snapshot['day']
+    slices = {}
+    start = 0
+    while start < len(snapshot):
+        first = (EPOCH + timedelta(days=int(days[start]))).replace(day=1)
+        stop = bisect_left(days, (_next_month(first) - EPOCH).days, start)
+        slices[first] = (start, stop)
+        start = stop
+    return slices
+
+
+def build_snapshot(user):
+    """Write a fresh snapshot of all the user's expenses; returns the row count"""
+    # Read before the rows, so a write committed in between triggers the next refresh
+    data_version = get_data_version(user)
+    month_versions = get_month_versions(user, _months_with_rows(user))
+    columns = _Columns()
+    for row in _rows(user).iterator(chunk_size=CHUNK_SIZE):
+        columns.append(row)
+    columns.write(snapshot_path(user), user, data_version, month_versions)
+    return len(columns)
+
+
+def _patch(user, snapshot):
+    """
+    (columns, month versions) for the user's current data, re-reading only
+    the months whose version changed since `snapshot` was built. None when
+    most of them did, since one pass over all rows is then cheaper.
+    """
+    stored = snapshot.header['month_versions']
+    slices = _month_slices(snapshot)
+    months = sorted(slices.keys() | _months_with_rows(user))
+    versions = get_month_versions(user, months)
+    changed = {first for first in months if stored.get(f'{first:%Y-%m}') != versions[first]}
+    if len(changed) * 2 > len(months):
+        return None
+
+    columns = _Columns(snapshot)
+    for first in months:
+        if first in changed:
+            for row in _rows(user).filter(date__gte=first, date__lt=_next_month(first)):
+                columns.append(row)
+        elif first in slices:
+            columns.copy(snapshot, *slices[first])
+    return columns, versions
+
+
+def refresh_snapshot(user):
+    """
+    Bring the user's snapshot up to date if their data changed since it was
+    built, re-reading only the changed months. Returns the number of rows
+    written, 0 when it was up to date.
+    """
+    path = snapshot_path(user)
+    if not path.exists():
+        return build_snapshot(user)
+    data_version = get_data_version(user)
+    with Snapshot(path) as snapshot:
+        if snapshot.header.get('data_version') == data_version:
+            return 0
+        # Snapshots from before month versions are rebuilt
+        patched = _patch(user, snapshot) if 'month_versions' in snapshot.header else None
+    if patched is None:
+        return build_snapshot(user)
+    columns, month_versions = patched
+    columns.write(path, user, data_version, month_versions)
+    return len(columns)
+
+
+def open_snapshot(user, refresh=True):
+    """The user's snapshot, refreshed first unless refresh=False"""
+    if refresh:
+        refresh_snapshot(user)
+    return Snapshot(snapshot_path(user))
+
+
+def _selection(snapshot, start=None, end=None, include_excluded=False):
+    """Row mask (NumPy) or row indexes (fallback) for days in [start, end)"""
+    first = (start - EPOCH).days if start else None
+    last = (end - EPOCH).days if end else None
+    days, flags = snapshot['day'], snapshot['flags']
+    if np is not None:
+        mask = np.ones(len(snapshot), dtype=bool)
+        if first is not None:
+            mask &= days >= first
+        if last is not None:
+            mask &= days < last
+        if not include_excluded:
+            mask &= (flags & EXCLUDE) == 0
+        return mask
+    return [
+        i for i in range(len(snapshot))
+        if (first is None or days[i] >= first) and (last is None or days[i] < last)
+        and (include_excluded or not flags[i] & EXCLUDE)
+    ]
+
+
+def _to_amount(cents):
+    return (Decimal(int(cents)) / 100).quantize(Decimal('0.01'))
+
+
+def category_totals(snapshot, start=None, end=None, include_excluded=False):
+    """{category name: total} for expenses dated in [start, end)"""
+    selected = _selection(snapshot, start, end, include_excluded)
+    names = snapshot.category_names
+    if np is not None:
+        totals = np.zeros(len(names), dtype=np.int64)
+        np.add.at(totals, snapshot['category'][selected], snapshot['cents'][selected])
+    else:
+        totals = [0] * len(names)
+        codes, cents = snapshot['category'], snapshot['cents']
+        for i in selected:
+            totals[codes[i]] += cents[i]
+    return {names[code]: _to_amount(total) for code, total in enumerate(totals) if total}
+
+
+def monthly_totals(snapshot, start=None, end=None, include_excluded=False):
+    """{first day of month: total} for expenses dated in [start, end)"""
+    selected = _selection(snapshot, start, end, include_excluded)
+    if np is not None:
+        months = snapshot['day'][selected].astype('datetime64[D]').astype('datetime64[M]')
+        keys, inverse = np.unique(months, return_inverse=True)
+        totals = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(totals, inverse, snapshot['cents'][selected])
+        return {key.item(): _to_amount(total) for key, total in zip(keys, totals)}
+    result = {}
+    days, cents = snapshot['day'], snapshot['cents']
+    for i in selected:
+        month = (EPOCH + timedelta(days=days[i])).replace(day=1)
+        result[month] = result.get(month, 0) + cents[i]
+    return {month: _to_amount(total) for month, total in sorted(result.items())}
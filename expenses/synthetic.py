@@ -0,0 +1,208 @@
+"""
+Synthetic expense data for load tests and benchmarks.
+
+Expenses are drawn from a fixed taxonomy of categories and subcategories,
+each with its own vendor pool, typical amount, weekly frequency, seasonal
+curve and flags. Vendors within a pool follow a Zipf distribution (a few
+shops get most visits) and some carry a branch suffix, amounts are
+log-normal around the subcategory's median, and recurring bills fall on a
+fixed day of the month. Everything comes from one seeded Random, so the
+same seed always produces the same data.
+"""
+import csv
+import math
+import random
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+
+from .cache import bump_data_version, invalidate_categories
+from .categorizer import rebuild_vendor_index
+from .export import CSV_COLUMNS, csv_row
+from .models import Expense, UserCategory, UserSubcategory
+from .rollups import rebuild_rollups
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Month multipliers, January first
+FLAT = (1,) * 12
+SUMMER = (0.4, 0.4, 0.6, 0.8, 1.0, 1.6, 2.6, 2.8, 1.2, 0.7, 0.5, 1.2)
+DECEMBER = (0.5, 0.6, 0.7, 0.7, 0.8, 0.8, 0.7, 0.6, 0.8, 0.9, 1.4, 3.5)
+WINTER_BILLS = (1.6, 1.5, 1.2, 0.9, 0.7, 0.6, 0.6, 0.6, 0.7, 0.9, 1.2, 1.5)
+SALES = (1.8, 1.0, 0.8, 1.0, 1.0, 0.9, 1.7, 0.9, 1.0, 1.0, 1.2, 1.5)
+OUTDOOR = (0.6, 0.6, 0.8, 1.0, 1.2, 1.3, 1.4, 1.1, 1.1, 1.0, 0.8, 1.1)
+
+BRANCHES = ('Centro', 'Via Roma', 'Stazione', 'Kirchberg', 'Gare', 'Aeroporto', 'Nord', 'Sud')
+NOTES = ('', '', '', '', '', '', '', '', 'con amici', 'rimborsabile', 'regalo', 'carta aziendale', 'da dividere')
+
+
+@dataclass(frozen=True)
+class Profile:
+    """How one subcategory's expenses look"""
+    category: str
+    subcategory: str
+    vendors: tuple
+    median: float
+    # Spread of the log-normal amount; 0 for fixed amounts such as rent
+    sigma: float
+    # Average number of expenses per week
+    per_week: float
+    season: tuple = FLAT
+    # Recurring expenses fall on this day of the month
+    day_of_month: int = None
+    indispensable: bool = False
+    avoidable: bool = False
+
+
+PROFILES = (
+    Profile('Cibo', 'Spesa', ('Lidl', 'Aldi', 'Cactus', 'Delhaize', 'Auchan', 'Monop', 'Esselunga', 'Coop'),
+            38, 0.6, 2.5, indispensable=True),
+    Profile('Cibo', 'Pranzo fuori', ('Paul', 'Exki', 'Cantine', 'Pasta Bar', 'Sushi Shop', 'Bistrot'), 16, 0.35, 2.0),
+    Profile('Cibo', 'Cena fuori', ('Trattoria Roma', 'Le Bistrot', 'Sushi Shop', 'Burger House', 'Pizzeria Napoli'),
+            48, 0.5, 0.8, season=DECEMBER, avoidable=True),
+    Profile('Cibo', 'Aperitivo', ('Bar Centrale', 'Ville Haute', 'Lounge One', 'Cafe des Artistes'), 22, 0.4, 0.6,
+            season=OUTDOOR, avoidable=True),
+    Profile('Svago', 'Alcohol', ('Ville Haute', 'Lounge One', 'Shuberfoyer', 'Bar Centrale'), 30, 0.5, 0.5,
+            season=OUTDOOR, avoidable=True),
+    Profile('Svago', 'Eventi', ('Ticketmaster', 'Rockhal', 'Escape Room', 'Cinema Utopia', 'Shuberfoyer'), 45, 0.6,
+            0.3, season=OUTDOOR),
+    Profile('Trasporti', 'Taxi', ('TaxiLux', 'Uber', 'Bolt'), 24, 0.5, 0.4),
+    Profile('Trasporti', 'Carburante', ('Aral', 'Shell', 'Q8', 'TotalEnergies'), 62, 0.25, 0.7, indispensable=True),
+    Profile('Viaggi', 'Aereo', ('Luxair', 'Ryanair', 'Easyjet', 'ITA Airways', 'MXP LUX'), 140, 0.6, 0.12,
+            season=SUMMER),
+    Profile('Viaggi', 'Hotel', ('Booking.com', 'Airbnb', 'Hotel Centrale', 'Ibis'), 210, 0.5, 0.1, season=SUMMER),
+    Profile('Abbigliamento', 'Vestiti', ('Zara', 'H&M', 'Uniqlo', 'Decathlon', 'Zalando'), 55, 0.6, 0.3,
+            season=SALES, avoidable=True),
+    Profile('Regali', 'Regali', ('Amazon', 'Fnac', 'Ikea', 'Galeries Lafayette'), 40, 0.7, 0.15, season=DECEMBER),
+    Profile('Mediche', 'Farmacia', ('Pharmacie Centrale', 'Farmacia Comunale', 'Pharmacie du Globe'), 18, 0.6, 0.3,
+            indispensable=True),
+    Profile('Spese fisse', 'Affitto', ('Elisa',), 950, 0, 12 / 52, day_of_month=1, indispensable=True),
+    Profile('Spese fisse', 'Bollette', ('Enovos', 'Creos', 'Post Telecom'), 85, 0.3, 36 / 52, season=WINTER_BILLS,
+            day_of_month=15, indispensable=True),
+    Profile('Abbonamenti', 'Abbonamenti', ('Netflix', 'Spotify', 'Jims', 'iCloud'), 13, 0.2, 48 / 52,
+            day_of_month=5),
+)
+
+
+def _zipf_weights(count, exponent=1.1):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def generate_rows(count, start, end, seed=0):
+    """
+    Yield `count` expense dicts (date, vendor, amount, category, subcategory,
+    flags, notes; category names as strings) dated in [start, end].
+    """
+    rng = random.Random(seed)
+    days = (end - start).days + 1
+    profiles = list(PROFILES)
+    profile_weights = [profile.per_week * sum(profile.season) / 12 for profile in profiles]
+    vendor_weights = {profile: _zipf_weights(len(profile.vendors)) for profile in profiles}
+
+    for _ in range(count):
+        profile = rng.choices(profiles, profile_weights)[0]
+        # Rejection sampling so busy months get proportionally more expenses
+        peak = max(profile.season)
+        while True:
+            day = start + timedelta(days=rng.randrange(days))
+            if rng.random() * peak < profile.season[day.month - 1]:
+                break
+        if profile.day_of_month:
+            day = day.replace(day=min(profile.day_of_month, 28))
+            if day < start or day > end:
+                day = start + timedelta(days=rng.randrange(days))
+
+        vendor = rng.choices(profile.vendors, vendor_weights[profile])[0]
+        if len(profile.vendors) > 1 and rng.random() < 0.2:
+            vendor = f'{vendor} {rng.choice(BRANCHES)}'
+
+        if profile.sigma:
+            amount = profile.median * math.exp(rng.gauss(0, profile.sigma))
+        else:
+            amount = profile.median
+        yield {
+            'date': day,
+            'vendor': vendor,
+            'amount': Decimal(max(amount, 0.5)).quantize(Decimal('0.01')),
+            'category': profile.category,
+            'subcategory': profile.subcategory,
+            'exclude': rng.random() < 0.01,
+            'indispensable': profile.indispensable,
+            'avoidable': profile.avoidable and rng.random() < 0.7,
+            'notes': rng.choice(NOTES),
+        }
+
+
+def create_dataset(user, count, start, end, seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Insert `count` generated expenses for user and rebuild the derived tables.
+
+    Rows are written with bulk_create (duplicates of an existing (date,
+    vendor, amount) key are dropped), then rollups and vendor counts are
+    rebuilt once instead of being updated per row. Returns the number of
+    expenses added.
+    """
+    categories = {}
+    subcategories = {}
+    for profile in PROFILES:
+        category = categories.get(profile.category)
+        if category is None:
+            category, _ = UserCategory.objects.get_or_create(user=user, name=profile.category)
+            categories[profile.category] = category
+        subcategories[(profile.category, profile.subcategory)], _ = UserSubcategory.objects.get_or_create(
+            user=user, category=category, name=profile.subcategory
+        )
+    invalidate_categories(user)
+
+    before = Expense.objects.for_user(user).count()
+    batch = []
+    written = 0
+    for fields in generate_rows(count, start, end, seed):
+        fields['subcategory'] = subcategories[(fields['category'], fields['subcategory'])]
+        fields['category'] = categories[fields['category']]
+        batch.append(Expense(user=user, **fields))
+        if len(batch) >= batch_size:
+            written += _write(batch)
+            batch = []
+            if progress:
+                progress(written)
+    if batch:
+        written += _write(batch)
+        if progress:
+            progress(written)
+
+    rebuild_rollups(user)
+    rebuild_vendor_index(user)
+    bump_data_version(user)
+    return Expense.objects.for_user(user).count() - before
+
+
+def _write(batch):
+    with transaction.atomic():
+        Expense.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(batch)
+
+
+def write_csv(path_or_file, count, start, end, seed=0):
+    """Write `count` generated expenses as a CSV file in the import layout"""
+    own = isinstance(path_or_file, str)
+    f = open(path_or_file, 'w', newline='', encoding='utf-8') if own else path_or_file
+    try:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(CSV_COLUMNS)
+        for row in generate_rows(count, start, end, seed):
+            writer.writerow(csv_row(
+                row['date'], row['vendor'], row['amount'], row['category'], row['subcategory'],
+                row['exclude'], row['indispensable'], row['avoidable'], row['notes'],
+            ))
+    finally:
+        if own:
+            f.close()
+
+
+def default_span(years):
+    """(start, end) covering the last `years` whole years up to today"""
+    end = date.today()
+    return date(end.year - years, end.month, 1), end
@@ -1,3 +1,955 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import pstats
+import re
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import resolve, reverse
+
+from .cache import get_category_tree, get_data_version
+from .forms import ExpenseForm
+from .fragments import week_count
+from .rollups import rebuild_rollups
+from .snapshot import build_snapshot, category_totals, open_snapshot, refresh_snapshot
+from .importer import BatchImporter, import_upload
+from .instrumentation import time_query, timings
+from .jobs import claim_job, reclaim_stale_jobs, run_job, worker_id
+from .models import Expense, ExpenseRollup, ImportJob, UserCategory, UserSubcategory, VendorCategory
+from .analytics import build_series
+from .bulk import bulk_delete_expenses, bulk_update_expenses
+from .categorizer import rebuild_vendor_index, suggest_category
+from .export import CSV_COLUMNS, csv_row
+from .search import search_expenses
+from .utils import percentiles
+from .profiling import ProfilingMiddleware, list_profiles, maybe_profiled, profiled
+from .pagination import _after, decode_cursor, encode_cursor, paginate_keyset
+from .views import expense_calendar, expense_chart_data, get_expenses_by_date
+
+
+# cache.clear() between tests must not wipe the project's real cache
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ExpenseTestCase(TestCase):
+    """A user with two categories (one with a subcategory) and helpers to add expenses"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='secret')
+        self.food = UserCategory.objects.create(user=self.user, name='Cibo')
+        self.fun = UserCategory.objects.create(user=self.user, name='Svago')
+        self.groceries = UserSubcategory.objects.create(user=self.user, category=self.food, name='Spesa')
+        self.client.force_login(self.user)
+
+    def assertRollupsMatchRebuild(self):
+        """The incrementally maintained rollups and vendor counts equal freshly rebuilt ones"""
+        def snapshot():
+            return (
+                sorted(ExpenseRollup.objects.filter(user=self.user).values_list(
+                    'period', 'period_start', 'category_id', 'subcategory_id', 'exclude', 'indispensable', 'avoidable',
+                    'total', 'count',
+                )),
+                sorted(VendorCategory.objects.filter(user=self.user).values_list(
+                    'vendor', 'category_id', 'subcategory_id', 'count',
+                )),
+            )
+        maintained = snapshot()
+        rebuild_rollups(self.user)
+        rebuild_vendor_index(self.user)
+        self.assertEqual(maintained, snapshot())
+
+    def add_expense(self, day, vendor, amount, category=None, **fields):
+        return Expense.objects.create(
+            user=self.user, date=day, vendor=vendor, amount=Decimal(amount),
+            category=category or self.food, **fields
+        )
+
+
+class BulkExpensesTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old_food = self.add_expense(date(2019, 5, 1), 'Lidl', '10.00', subcategory=self.groceries)
+        self.new_food = self.add_expense(date(2021, 5, 1), 'Aldi', '20.00', subcategory=self.groceries)
+        self.new_fun = self.add_expense(date(2021, 6, 1), 'Cinema', '15.00', category=self.fun)
+        self.url = reverse('expenses:bulk')
+
+    def test_update_by_filter_uses_set_fields_for_new_values(self):
+        response = self.client.post(self.url, {
+            'action': 'update', 'date_after': '2020-01-01', 'set_category': self.fun.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 2)
+        self.new_food.refresh_from_db()
+        self.old_food.refresh_from_db()
+        self.assertEqual(self.new_food.category, self.fun)
+        self.assertIsNone(self.new_food.subcategory)
+        self.assertEqual(self.old_food.category, self.food)
+        self.assertEqual(self.old_food.subcategory, self.groceries)
+
+    def test_category_is_a_filter_not_a_new_value(self):
+        response = self.client.post(self.url, {'action': 'update', 'category': self.food.pk, 'exclude': 'true'})
+        self.assertEqual(response.json()['updated'], 2)
+        self.assertEqual(Expense.objects.filter(exclude=True).count(), 2)
+        self.new_fun.refresh_from_db()
+        self.assertFalse(self.new_fun.exclude)
+
+    def test_set_fields_alone_do_not_select_rows(self):
+        response = self.client.post(self.url, {'action': 'update', 'set_category': self.fun.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Expense.objects.filter(category=self.fun).count(), 1)
+
+    def test_delete_by_ids_is_scoped_to_the_user(self):
+        other = User.objects.create_user('bob')
+        other_category = UserCategory.objects.create(user=other, name='Cibo')
+        foreign = Expense.objects.create(
+            user=other, date=date(2021, 5, 1), vendor='Lidl', amount=Decimal('5'), category=other_category
+        )
+        response = self.client.post(self.url, {'action': 'delete', 'ids': f'{self.old_food.pk},{foreign.pk}'})
+        self.assertEqual(response.json()['deleted'], 1)
+        self.assertTrue(Expense.objects.filter(pk=foreign.pk).exists())
+        self.assertFalse(Expense.objects.filter(pk=self.old_food.pk).exists())
+
+
+class KeysetPaginationTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Several rows share a date, and bulk_create gives some the same created_at too
+        for day in (1, 1, 1, 2, 2, 3, 4, 4, 4, 4):
+            self.add_expense(date(2024, 1, day), f'Vendor {Expense.objects.count()}', '1.00')
+        self.queryset = Expense.objects.for_user(self.user)
+
+    def test_forward_and_back_cover_every_row_once(self):
+        expected = list(self.queryset.order_by('-date', '-created_at', '-id'))
+        pages = [paginate_keyset(self.queryset, page_size=3)]
+        while pages[-1].has_next:
+            pages.append(paginate_keyset(self.queryset, after=pages[-1].next_cursor, page_size=3))
+        self.assertEqual([row for page in pages for row in page.object_list], expected)
+
+        # Walking back from the last page gives the same pages
+        back = [pages[-1]]
+        while back[-1].has_previous:
+            back.append(paginate_keyset(self.queryset, before=back[-1].previous_cursor, page_size=3))
+        self.assertEqual([page.object_list for page in reversed(back)], [page.object_list for page in pages])
+
+    def test_cursor_query_seeks_the_date_index(self):
+        cursor = decode_cursor(encode_cursor(self.queryset.order_by('date').first()))
+        plan = self.queryset.filter(_after(cursor)).order_by('-date', '-created_at', '-id').explain()
+        self.assertIn('date<?', plan.replace(' ', ''))
+
+
+class DataVersionTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_expense(date(2024, 1, 1), 'Lidl', '10.00')
+        self.url = reverse('expenses:list')
+        # The ETag includes the CSRF secret, which the first page sets
+        self.client.get(self.url)
+
+    def test_unchanged_data_answers_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(date(2024, 1, 2), 'Aldi', '5.00')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_async_views_answer_304_until_a_write(self):
+        urls = [
+            reverse('expenses:calendar'), reverse('expenses:chart-data'),
+            reverse('expenses:expenses-by-date', args=['2024-01-01']),
+        ]
+        first = {url: self.client.get(url) for url in urls}
+        for url, response in first.items():
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304, url)
+            modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(modified.status_code, 304, url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(date(2024, 1, 1), 'Aldi', '5.00')
+        for url, response in first.items():
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200, url)
+
+    def test_etags_differ_between_users(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.force_login(User.objects.create_user('bob'))
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_calendar_and_chart_change_with_the_day(self):
+        class Tomorrow(date):
+            @classmethod
+            def today(cls):
+                return date.today() + timedelta(days=1)
+
+        for url in (reverse('expenses:calendar'), reverse('expenses:chart-data')):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+            with mock.patch('expenses.decorators.date', Tomorrow):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+    def test_version_is_bumped_after_the_commit(self):
+        version = get_data_version(self.user)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.add_expense(date(2024, 1, 2), 'Aldi', '5.00')
+            self.assertEqual(get_data_version(self.user), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_data_version(self.user), version)
+
+    def test_rolled_back_write_keeps_the_version(self):
+        version = get_data_version(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.add_expense(date(2024, 1, 2), 'Aldi', '5.00')
+                raise RuntimeError
+        self.assertEqual(get_data_version(self.user), version)
+
+
+class ImportJobClaimTests(ExpenseTestCase):
+    def running_job(self, heartbeat_age):
+        return ImportJob.objects.create(
+            user=self.user, filename='bank.csv', status=ImportJob.STATUS_RUNNING, owner='other-host:1',
+            started_at=timezone.now() - timedelta(hours=1),
+            heartbeat_at=timezone.now() - timedelta(seconds=heartbeat_age),
+        )
+
+    def test_claim_records_the_owner_once(self):
+        job = ImportJob.objects.create(user=self.user, filename='bank.csv')
+        self.assertTrue(claim_job(job.pk))
+        self.assertFalse(claim_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_RUNNING)
+        self.assertEqual(job.owner, worker_id())
+        self.assertIsNotNone(job.heartbeat_at)
+
+    def test_only_jobs_without_a_recent_heartbeat_are_requeued(self):
+        live = self.running_job(heartbeat_age=5)
+        stale = self.running_job(heartbeat_age=600)
+        self.assertEqual(reclaim_stale_jobs(), 1)
+        live.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual(live.status, ImportJob.STATUS_RUNNING)
+        self.assertEqual(stale.status, ImportJob.STATUS_PENDING)
+        self.assertEqual(stale.owner, '')
+
+
+class ExpenseFormTests(ExpenseTestCase):
+    def form(self, **data):
+        values = {'date': '2024-03-01', 'vendor': 'Lidl', 'amount': '12.50', 'category': 'Casa'}
+        values.update(data)
+        return ExpenseForm(values, instance=Expense(user=self.user), user=self.user)
+
+    def test_invalid_form_creates_no_categories(self):
+        form = self.form(amount='abc', subcategory='Mobili')
+        self.assertFalse(form.is_valid())
+        self.assertFalse(UserCategory.objects.filter(name='Casa').exists())
+        self.assertFalse(UserSubcategory.objects.filter(name='Mobili').exists())
+
+    def test_save_creates_new_names_and_reuses_existing_ones(self):
+        expense = self.form(subcategory='Mobili').save()
+        self.assertEqual(expense.category.name, 'Casa')
+        self.assertEqual(expense.subcategory.name, 'Mobili')
+        self.assertEqual(expense.subcategory.category, expense.category)
+
+        expense = self.form(vendor='Coop', category='Cibo', subcategory='Spesa').save()
+        self.assertEqual(expense.category, self.food)
+        self.assertEqual(expense.subcategory, self.groceries)
+        self.assertEqual(UserCategory.objects.filter(user=self.user).count(), 3)
+
+
+class SubcategoryLookupTests(ExpenseTestCase):
+    def subcategories(self, category):
+        response = self.client.get(reverse('expenses:subcategories'), {'category': category})
+        return [item['name'] for item in response.json()['subcategories']]
+
+    def test_lists_one_category_of_the_user(self):
+        UserSubcategory.objects.create(user=self.user, category=self.fun, name='Cinema')
+        bob = User.objects.create_user('bob')
+        bob_food = UserCategory.objects.create(user=bob, name='Cibo')
+        UserSubcategory.objects.create(user=bob, category=bob_food, name='Bar')
+        self.assertEqual(self.subcategories('Cibo'), ['Spesa'])
+        self.assertEqual(self.subcategories('Svago'), ['Cinema'])
+        self.assertEqual(self.subcategories('Casa'), [])
+
+    def test_cached_until_a_category_changes(self):
+        self.subcategories('Cibo')
+        with self.assertNumQueries(0):
+            categories = get_category_tree(self.user)['categories']
+        self.assertEqual(categories, [(self.food.pk, 'Cibo'), (self.fun.pk, 'Svago')])
+        with self.captureOnCommitCallbacks(execute=True):
+            UserSubcategory.objects.create(user=self.user, category=self.food, name='Bar')
+        self.assertEqual(self.subcategories('Cibo'), ['Bar', 'Spesa'])
+
+    def test_warm_add_page_queries_no_categories(self):
+        url = reverse('expenses:add')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([query['sql'] for query in captured if 'category' in query['sql']])
+
+
+class CategorizerTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_expense(date(2024, 3, 1), 'Esselunga Via Roma 12', '30.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 3, 8), 'ESSELUNGA via roma 12', '25.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 3, 9), 'Esselunga', '4.00', category=self.fun)
+
+    def test_most_frequent_category_by_name_then_prefix(self):
+        self.assertEqual(suggest_category(self.user, 'esselunga via roma'), (self.food.pk, self.groceries.pk))
+        # Only the one-token prefix is known, where Cibo > Spesa counts twice and Svago once
+        self.assertEqual(suggest_category(self.user, 'Esselunga Milano 3'), (self.food.pk, self.groceries.pk))
+        self.assertIsNone(suggest_category(self.user, 'Coop'))
+        response = self.client.get(reverse('expenses:suggest-category'), {'vendor': 'Esselunga Via Roma'})
+        self.assertEqual(response.json(), {'vendor': 'Esselunga Via Roma', 'category': 'Cibo', 'subcategory': 'Spesa'})
+
+    def test_recategorizing_updates_the_suggestion(self):
+        bulk_update_expenses(self.user, Expense.objects.filter(category=self.food), {
+            'category_id': self.fun.pk, 'subcategory_id': None,
+        })
+        self.assertEqual(suggest_category(self.user, 'Esselunga Milano'), (self.fun.pk, None))
+        self.assertRollupsMatchRebuild()
+
+    def test_import_and_form_fall_back_to_the_suggestion(self):
+        importer = BatchImporter(self.user)
+        for vendor in ('Esselunga Via Roma 12', 'Coop'):
+            importer.add_parsed({
+                'date': date(2024, 4, 1), 'vendor': vendor, 'amount': Decimal('10.00'), 'category': '',
+                'subcategory': '', 'exclude': False, 'indispensable': False, 'avoidable': False, 'notes': '',
+            })
+        importer.finish()
+        imported = dict(Expense.objects.filter(date=date(2024, 4, 1)).values_list('vendor', 'subcategory__name'))
+        self.assertEqual(imported, {'Esselunga Via Roma 12': 'Spesa', 'Coop': None})
+        self.assertEqual(Expense.objects.get(vendor='Coop').category.name, 'Other')
+
+        form = ExpenseForm(
+            {'date': '2024-04-02', 'vendor': 'esselunga via roma', 'amount': '3.00', 'category': ''},
+            instance=Expense(user=self.user), user=self.user,
+        )
+        expense = form.save()
+        self.assertEqual((expense.category, expense.subcategory), (self.food, self.groceries))
+
+
+class CalendarParamsTests(ExpenseTestCase):
+    def test_malformed_or_out_of_range_params_fall_back(self):
+        url = reverse('expenses:calendar')
+        for query in ('months=abc', 'months=0', 'months=99', 'year=abc', 'year=10000', 'month=13', 'month=x&year=2024'):
+            response = self.client.get(f'{url}?{query}')
+            self.assertEqual(response.status_code, 200, query)
+            self.assertEqual(response.context['months'], 1, query)
+        response = self.client.get(f'{url}?year=9998&month=12&months=12')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['calendars']), 12)
+
+
+class AsyncViewTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_expense(date(2024, 3, 5), 'Lidl', '10.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 3, 5), 'Cinema', '8.50', category=self.fun)
+        self.add_expense(date(2024, 3, 6), 'Coop', '4.00')
+        self.async_client.force_login(self.user)
+
+    def test_views_are_coroutines(self):
+        for view in (expense_calendar, expense_chart_data, get_expenses_by_date):
+            self.assertTrue(asyncio.iscoroutinefunction(view), view)
+
+    async def test_day_detail(self):
+        response = await self.async_client.get(reverse('expenses:expenses-by-date', args=['2024-03-05']))
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(
+            sorted((item['vendor'], item['amount'], item['subcategory']) for item in data['expenses']),
+            [('Cinema', '8.50', ''), ('Lidl', '10.00', 'Spesa')],
+        )
+        response = await self.async_client.get(reverse('expenses:expenses-by-date', args=['2024-02-30']))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_calendar_shows_daily_totals(self):
+        response = await self.async_client.get(reverse('expenses:calendar'), {'year': 2024, 'month': 3})
+        self.assertEqual(response.status_code, 200)
+        page = response.content.decode()
+        # SQLite sums decimals as floats, so trailing zeros are dropped
+        self.assertRegex(page, r'data-date="2024-03-05"\s+data-total="18\.50?"\s+data-expense-count="2"')
+        self.assertRegex(page, r'data-date="2024-03-06"\s+data-total="4(\.00)?"\s+data-expense-count="1"')
+        self.assertNotIn('data-date="2024-03-07"', page)
+
+    async def test_anonymous_requests_are_turned_away(self):
+        client = AsyncClient()
+        response = await client.get(reverse('expenses:expenses-by-date', args=['2024-03-05']))
+        self.assertEqual(response.status_code, 401)
+        response = await client.get(reverse('expenses:calendar'))
+        self.assertEqual(response.status_code, 302)
+
+
+class FragmentCacheTests(ExpenseTestCase):
+    def render_calendar(self):
+        """Week rows rendered (not served from the cache) for a February-March 2024 calendar"""
+        with mock.patch('expenses.fragments.render_to_string', wraps=render_to_string) as render:
+            response = self.client.get(reverse('expenses:calendar'), {'year': 2024, 'month': 2, 'months': 2})
+        self.assertEqual(response.status_code, 200)
+        return render.call_count, response.content.decode()
+
+    def test_a_write_renders_only_its_month_again(self):
+        self.add_expense(date(2024, 2, 10), 'Lidl', '10.00')
+        self.assertEqual(self.render_calendar()[0], week_count(2024, 2) + week_count(2024, 3))
+        self.assertEqual(self.render_calendar()[0], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(date(2024, 3, 15), 'Coop', '7.00')
+        rendered, page = self.render_calendar()
+        self.assertEqual(rendered, week_count(2024, 3))
+        self.assertIn('data-date="2024-03-15"', page)
+        self.assertIn('data-date="2024-02-10"', page)
+
+    def test_moving_an_expense_renders_both_months_again(self):
+        expense = self.add_expense(date(2024, 2, 10), 'Lidl', '10.00')
+        self.render_calendar()
+        with self.captureOnCommitCallbacks(execute=True):
+            expense.date = date(2024, 3, 10)
+            expense.save()
+        rendered, page = self.render_calendar()
+        self.assertEqual(rendered, week_count(2024, 2) + week_count(2024, 3))
+        self.assertNotIn('data-date="2024-02-10"', page)
+
+    def test_list_page_is_cached_until_any_write(self):
+        self.add_expense(date(2024, 2, 10), 'Lidl', '10.00')
+        url = reverse('expenses:list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url)
+        self.assertFalse([query['sql'] for query in captured if 'FROM "expenses_expense"' in query['sql']])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(date(2023, 1, 1), 'Coop', '7.00')
+        self.assertContains(self.client.get(url), 'Coop')
+
+
+class RollupTests(ExpenseTestCase):
+    def test_save_update_and_delete_keep_rollups_in_step(self):
+        lidl = self.add_expense(date(2024, 1, 31), 'Lidl', '10.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 1, 31), 'Aldi', '3.50')
+        cinema = self.add_expense(date(2024, 2, 1), 'Cinema', '8.00', category=self.fun)
+        lidl.date = date(2024, 2, 1)
+        lidl.amount = Decimal('12.00')
+        lidl.subcategory = None
+        lidl.exclude = True
+        lidl.save()
+        cinema.delete()
+        self.assertRollupsMatchRebuild()
+
+    def test_import_keeps_rollups_in_step(self):
+        importer = BatchImporter(self.user, batch_size=2)
+        for day, vendor, category in ((1, 'Lidl', 'Cibo'), (2, 'Aldi', 'Cibo'), (3, 'Cinema', 'Svago')):
+            importer.add_parsed({
+                'date': date(2024, 3, day), 'vendor': vendor, 'amount': Decimal('5.00'), 'category': category,
+                'subcategory': '', 'exclude': False, 'indispensable': False, 'avoidable': False, 'notes': '',
+            })
+        importer.add_parsed({
+            'date': date(2024, 3, 1), 'vendor': 'Lidl', 'amount': Decimal('5.00'), 'category': 'Svago',
+            'subcategory': '', 'exclude': True, 'indispensable': False, 'avoidable': False, 'notes': '',
+        })
+        importer.finish()
+        self.assertEqual((importer.created, importer.updated), (3, 1))
+        self.assertRollupsMatchRebuild()
+
+    def test_bulk_update_and_delete_keep_rollups_in_step(self):
+        for day in range(1, 6):
+            self.add_expense(date(2024, 4, day), f'Shop {day}', '2.00', subcategory=self.groceries)
+        expenses = Expense.objects.for_user(self.user)
+        bulk_update_expenses(self.user, expenses.filter(date__lte=date(2024, 4, 3)), {
+            'category_id': self.fun.pk, 'subcategory_id': None, 'avoidable': True,
+        })
+        bulk_delete_expenses(self.user, expenses.filter(date=date(2024, 4, 5)))
+        self.assertRollupsMatchRebuild()
+
+    def test_deleting_a_subcategory_merges_its_rows_into_the_unset_ones(self):
+        self.add_expense(date(2024, 1, 1), 'Lidl', '10.00')
+        self.add_expense(date(2024, 1, 1), 'Lidl', '4.00', subcategory=self.groceries)
+        self.groceries.delete()
+        self.assertEqual(
+            ExpenseRollup.objects.filter(user=self.user, period='day', subcategory__isnull=True).get().count, 2
+        )
+        self.assertRollupsMatchRebuild()
+
+
+class SnapshotTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(EXPENSE_SNAPSHOT_DIR=Path(directory.name))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.add_expense(date(2024, 1, 1), 'Lidl', '10.00')
+
+    def test_refresh_rebuilds_only_after_a_committed_write(self):
+        self.assertEqual(refresh_snapshot(self.user), 1)
+        self.assertEqual(refresh_snapshot(self.user), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(date(2023, 12, 1), 'Aldi', '5.00', category=self.fun)
+        with open_snapshot(self.user) as snapshot:
+            self.assertEqual(len(snapshot), 2)
+            totals = category_totals(snapshot)
+        self.assertEqual(totals, {'Cibo': Decimal('10.00'), 'Svago': Decimal('5.00')})
+
+    def rows(self):
+        with open_snapshot(self.user, refresh=False) as snapshot:
+            vendors, subcategories = snapshot.vendors, snapshot.header['subcategory_ids']
+            return [
+                (int(pk), int(day), int(cents), vendors[vendor], None if sub < 0 else subcategories[sub])
+                for pk, day, cents, vendor, sub in zip(
+                    snapshot['id'], snapshot['day'], snapshot['cents'], snapshot['vendor'], snapshot['subcategory']
+                )
+            ]
+
+    def test_refresh_rereads_only_the_changed_months(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            feb = self.add_expense(date(2024, 2, 1), 'Coop', '7.00')
+            self.add_expense(date(2024, 3, 1), 'Esselunga', '3.00', subcategory=self.groceries)
+            apr = self.add_expense(date(2024, 4, 1), 'Aldi', '5.00')
+        refresh_snapshot(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            # A vendor-only edit leaves the rollups as they were but still marks its month
+            feb.vendor = 'Conad'
+            feb.save()
+            apr.delete()
+        with mock.patch('expenses.snapshot.build_snapshot', side_effect=AssertionError('rebuilt')):
+            self.assertEqual(refresh_snapshot(self.user), 3)
+        patched = self.rows()
+        build_snapshot(self.user)
+        self.assertEqual(self.rows(), patched)
+        self.assertEqual([row[3] for row in patched], ['Lidl', 'Conad', 'Esselunga'])
+
+
+class ImportCommandTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def write_csv(self, name, rows, encoding='utf-8'):
+        path = self.directory / name
+        with open(path, 'w', newline='', encoding=encoding) as f:
+            f.write(';'.join(CSV_COLUMNS) + '\n')
+            for row in rows:
+                f.write(';'.join(str(value) for value in row) + '\n')
+        return path
+
+    def import_csv(self, path, *args):
+        out = io.StringIO()
+        call_command('import_expenses', str(path), '--username', 'alice', *args, stdout=out)
+        return out.getvalue()
+
+    def row(self, day, vendor, amount, category='Cibo'):
+        return csv_row(day, vendor, amount, category, '', False, False, False, '')
+
+    def test_single_file_with_a_byte_order_mark(self):
+        self.import_csv(self.write_csv('bank.csv', [self.row(date(2024, 3, 1), 'Lidl', '10.00')], encoding='utf-8-sig'))
+        self.assertTrue(Expense.objects.filter(vendor='Lidl', category=self.food).exists())
+
+    def test_rows_are_numbered_alike_for_one_file_and_many(self):
+        bad = self.row(date(2024, 3, 1), 'Aldi', '5.00')
+        bad[0] = 'not a date'
+        rows = [self.row(date(2024, 3, 1), 'Lidl', '10.00'), bad, self.row(date(2024, 3, 2), 'Coop', '7.00')]
+        # The same rows again with another category: the third row is a conflict
+        changed = [rows[0], bad, self.row(date(2024, 3, 2), 'Coop', '7.00', category='Svago')]
+        self.import_csv(self.write_csv('one.csv', rows))
+        single = self.import_csv(self.write_csv('one.csv', changed))
+        self.directory.joinpath('one.csv').unlink()
+        self.write_csv('a.csv', rows)
+        self.write_csv('b.csv', changed)
+        many = self.import_csv(self.directory, '--workers', '1')
+        self.assertIn('Row 2: Invalid date format', single)
+        self.assertIn('alice row 3: 2024-03-02 Coop', single)
+        self.assertIn('a.csv row 2: Invalid date format', many)
+        self.assertIn('b.csv row 2: Invalid date format', many)
+        self.assertRegex(many, r'alice [ab]\.csv row 3: 2024-03-02 Coop')
+
+
+class ExplainQueriesTests(ExpenseTestCase):
+    def explain(self):
+        out = io.StringIO()
+        call_command('explain_queries', '--username', 'alice', '--fail-on-scan', stdout=out)
+        return out.getvalue()
+
+    def test_second_run_still_captures_queries(self):
+        self.add_expense(date(2024, 3, 1), 'Lidl', '10.00')
+        self.explain()
+        self.assertNotIn('(0 queries)', self.explain())
+
+
+class UploadImportTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, *rows):
+        lines = [';'.join(CSV_COLUMNS)] + [';'.join(str(value) for value in row) for row in rows]
+        return SimpleUploadedFile('bank.csv', ('\ufeff' + '\n'.join(lines) + '\n').encode())
+
+    def row(self, day, vendor, amount, category='Cibo', subcategory=''):
+        return csv_row(day, vendor, amount, category, subcategory, False, False, False, '')
+
+    def test_upload_is_streamed_in_chunks_into_a_result(self):
+        bad = self.row(date(2024, 3, 2), 'Aldi', '5.00')
+        bad[0] = 'not a date'
+        upload = self.upload(
+            self.row(date(2024, 3, 1), 'Caffè Nero', '2.50'), bad,
+            self.row(date(2024, 3, 3), 'Trenitalia', '19.90', category='Viaggi', subcategory='Treno'),
+        )
+        # Chunks smaller than a line, some ending inside the two bytes of "è"
+        upload.DEFAULT_CHUNK_SIZE = 7
+        result = import_upload(self.user, upload)
+        self.assertEqual((result.rows, result.created, result.skipped), (3, 2, 1))
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn('Invalid date format', result.errors[0])
+        self.assertEqual(result.new_categories, ['Viaggi'])
+        self.assertTrue(result.created_categories)
+        self.assertTrue(Expense.objects.filter(vendor='Caffè Nero', date=date(2024, 3, 1)).exists())
+        self.assertRollupsMatchRebuild()
+
+    def test_upload_view_queues_a_job_that_reports_the_result(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse('expenses:import'), {'csv_file': self.upload(self.row(date(2024, 3, 1), 'Lidl', '10.00'))},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        job_id = response.json()['job_id']
+        # The worker pool would run this after the commit
+        self.assertTrue(run_job(job_id))
+        progress = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(progress['status'], ImportJob.STATUS_DONE)
+        self.assertEqual((progress['rows_processed'], progress['created']), (1, 1))
+        self.assertFalse(ImportJob.objects.get(pk=job_id).csv_file)
+
+
+class BatchImporterTests(ExpenseTestCase):
+    def import_rows(self, *rows):
+        importer = BatchImporter(self.user)
+        for fields in rows:
+            importer.add_parsed(dict(
+                {'subcategory': '', 'exclude': False, 'indispensable': False, 'avoidable': False, 'notes': ''},
+                **fields,
+            ))
+        return importer.finish()
+
+    def test_new_identical_and_conflicting_rows(self):
+        row = {'date': date(2024, 2, 1), 'vendor': 'Lidl', 'amount': Decimal('10.00'), 'category': 'Cibo'}
+        first = self.import_rows(row)
+        self.assertEqual((first.created, first.unchanged, first.conflicts), (1, 0, 0))
+
+        again = self.import_rows(dict(row))
+        self.assertEqual((again.created, again.updated, again.unchanged, again.conflicts), (0, 0, 1, 0))
+
+        changed = self.import_rows(dict(row, category='Svago', notes='cinema'))
+        self.assertEqual((changed.created, changed.updated, changed.conflicts), (0, 1, 1))
+        self.assertEqual(changed.conflict_report[0]['changes'], {
+            'category': ['Cibo', 'Svago'], 'notes': ['', 'cinema'],
+        })
+        self.assertEqual(Expense.objects.get().category, self.fun)
+        self.assertRollupsMatchRebuild()
+
+    def test_same_subcategory_name_under_a_new_category_is_not_reported(self):
+        UserSubcategory.objects.create(user=self.user, category=self.fun, name='Spesa')
+        row = {'date': date(2024, 2, 1), 'vendor': 'Lidl', 'amount': Decimal('10.00'), 'subcategory': 'Spesa'}
+        self.import_rows(dict(row, category='Cibo'))
+        changed = self.import_rows(dict(row, category='Svago'))
+        self.assertEqual(changed.conflict_report[0]['changes'], {'category': ['Cibo', 'Svago']})
+
+
+class SearchTests(ExpenseTestCase):
+    def search(self, **params):
+        return self.client.get(reverse('expenses:search'), params)
+
+    def matches(self, value):
+        return set(search_expenses(Expense.objects.for_user(self.user), value).values_list('vendor', flat=True))
+
+    def test_triggers_keep_the_index_in_sync(self):
+        expense = self.add_expense(date(2024, 3, 1), 'Lidl', '10.00', notes='spesa settimanale')
+        Expense.objects.bulk_create([Expense(
+            user=self.user, date=date(2024, 3, 2), vendor='Coop', amount=Decimal('5.00'), category=self.food,
+        )])
+        self.assertEqual(self.matches('sett'), {'Lidl'})
+        self.assertEqual(self.matches('coop'), {'Coop'})
+        Expense.objects.filter(pk=expense.pk).update(vendor='Esselunga', notes='')
+        self.assertEqual(self.matches('lidl'), set())
+        self.assertEqual(self.matches('essel'), {'Esselunga'})
+        bulk_delete_expenses(self.user, Expense.objects.filter(vendor='Coop'))
+        self.assertEqual(self.matches('coop'), set())
+
+    def test_every_word_must_match_as_a_prefix_ignoring_accents(self):
+        self.add_expense(date(2024, 3, 1), 'Caffè Nero', '2.00', notes='colazione')
+        self.add_expense(date(2024, 3, 2), 'Caffetteria', '3.00')
+        self.assertEqual(self.matches('caffe'), {'Caffè Nero', 'Caffetteria'})
+        self.assertEqual(self.matches('caffe colaz'), {'Caffè Nero'})
+        # FTS5 syntax in the input is taken as plain words
+        self.assertEqual(self.matches('"nero*)'), {'Caffè Nero'})
+        response = self.client.get(reverse('expenses:list'), {'q': 'caffe colaz'})
+        self.assertEqual(response.context['total_count'], 1)
+        self.assertContains(response, 'Caffè Nero')
+        self.assertNotContains(response, 'Caffetteria')
+
+    def test_results_are_ranked_and_scoped_to_the_user(self):
+        self.add_expense(date(2024, 3, 1), 'Pizzeria da Mario', '20.00', notes='pizza')
+        self.add_expense(date(2024, 3, 2), 'Bar', '4.00', notes='pizza al taglio e pizza fritta')
+        bob = User.objects.create_user('bob')
+        Expense.objects.create(
+            user=bob, date=date(2024, 3, 1), vendor='Pizza Hut', amount=Decimal('9.00'),
+            category=UserCategory.objects.create(user=bob, name='Cibo'),
+        )
+        data = self.search(q='pizza').json()
+        self.assertEqual([result['vendor'] for result in data['results']], ['Bar', 'Pizzeria da Mario'])
+        self.assertEqual(self.search(q='  ').json()['count'], 0)
+
+    def test_limit_below_one_is_rejected(self):
+        for day in range(1, 4):
+            self.add_expense(date(2024, 3, day), 'Lidl', '10.00')
+        self.assertEqual(self.search(q='lidl', limit='1').json()['count'], 1)
+        for limit in ('0', '-5'):
+            self.assertEqual(self.search(q='lidl', limit=limit).status_code, 400, limit)
+
+    def test_admin_searches_usernames_and_full_text(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        lidl = self.add_expense(date(2024, 3, 1), 'Lidl', '10.00', notes='weekly shopping')
+        other = User.objects.create_user('bob')
+        UserCategory.objects.create(user=other, name='Cibo')
+        bob = Expense.objects.create(
+            user=other, date=date(2024, 3, 1), vendor='Coop', amount=Decimal('5.00'),
+            category=UserCategory.objects.get(user=other),
+        )
+        caffe = self.add_expense(date(2024, 3, 2), 'Caffè Nero', '2.00')
+        url = reverse('admin:expenses_expense_changelist')
+        # Only the full-text index folds diacritics
+        for term, expected in (('bob', [bob]), ('shop', [lidl]), ('caffe', [caffe])):
+            response = self.client.get(url, {'q': term})
+            self.assertEqual(list(response.context['cl'].result_list), expected, term)
+
+
+class AnalyticsTests(ExpenseTestCase):
+    def chart_data(self, **params):
+        params = dict({'start': '2024-03-01', 'end': '2024-03-31'}, **params)
+        response = self.client.get(reverse('expenses:chart-data'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_same_named_subcategories_are_separate_series(self):
+        leisure_shopping = UserSubcategory.objects.create(user=self.user, category=self.fun, name='Spesa')
+        self.add_expense(date(2024, 3, 1), 'Lidl', '10.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 3, 2), 'Zara', '30.00', category=self.fun, subcategory=leisure_shopping)
+        data = self.chart_data(group_by='subcategory')
+        self.assertEqual(
+            [(series['name'], series['totals']) for series in data['series']],
+            [('Svago > Spesa', [30.0]), ('Cibo > Spesa', [10.0])],
+        )
+        self.assertEqual(build_series(self.user, date(2024, 3, 1), date(2024, 3, 31), group_by='subcategory'), data)
+
+    def test_weekly_series_are_zero_filled_and_skip_excluded_expenses(self):
+        self.add_expense(date(2024, 3, 4), 'Lidl', '10.00')
+        self.add_expense(date(2024, 3, 6), 'Coop', '5.50', indispensable=True)
+        self.add_expense(date(2024, 3, 20), 'Cinema', '9.00', category=self.fun, avoidable=True)
+        self.add_expense(date(2024, 3, 21), 'Rimborso', '100.00', exclude=True)
+        data = self.chart_data(granularity='week', start='2024-03-04', end='2024-03-24')
+        self.assertEqual(data['periods'], ['2024-03-04', '2024-03-11', '2024-03-18'])
+        self.assertEqual(
+            [(series['name'], series['totals'], series['counts']) for series in data['series']],
+            [('Cibo', [15.5, 0.0, 0.0], [2, 0, 0]), ('Svago', [0.0, 0.0, 9.0], [0, 0, 1])],
+        )
+        self.assertEqual(data['grand_total'], 24.5)
+
+        flags = self.chart_data(group_by='flags', granularity='month', include_excluded='1')
+        self.assertEqual({series['name']: series['totals'] for series in flags['series']}, {
+            'Unflagged': [110.0], 'Indispensable': [5.5], 'Avoidable': [9.0],
+        })
+
+    def test_invalid_parameters_are_rejected(self):
+        url = reverse('expenses:chart-data')
+        for params in ({'granularity': 'hour'}, {'group_by': 'vendor'}, {'start': '2024-13-01'},
+                       {'start': '2024-03-02', 'end': '2024-03-01'}, {'start': '2000-01-01', 'end': '2024-01-01'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+
+class ExportTests(ExpenseTestCase):
+    fields = ('date', 'vendor', 'amount', 'category__name', 'subcategory__name', 'exclude', 'indispensable',
+              'avoidable', 'notes')
+
+    def test_csv_export_imports_back_unchanged(self):
+        self.add_expense(date(2024, 3, 1), 'Lidl', '1234.50', subcategory=self.groceries, indispensable=True)
+        self.add_expense(date(2024, 3, 2), 'Cinema; "Odeon"', '9.00', category=self.fun, avoidable=True,
+                         exclude=True, notes='con Marta; 2 biglietti')
+        expected = list(Expense.objects.order_by('date').values_list(*self.fields))
+        response = self.client.get(reverse('expenses:export'), {'format': 'csv'})
+        content = b''.join(response.streaming_content).decode()
+        header, *rows = list(csv.reader(io.StringIO(content), delimiter=';'))
+        flag_columns = header.index('EVITABILE') + 1
+        self.assertEqual({value for row in rows for value in row[2:flag_columns]}, {'TRUE', 'FALSE'})
+
+        Expense.objects.all().delete()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'export.csv'
+        path.write_text(content, encoding='utf-8')
+        call_command('import_expenses', str(path), '--username', 'alice', stdout=io.StringIO())
+        self.assertEqual(list(Expense.objects.order_by('date').values_list(*self.fields)), expected)
+        self.assertRollupsMatchRebuild()
+
+    def test_jsonl_export_streams_the_filtered_expenses_of_the_user(self):
+        self.add_expense(date(2024, 3, 1), 'Lidl', '10.00', subcategory=self.groceries)
+        self.add_expense(date(2024, 4, 1), 'Coop', '7.00')
+        bob = User.objects.create_user('bob')
+        Expense.objects.create(
+            user=bob, date=date(2024, 3, 5), vendor='Aldi', amount=Decimal('3.00'),
+            category=UserCategory.objects.create(user=bob, name='Cibo'),
+        )
+        response = self.client.get(reverse('expenses:export'), {'format': 'jsonl', 'date_before': '2024-03-31'})
+        self.assertTrue(response.streaming)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(line['vendor'], line['amount'], line['subcategory']) for line in lines],
+                         [('Lidl', '10.00', 'Spesa')])
+        self.assertEqual(self.client.get(reverse('expenses:export'), {'format': 'xml'}).status_code, 400)
+
+
+class RequestTimingTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        templates = [dict(settings.TEMPLATES[0], BACKEND='expenses.instrumentation.TimedDjangoTemplates')]
+        overrides = override_settings(
+            REQUEST_TIMING=True, TEMPLATES=templates,
+            MIDDLEWARE=['expenses.instrumentation.RequestTimingMiddleware', *settings.MIDDLEWARE],
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # expenses.signals.time_queries only installs it on new connections
+        connection.execute_wrappers.append(time_query)
+        self.addCleanup(connection.execute_wrappers.remove, time_query)
+        timings.clear()
+        self.addCleanup(timings.clear)
+        self.add_expense(date(2024, 3, 1), 'Lidl', '10.00')
+
+    def test_server_timing_header_log_line_and_window(self):
+        with self.assertLogs('expenses.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('expenses:list'))
+            self.client.get(reverse('expenses:calendar'))
+            self.client.get('/no-such-page/')
+        sql, template = re.match(
+            r'sql;dur=[\d.]+;desc="(\d+) queries", tpl;dur=([\d.]+);desc="templates", app;dur=[\d.]+;desc="python", '
+            r'total;dur=[\d.]+$',
+            response['Server-Timing'],
+        ).groups()
+        self.assertGreater(int(sql), 0)
+        self.assertGreater(float(template), 0)
+
+        timing = logs.records[0].timing
+        self.assertEqual(
+            (timing['url_name'], timing['status'], timing['user_id']), ('expenses:list', 200, self.user.pk)
+        )
+        self.assertEqual(timing['queries'], int(sql))
+        self.assertEqual(
+            sorted(row['url_name'] for row in timings.summary()), ['<unresolved>', 'expenses:calendar', 'expenses:list']
+        )
+
+    def test_timings_page_is_for_staff(self):
+        url = reverse('expenses:timings')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(reverse('expenses:list'))
+        rows = self.client.get(url, {'format': 'json'}).json()['timings']
+        # The redirect answered before the user was staff is in the window too
+        self.assertEqual(
+            {row['url_name']: row['requests'] for row in rows}, {'expenses:list': 1, 'expenses:timings': 1}
+        )
+
+    def test_percentiles(self):
+        self.assertEqual(percentiles([]), {'p50': 0.0, 'p95': 0.0, 'p99': 0.0})
+        self.assertEqual(percentiles([0.25]), {'p50': 250.0, 'p95': 250.0, 'p99': 250.0})
+        cuts = percentiles([i / 1000 for i in range(100, 0, -1)])
+        self.assertAlmostEqual(cuts['p50'], 50.5)
+        self.assertAlmostEqual(cuts['p95'], 95.05)
+        self.assertAlmostEqual(cuts['p99'], 99.01)
+
+
+def _busy(seconds):
+    # Python frames on the stack for the sampler to see
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class ProfilingTests(ExpenseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        overrides = override_settings(PROFILE_DIR=self.directory, PROFILE_SLOW_MS=20, PROFILE_SAMPLE_RATE=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_only_slow_blocks_are_saved_with_their_queries(self):
+        with profiled('fast'):
+            pass
+        with profiled('import-job', self.user.pk) as block:
+            block.extra = {'job_id': 7}
+            list(Expense.objects.all())
+            _busy(0.1)
+        [meta] = list_profiles()
+        self.assertEqual(
+            (meta['name'], meta['user_id'], meta['job_id'], meta['queries'], meta['reason']),
+            ('import-job', self.user.pk, 7, 1, 'slow'),
+        )
+        self.assertGreater(meta['samples'], 0)
+        stats = pstats.Stats(meta['stats_path'])
+        self.assertTrue(any(func[2] == '_busy' for func in stats.stats))
+
+        out = io.StringIO()
+        call_command('show_profiles', meta['id'][:20], '--top', '5', stdout=out)
+        self.assertIn('_busy', out.getvalue())
+
+    def test_middleware_names_the_profile_after_the_view(self):
+        request = RequestFactory().get(reverse('expenses:calendar'))
+        request.resolver_match = resolve(request.path)
+        request._cached_user = self.user
+
+        def slow_view(request):
+            _busy(0.1)
+            return HttpResponse()
+
+        ProfilingMiddleware(slow_view)(request)
+        [meta] = list_profiles(self.directory)
+        self.assertEqual(
+            (meta['name'], meta['user_id'], meta['path'], meta['status']),
+            ('expenses:calendar', self.user.pk, '/expenses/calendar/', 200),
+        )
+
+    def test_disabled_profiling_saves_nothing(self):
+        with override_settings(REQUEST_PROFILING=False), maybe_profiled('import-job') as block:
+            _busy(0.05)
+        self.assertEqual(block.name, 'import-job')
+        self.assertEqual(list_profiles(), [])
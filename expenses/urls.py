@@ -1,8 +1,9 @@
 from django.urls import path
 from .views import (
-    ExpenseListView, ExpenseCreateView, ExpenseCalendarView, ExpenseChartView,
-    add_category, add_subcategory, delete_expense, ExpenseUpdateView, import_expenses,
-    get_expenses_by_date
+    ExpenseListView, ExpenseCreateView, expense_calendar, ExpenseChartView, expense_chart_data,
+    add_category, add_subcategory, get_subcategories, suggest_vendor_category, delete_expense, ExpenseUpdateView, import_expenses,
+    import_job_status, get_expenses_by_date, bulk_expenses,
+    export_expenses, search_expenses_json, request_timings
 )
 
 app_name = 'expenses'
@@ -10,11 +11,19 @@ urlpatterns = [
     path('', ExpenseListView.as_view(), name='list'),
     path('add/', ExpenseCreateView.as_view(), name='add'),
     path('edit/<int:expense_id>/', ExpenseUpdateView.as_view(), name='edit'),
-    path('calendar/', ExpenseCalendarView.as_view(), name='calendar'),
+    path('calendar/', expense_calendar, name='calendar'),
     path('calendar/day/<str:date_str>/', get_expenses_by_date, name='expenses-by-date'),
     path('chart/', ExpenseChartView.as_view(), name='chart'),
+    path('chart-data/', expense_chart_data, name='chart-data'),
     path('import/', import_expenses, name='import'),
+    path('import/jobs/<int:job_id>/', import_job_status, name='import-job-status'),
     path('add-category/', add_category, name='add-category'),
     path('add-subcategory/', add_subcategory, name='add-subcategory'),
+    path('subcategories/', get_subcategories, name='subcategories'),
+    path('suggest-category/', suggest_vendor_category, name='suggest-category'),
     path('delete/<int:expense_id>/', delete_expense, name='delete'),
+    path('bulk/', bulk_expenses, name='bulk'),
+    path('export/', export_expenses, name='export'),
+    path('search/', search_expenses_json, name='search'),
+    path('timings/', request_timings, name='timings'),
 ] 
\ No newline at end of file
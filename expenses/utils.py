@@ -1,45 +1,72 @@
 import calendar
+import statistics
 from datetime import date
 from decimal import Decimal
-from django.db.models import Sum
+from django.db.models import Count, Sum
 from .models import Expense
+from .rollups import adaily_totals
 
-def get_month_calendar(year: int, month: int, user=None):
-    # Build a matrix of dates for the month, weeks start on Monday
-    cal = calendar.Calendar(firstweekday=0)
-    # Aggregate totals per date
-    if user:
-        qs = Expense.objects.for_user(user).filter(date__year=year, date__month=month)
-    else:
-        qs = Expense.objects.filter(date__year=year, date__month=month)
-    qs = qs.values('date').annotate(total=Sum('amount'))
-    totals = {item['date']: item['total'] or Decimal('0.00') for item in qs}
 
-    # Get all expenses for the month to include in calendar cells
+def percentiles(latencies):
+    """p50/p95/p99 of latencies in seconds, as milliseconds"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'p50': cuts[49] * 1000, 'p95': cuts[94] * 1000, 'p99': cuts[98] * 1000}
+
+
+class QueryCounter:
+    """
+    execute_wrapper that counts queries, e.g.
+    `with connection.execute_wrapper(counter):`. Unlike the debug query log
+    it is not reset by request_started and survives reconnects.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def add_months(year: int, month: int, count: int):
+    """(year, month) shifted by `count` months"""
+    index = year * 12 + (month - 1) + count
+    return index // 12, index % 12 + 1
+
+
+async def aget_day_totals(start: date, end: date, user=None):
+    """
+    {date: (total, count)} for days in [start, end), from a single range query.
+
+    For a user the daily rollups are read; otherwise expenses are grouped by
+    date directly. Both only fetch the date, total and count columns.
+    """
     if user:
-        all_expenses = Expense.objects.for_user(user).filter(date__year=year, date__month=month)
-    else:
-        all_expenses = Expense.objects.filter(date__year=year, date__month=month)
-    
-    # Group expenses by date
-    expenses_by_date = {}
-    for expense in all_expenses:
-        if expense.date not in expenses_by_date:
-            expenses_by_date[expense.date] = []
-        expenses_by_date[expense.date].append(expense)
+        return await adaily_totals(user, start, end)
+    qs = Expense.objects.filter(date__gte=start, date__lt=end).order_by()
+    qs = qs.values('date').annotate(total=Sum('amount'), count=Count('id'))
+    return {item['date']: (item['total'], item['count']) async for item in qs}
 
+
+def build_month_matrix(year: int, month: int, totals):
+    # Build a matrix of dates for the month, weeks start on Monday
+    cal = calendar.Calendar(firstweekday=0)
     month_matrix = []
     for week in cal.monthdatescalendar(year, month):
         week_row = []
         for dt in week:
             if dt.month == month:
+                total, count = totals.get(dt, (None, 0))
                 week_row.append({
                     'day': dt.day,
                     'date': dt,
-                    'total': totals.get(dt, Decimal('0.00')),
-                    'expenses': expenses_by_date.get(dt, [])
+                    'total': total or Decimal('0.00'),
+                    'count': count,
                 })
             else:
-                week_row.append({'day': 0, 'date': None, 'total': Decimal('0.00'), 'expenses': []})
+                week_row.append({'day': 0, 'date': None, 'total': Decimal('0.00'), 'count': 0})
         month_matrix.append(week_row)
-    return month_matrix 
\ No newline at end of file
+    return month_matrix
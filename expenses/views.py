@@ -1,74 +1,105 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import CreateView, TemplateView, UpdateView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
 from django_filters.views import FilterView
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Sum, Min, Max
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-from django.core.management import call_command
-from django.conf import settings
-import os
-import csv
-import tempfile
+from django.http import JsonResponse, StreamingHttpResponse
 from datetime import date, datetime
-from .models import Expense, UserCategory, UserSubcategory
+from asgiref.sync import sync_to_async
+from .models import Expense, ImportJob, UserCategory, UserSubcategory
 from .filters import ExpenseFilter
-from .utils import get_month_calendar
-from .forms import ExpenseForm
+from .utils import add_months
+from .forms import BulkExpenseForm, ExpenseForm
+from .bulk import bulk_delete_expenses, bulk_update_expenses
+from .export import FORMATS, iter_csv, iter_jsonl
+from .search import ranked_search
+from .categorizer import suggest_category
+from .analytics import GRANULARITIES, GROUP_BY, aget_series
+from .cache import get_category_tree, get_filtered_totals, get_subcategory_choices, get_user_summary
+from .decorators import aget_user, conditional_on_user_data
+from .instrumentation import timings
+from .jobs import job_progress, submit_import
+from .pagination import get_page_size
+from .fragments import aget_calendar_fragments, get_list_page
 
 # Create your views here.
 
+PAGE_SIZE_OPTIONS = [25, 50, 100, 250]
+MAX_CALENDAR_MONTHS = 12
+MAX_CHART_DAYS = 366 * 20
+MAX_SEARCH_RESULTS = 50
+# Calendar years whose months and the months after them are valid dates
+CALENDAR_YEARS = (1, 9998)
+
+
+def _int_param(params, name, default, lowest, highest):
+    """params[name] as an int, or default when it is missing, malformed or outside [lowest, highest]"""
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        return default
+    return value if lowest <= value <= highest else default
+
 
+@method_decorator(conditional_on_user_data, name='dispatch')
 class ExpenseListView(LoginRequiredMixin, FilterView):
     model = Expense
     template_name = 'expenses/expense_list.html'
     filterset_class = ExpenseFilter
     
     def get_queryset(self):
-        return Expense.objects.for_user(self.request.user)
+        return Expense.objects.for_user(self.request.user).select_related('category', 'subcategory')
     
     def get_filterset_queryset(self, queryset):
         # Ensure the filterset uses the user-scoped queryset
         return queryset
     
-    def get_filterset(self, queryset=None):
-        filterset = super().get_filterset(queryset)
-        if filterset:
-            # Get the actual queryset for setting filter choices
-            actual_queryset = self.get_queryset()
-            print(actual_queryset)
-        return filterset
-    
-
-    
     def get_context_data(self, **kwargs):
+        # Get the filtered queryset for the current filters
+        filtered_queryset = kwargs.pop('object_list', self.object_list)
         context = super().get_context_data(**kwargs)
+        page_size = get_page_size(self.request.GET.get('page_size'))
+        context['page_size'] = page_size
+        context['page_size_options'] = PAGE_SIZE_OPTIONS
         
-        # Get the base queryset (unfiltered) for calculating stats and choices
-        base_queryset = self.get_queryset()
+        # Query string of the current filters, for building page links
+        query = self.request.GET.copy()
+        for key in ('after', 'before'):
+            query.pop(key, None)
+        context['filter_query'] = query.urlencode()
         
-        # Get the filtered queryset for the current filters
-        filtered_queryset = context.get('object_list', base_queryset)
+        # Only one keyset page of the filtered rows is shown, rendered once per data version
+        context['list_page'] = get_list_page(self.request, filtered_queryset, page_size, context['filter_query'])
         
-        # Calculate total amount from filtered results
-        context['total_amount'] = filtered_queryset.aggregate(total=Sum('amount'))['total'] or 0
+        # Filter values that actually narrow the rows
+        params = {name: value for name, value in self.request.GET.items()
+                  if name in self.filterset.filters and value}
         
-        # Calculate min/max amounts for slider from base queryset (all available data)
-        amount_stats = base_queryset.aggregate(
-            min_amount=Min('amount'),
-            max_amount=Max('amount')
-        )
-        context['min_amount'] = amount_stats['min_amount'] or 0
-        context['max_amount'] = amount_stats['max_amount'] or 1000
+        # Stats over all of the user's data come from the cached summary
+        summary = get_user_summary(self.request.user)
+        
+        # Calculate count and total amount from filtered results, not just this page
+        if params:
+            totals = get_filtered_totals(self.request.user, filtered_queryset, params)
+        else:
+            totals = summary
+        context['total_amount'] = totals['total'] or 0
+        context['total_count'] = totals['count']
         
-        # Get unique categories and subcategories for filter dropdowns
-        context['categories'] = base_queryset.values_list('category', flat=True).distinct().order_by('category')
-        context['subcategories'] = base_queryset.exclude(subcategory='').values_list('subcategory', flat=True).distinct().order_by('subcategory')
+        # Min/max amounts for slider from all available data
+        context['min_amount'] = summary['min_amount'] or 0
+        context['max_amount'] = summary['max_amount'] or 1000
+        
+        # Unique categories and subcategories for filter dropdowns
+        context['categories'] = summary['categories']
+        context['subcategories'] = summary['subcategories']
 
         return context
 
@@ -89,39 +120,37 @@ class ExpenseCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class ExpenseCalendarView(LoginRequiredMixin, TemplateView):
-    template_name = 'expenses/calendar.html'
+@conditional_on_user_data
+async def expense_calendar(request):
+    """Month calendar of daily totals; async so it holds no worker thread while querying"""
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
 
-    def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        today = date.today()
-        year  = int(self.request.GET.get('year', today.year))
-        month = int(self.request.GET.get('month', today.month))
-        
-        # Calculate previous month/year
-        if month == 1:
-            prev_month = 12
-            prev_year = year - 1
-        else:
-            prev_month = month - 1
-            prev_year = year
-        
-        # Calculate next month/year
-        if month == 12:
-            next_month = 1
-            next_year = year + 1
-        else:
-            next_month = month + 1
-            next_year = year
-        
-        ctx['calendar'] = get_month_calendar(year, month, self.request.user)
-        ctx['year'] = year
-        ctx['month'] = month
-        ctx['prev_year'] = prev_year
-        ctx['prev_month'] = prev_month
-        ctx['next_year'] = next_year
-        ctx['next_month'] = next_month
-        return ctx
+    today = date.today()
+    year = _int_param(request.GET, 'year', today.year, *CALENDAR_YEARS)
+    month = _int_param(request.GET, 'month', today.month, 1, 12)
+    # Number of consecutive months to show, e.g. 3 for a quarter
+    months = _int_param(request.GET, 'months', 1, 1, MAX_CALENDAR_MONTHS)
+    
+    # Previous/next move by the number of months shown
+    prev_year, prev_month = add_months(year, month, -months)
+    next_year, next_month = add_months(year, month, months)
+    
+    # Rendered week rows, cached per month until one of its expenses changes
+    calendars = await aget_calendar_fragments(user, year, month, months)
+    ctx = {
+        'calendars': calendars,
+        'year': year,
+        'month': month,
+        'months': months,
+        'prev_year': prev_year,
+        'prev_month': prev_month,
+        'next_year': next_year,
+        'next_month': next_month,
+    }
+    # Context processors read the session (messages), so rendering runs in a thread
+    return await sync_to_async(render)(request, 'expenses/calendar.html', ctx)
 
 
 class ExpenseChartView(LoginRequiredMixin, TemplateView):
@@ -129,11 +158,43 @@ class ExpenseChartView(LoginRequiredMixin, TemplateView):
     
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        # For now, just return empty context
-        # Later we can add chart data here
+        # Chart data is fetched by the page from expense_chart_data
         return ctx
 
 
+@conditional_on_user_data
+async def expense_chart_data(request):
+    """Time series of expense totals as JSON for the chart page"""
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    today = date.today()
+    granularity = request.GET.get('granularity', 'month')
+    group_by = request.GET.get('group_by', 'category')
+    if granularity not in GRANULARITIES:
+        return JsonResponse({'error': f'granularity must be one of {", ".join(GRANULARITIES)}'}, status=400)
+    if group_by not in GROUP_BY:
+        return JsonResponse({'error': f'group_by must be one of {", ".join(GROUP_BY)}'}, status=400)
+    
+    try:
+        # Default to the last twelve whole months including the current one
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if request.GET.get('end') else today
+        if request.GET.get('start'):
+            start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+        else:
+            start = date(*add_months(end.year, end.month, -11), 1)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date format'}, status=400)
+    if start > end:
+        return JsonResponse({'error': 'start must not be after end'}, status=400)
+    if (end - start).days > MAX_CHART_DAYS:
+        return JsonResponse({'error': f'Date range is limited to {MAX_CHART_DAYS} days'}, status=400)
+    
+    include_excluded = request.GET.get('include_excluded') in ('1', 'true', 'yes')
+    return JsonResponse(await aget_series(user, start, end, granularity, group_by, include_excluded))
+
+
 def add_category(request):
     if request.method == 'POST':
         name = request.POST.get('name', '').strip()
@@ -176,6 +237,34 @@ def add_subcategory(request):
     return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
 
+def get_subcategories(request):
+    """Subcategories of one category (by name) as JSON, for the expense form's dependent select"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    category_name = request.GET.get('category', '').strip()
+    subcategories = get_subcategory_choices(request.user, category_name) if category_name else []
+    return JsonResponse({
+        'category': category_name,
+        'subcategories': [{'id': pk, 'name': name} for pk, name in subcategories],
+    })
+
+
+def suggest_vendor_category(request):
+    """Category and subcategory names the user most often files `vendor` under, as JSON"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    vendor = request.GET.get('vendor', '').strip()
+    suggestion = suggest_category(request.user, vendor)
+    category = subcategory = None
+    if suggestion:
+        tree = get_category_tree(request.user)
+        category = dict(tree['categories']).get(suggestion[0])
+        subcategory = dict(tree['subcategories'].get(suggestion[0], [])).get(suggestion[1])
+    return JsonResponse({'vendor': vendor, 'category': category, 'subcategory': subcategory})
+
+
 class UserRegistrationView(CreateView):
     form_class = UserCreationForm
     template_name = 'registration/register.html'
@@ -201,6 +290,97 @@ def delete_expense(request, expense_id):
         return redirect('expenses:list')
 
 
+def search_expenses_json(request):
+    """Best matches for `q` in vendor and notes as JSON, for search-as-you-type"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 20)), MAX_SEARCH_RESULTS)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if limit < 1:
+        # SQLite reads a negative LIMIT as no limit at all
+        return JsonResponse({'error': 'limit must be at least 1'}, status=400)
+    
+    results = []
+    for expense in ranked_search(request.user, query, limit):
+        results.append({
+            'id': expense.id,
+            'vendor': expense.vendor,
+            'amount': str(expense.amount),
+            'category': expense.category.name,
+            'subcategory': expense.subcategory.name if expense.subcategory else '',
+            'notes': expense.notes,
+            'date': expense.date.strftime('%Y-%m-%d')
+        })
+    return JsonResponse({'q': query, 'results': results, 'count': len(results)})
+
+
+def export_expenses(request):
+    """Stream the user's expenses matching the ExpenseFilter parameters as CSV or JSON Lines"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        return JsonResponse({'error': f'format must be one of {", ".join(FORMATS)}'}, status=400)
+    
+    expense_filter = ExpenseFilter(request.GET, queryset=Expense.objects.for_user(request.user), request=request)
+    if not expense_filter.is_valid():
+        return JsonResponse({'error': 'Invalid filter', 'errors': expense_filter.errors}, status=400)
+    
+    if export_format == 'csv':
+        response = StreamingHttpResponse(iter_csv(expense_filter.qs), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(iter_jsonl(expense_filter.qs), content_type='application/x-ndjson')
+    filename = f'expenses-{date.today().isoformat()}.{export_format}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def bulk_expenses(request):
+    """
+    Update or delete many expenses in one request. Rows are selected by
+    `ids` (repeated or comma separated) or else by ExpenseFilter parameters.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    
+    form = BulkExpenseForm(request.POST, user=request.user)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Invalid bulk request', 'errors': form.errors}, status=400)
+    
+    queryset = Expense.objects.for_user(request.user)
+    try:
+        ids = [int(value) for item in request.POST.getlist('ids') for value in item.split(',') if value.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be integers'}, status=400)
+    if ids:
+        queryset = queryset.filter(id__in=ids)
+    else:
+        expense_filter = ExpenseFilter(request.POST, queryset=queryset, request=request)
+        params = [name for name in expense_filter.filters if request.POST.get(name)]
+        if not params:
+            return JsonResponse({'error': 'Select expenses by ids or filter parameters'}, status=400)
+        if not expense_filter.is_valid():
+            return JsonResponse({'error': 'Invalid filter', 'errors': expense_filter.errors}, status=400)
+        queryset = expense_filter.qs
+    
+    action = form.cleaned_data['action']
+    if action == BulkExpenseForm.ACTION_DELETE:
+        return JsonResponse({'action': action, 'deleted': bulk_delete_expenses(request.user, queryset)})
+    changes = form.get_changes()
+    return JsonResponse({
+        'action': action,
+        'updated': bulk_update_expenses(request.user, queryset, changes),
+        'fields': sorted(changes),
+    })
+
+
 class ExpenseUpdateView(LoginRequiredMixin, UpdateView):
     model = Expense
     form_class = ExpenseForm
@@ -209,7 +389,10 @@ class ExpenseUpdateView(LoginRequiredMixin, UpdateView):
     
     def get_object(self, queryset=None):
         """Get the expense object, ensuring it belongs to the current user"""
-        return get_object_or_404(Expense, id=self.kwargs['expense_id'], user=self.request.user)
+        return get_object_or_404(
+            Expense.objects.select_related('category', 'subcategory'),
+            id=self.kwargs['expense_id'], user=self.request.user
+        )
     
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -229,7 +412,7 @@ class ExpenseUpdateView(LoginRequiredMixin, UpdateView):
 
 
 def import_expenses(request):
-    """Handle CSV file upload and import expenses"""
+    """Handle CSV file upload and queue it as a background import job"""
     if request.method == 'POST':
         if 'csv_file' not in request.FILES:
             messages.error(request, 'Please select a CSV file to upload.')
@@ -243,66 +426,62 @@ def import_expenses(request):
             return render(request, 'expenses/import_expenses.html')
         
         try:
-            # Save the uploaded file temporarily
-            file_path = default_storage.save(f'temp_imports/{csv_file.name}', ContentFile(csv_file.read()))
-            full_path = os.path.join(settings.MEDIA_ROOT, file_path)
-            
-            # Call the management command and capture output
-            from io import StringIO
-            from django.core.management import call_command
-            
-            output = StringIO()
-            call_command('import_expenses', full_path, username=request.user.username, stdout=output)
-            
-            # Clean up the temporary file
-            default_storage.delete(file_path)
-            
-            # Get the command output
-            command_output = output.getvalue()
-            output.close()
-            
-            # Check if categories/subcategories were created
-            if 'Created new category:' in command_output or 'Created new subcategory:' in command_output:
-                messages.success(request, 'Expenses imported successfully! New categories and subcategories were automatically created.')
-            else:
-                messages.success(request, 'Expenses imported successfully!')
-            
-            return redirect('expenses:list')
-            
+            # Store the upload on a job row; the import itself runs in the worker pool
+            job = submit_import(request.user, csv_file)
         except Exception as e:
-            # Clean up the temporary file if it exists
-            if 'file_path' in locals():
-                default_storage.delete(file_path)
-            
             messages.error(request, f'Error importing expenses: {str(e)}')
             return render(request, 'expenses/import_expenses.html')
+        
+        status_url = reverse('expenses:import-job-status', args=[job.id])
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'job_id': job.id, 'status_url': status_url}, status=202)
+        
+        messages.info(request, f'Import of "{job.filename}" started. You can follow its progress below.')
+        return redirect(f"{reverse('expenses:import')}?job={job.id}")
     
-    return render(request, 'expenses/import_expenses.html')
+    job = None
+    job_id = request.GET.get('job')
+    if job_id and job_id.isdigit():
+        job = ImportJob.objects.filter(id=job_id, user=request.user).first()
+    return render(request, 'expenses/import_expenses.html', {'job': job})
 
 
-def get_expenses_by_date(request, date_str):
-    """Get expenses for a specific date via AJAX"""
+def import_job_status(request, job_id):
+    """Report progress of an import job as JSON for polling"""
     if not request.user.is_authenticated:
         return JsonResponse({'error': 'Authentication required'}, status=401)
     
+    job = get_object_or_404(ImportJob, id=job_id, user=request.user)
+    return JsonResponse(job_progress(job))
+
+
+@conditional_on_user_data
+async def get_expenses_by_date(request, date_str):
+    """Get expenses for a specific date via AJAX"""
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    
     try:
         # Parse the date string
         expense_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
         # Get expenses for the user on that date
-        expenses = Expense.objects.for_user(request.user).filter(date=expense_date)
+        expenses = Expense.objects.for_user(user).filter(date=expense_date).values(
+            'id', 'vendor', 'amount', 'category__name', 'subcategory__name', 'notes', 'date'
+        )
         
         # Serialize expenses for JSON response
         expense_data = []
-        for expense in expenses:
+        async for expense in expenses:
             expense_data.append({
-                'id': expense.id,
-                'vendor': expense.vendor,
-                'amount': str(expense.amount),
-                'category': expense.category,
-                'subcategory': expense.subcategory,
-                'notes': expense.notes,
-                'date': expense.date.strftime('%Y-%m-%d')
+                'id': expense['id'],
+                'vendor': expense['vendor'],
+                'amount': str(expense['amount']),
+                'category': expense['category__name'],
+                'subcategory': expense['subcategory__name'] or '',
+                'notes': expense['notes'],
+                'date': expense['date'].strftime('%Y-%m-%d')
             })
         
         return JsonResponse({
@@ -315,3 +494,19 @@ def get_expenses_by_date(request, date_str):
         return JsonResponse({'error': 'Invalid date format'}, status=400)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@staff_member_required
+def request_timings(request):
+    """Per-URL-name latency percentiles collected by RequestTimingMiddleware in this process"""
+    if request.method == 'POST':
+        timings.clear()
+        return redirect('expenses:timings')
+    context = {
+        'enabled': settings.REQUEST_TIMING,
+        'window': settings.REQUEST_TIMING_WINDOW,
+        'timings': timings.summary(),
+    }
+    if request.GET.get('format') == 'json':
+        return JsonResponse(context)
+    return render(request, 'expenses/request_timings.html', context)
@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from decouple import config
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -68,18 +71,131 @@ TEMPLATES = [
     },
 ]
 
+# Per-request timing (expenses.instrumentation): query count, SQL, template and
+# total time in a Server-Timing header and an INFO log line per request, and
+# p50/p95/p99 per URL name over the last REQUEST_TIMING_WINDOW requests at
+# /expenses/timings/ (staff only). Off unless REQUEST_TIMING=True.
+REQUEST_TIMING = config('REQUEST_TIMING', default=False, cast=bool)
+REQUEST_TIMING_WINDOW = config('REQUEST_TIMING_WINDOW', default=1000, cast=int)
+
+if REQUEST_TIMING:
+    MIDDLEWARE.insert(0, 'expenses.instrumentation.RequestTimingMiddleware')
+    TEMPLATES[0]['BACKEND'] = 'expenses.instrumentation.TimedDjangoTemplates'
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'console': {'class': 'logging.StreamHandler'},
+        },
+        'loggers': {
+            'expenses.instrumentation': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+# Sampling profiler (expenses.profiling): the stack of each request, and of each
+# import job, is sampled every PROFILE_INTERVAL_MS. The samples are saved to
+# PROFILE_DIR when it took PROFILE_SLOW_MS or longer, or for one request in
+# PROFILE_SAMPLE_RATE (0: none). The newest PROFILE_KEEP profiles are kept;
+# read them with the show_profiles command. Off unless REQUEST_PROFILING=True.
+REQUEST_PROFILING = config('REQUEST_PROFILING', default=False, cast=bool)
+PROFILE_DIR = Path(config('PROFILE_DIR', default=str(BASE_DIR / 'profiles')))
+PROFILE_SLOW_MS = config('PROFILE_SLOW_MS', default=1000, cast=int)
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0, cast=int)
+PROFILE_INTERVAL_MS = config('PROFILE_INTERVAL_MS', default=10, cast=float)
+PROFILE_KEEP = config('PROFILE_KEEP', default=500, cast=int)
+
+if REQUEST_PROFILING:
+    MIDDLEWARE.insert(0, 'expenses.profiling.ProfilingMiddleware')
+
 WSGI_APPLICATION = 'finance_tracker.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# Chosen from the environment (or a .env file): DB_ENGINE=sqlite (default) or
+# postgresql. DB_CONN_MAX_AGE keeps connections open between requests; use 0
+# when serving through ASGI or when PgBouncer does the pooling.
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='finance_tracker'),
+            'USER': config('DB_USER', default='finance_tracker'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            # Persistent connections are pinged before reuse instead of failing the request
+            'CONN_HEALTH_CHECKS': True,
+            # Transaction-mode PgBouncer cannot keep the server-side cursors used by iterator()
+            'DISABLE_SERVER_SIDE_CURSORS': config('DB_PGBOUNCER', default=False, cast=bool),
+        }
+    }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0, cast=int),
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before 'database is locked'
+                'timeout': config('DB_SQLITE_TIMEOUT', default=20, cast=int),
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f'DB_ENGINE must be sqlite or postgresql, not {DB_ENGINE!r}')
+
+# Pragmas run on every new SQLite connection (expenses.signals.configure_sqlite).
+# WAL lets readers run while one writer commits, NORMAL only syncs at checkpoints
+# in WAL mode, and mmap serves reads from the page cache without copying.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': config('DB_SQLITE_TIMEOUT', default=20, cast=int) * 1000,
+    'mmap_size': config('DB_SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    'temp_store': 'MEMORY',
+} if config('DB_SQLITE_TUNING', default=True, cast=bool) else {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Cached pages and summaries are invalidated by bumping version keys in this
+# cache, from whichever process wrote the data (a web worker, an import job
+# thread, a management command), so every process must share it. Chosen from
+# the environment: CACHE_BACKEND=file (default, a directory shared by the
+# processes of one host), db (run createcachetable first), redis or memcached
+# (CACHE_LOCATION is the server URL or address). locmem is per process and only
+# fits a single process that is also the only writer, e.g. the test runner.
+
+CACHE_BACKENDS = {
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+}
+CACHE_BACKEND = config('CACHE_BACKEND', default='file')
+CACHE_DEFAULT_LOCATIONS = {
+    'file': str(BASE_DIR / 'cache'),
+    'db': 'finance_tracker_cache',
+    'redis': 'redis://127.0.0.1:6379',
+    'memcached': '127.0.0.1:11211',
+    'locmem': 'finance-tracker',
+}
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_DEFAULT_LOCATIONS[CACHE_BACKEND]),
     }
 }
+if CACHE_BACKEND in ('file', 'db', 'locmem'):
+    # Django culls these at 300 entries; calendar week rows alone are several per user and month
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=20000, cast=int)}
 
 
 # Password validation
@@ -122,6 +238,16 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Background CSV imports (expenses.jobs). A running job refreshes its heartbeat
+# every IMPORT_JOB_HEARTBEAT seconds; after IMPORT_JOB_STALE_AFTER seconds
+# without one, process_import_jobs treats its process as gone and reruns it.
+IMPORT_JOB_WORKERS = 2
+IMPORT_JOB_HEARTBEAT = 10
+IMPORT_JOB_STALE_AFTER = 60
+
+# Columnar analytics snapshots (expenses.snapshot)
+EXPENSE_SNAPSHOT_DIR = BASE_DIR / 'snapshots'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 